@@ -1,7 +1,7 @@
 """
 extract factors the build is dependent on:
 [X] compute capability
-    [ ] TODO: Q - What if we have multiple GPUs of different makes?
+    [X] multiple GPUs of different makes, a binary is picked per device (see probe.choose_binary)
 - CUDA version
 - Software:
     - CPU-only: only CPU quantization functions (no optimizer, no matrix multiple)
@@ -17,8 +17,10 @@ evaluation:
 """
 
 import ctypes
+import os
 
 from .paths import determine_cuda_runtime_lib_path
+from .probe import choose_binary, compute_capability_value, driver_present, probe
 
 
 def check_cuda_result(cuda, result_val):
@@ -103,9 +105,8 @@ def get_compute_capability(cuda):
     None.
     """
     ccs = get_compute_capabilities(cuda)
-    if ccs is not None:
-        # TODO: handle different compute capabilities; for now, take the max
-        return ccs[-1]
+    if ccs:
+        return max(ccs, key=compute_capability_value)
     return None
 
 
@@ -115,12 +116,14 @@ def evaluate_cuda_setup():
     print('Welcome to bitsandbytes. For bug reports, please submit your error trace to: https://github.com/TimDettmers/bitsandbytes/issues')
     print('For effortless bug reporting copy-paste your error into this form: https://docs.google.com/forms/d/e/1FAIpQLScPB8emS3Thkp66nvqwmjTEgxp8Y9ufuWTzFyr9kJ5AoI47dQ/viewform?usp=sf_link')
     print('='*80)
-    return "libbitsandbytes_cudaall.dll"            # $$$
-    
+    if os.name == "nt":
+        # the windows install only ships libbitsandbytes_cudaall.dll, which is built for every compute capability
+        return "libbitsandbytes_cudaall.dll"
+
     binary_name = "libbitsandbytes_cpu.so"
-    #if not torch.cuda.is_available():
-        #print('No GPU detected. Loading CPU library...')
-        #return binary_name
+    if not driver_present():
+        print('CUDA SETUP: No CUDA driver found, loading the CPU-only library...')
+        return binary_name
 
     cudart_path = determine_cuda_runtime_lib_path()
     if cudart_path is None:
@@ -130,20 +133,17 @@ def evaluate_cuda_setup():
         return binary_name
 
     print(f"CUDA SETUP: CUDA runtime path found: {cudart_path}")
-    cuda = get_cuda_lib_handle()
-    cc = get_compute_capability(cuda)
-    print(f"CUDA SETUP: Highest compute capability among GPUs detected: {cc}")
-    cuda_version_string = get_cuda_version(cuda, cudart_path)
-
-
-    if cc == '':
+    # the driver, runtime and devices are only probed again when the driver or CUDA libraries change
+    result = probe(cudart_path)
+    if not result["devices"]:
         print(
             "WARNING: No GPU detected! Check your CUDA paths. Processing to load CPU-only library..."
         )
         return binary_name
-
-    # 7.5 is the minimum CC vor cublaslt
-    has_cublaslt = cc in ["7.5", "8.0", "8.6"]
+    cuda_version_string = result["cuda_version"]
+    if cuda_version_string is None:
+        print("WARNING: Could not read the CUDA runtime version! Loading CPU-only library...")
+        return binary_name
 
     # TODO:
     # (1) CUDA missing cases (no CUDA installed by CUDA driver (nvidia-smi accessible)
@@ -152,15 +152,7 @@ def evaluate_cuda_setup():
     # we use ls -l instead of nvcc to determine the cuda version
     # since most installations will have the libcudart.so installed, but not the compiler
     print(f'CUDA SETUP: Detected CUDA version {cuda_version_string}')
+    if int(cuda_version_string[:-1]) < 11:
+        print('CUDA SETUP: CUDA version lower than 11 are currently not supported for LLM.int8(). You will be only to use 8-bit optimizers and quantization routines!!')
 
-    def get_binary_name():
-        "if not has_cublaslt (CC < 7.5), then we have to choose  _nocublaslt.so"
-        bin_base_name = "libbitsandbytes_cuda"
-        if has_cublaslt:
-            return f"{bin_base_name}{cuda_version_string}.so"
-        else:
-            return f"{bin_base_name}{cuda_version_string}_nocublaslt.so"
-
-    binary_name = get_binary_name()
-
-    return binary_name
+    return choose_binary(result)
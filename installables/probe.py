@@ -0,0 +1,188 @@
+"""
+Detects the CUDA driver, runtime version and every GPU once, and caches the result on disk.
+
+The cache is keyed on the driver version and the mtime/size of the driver and runtime libraries,
+so it only gets redone after a driver or CUDA install changes. Every function that talks to CUDA
+takes the ctypes handles as arguments, so they can be tested with mocked handles.
+"""
+
+import ctypes
+import json
+import os
+
+CACHE_PATH = os.path.join(os.path.expanduser("~"), ".cache", "bitsandbytes", "cuda_probe.json")
+CACHE_VERSION = 1
+
+DRIVER_NAME = "nvcuda.dll" if os.name == "nt" else "libcuda.so"
+DRIVER_CANDIDATES = [
+    "/usr/lib/x86_64-linux-gnu/libcuda.so.1",
+    "/usr/lib64/libcuda.so.1",
+    "/usr/lib/wsl/lib/libcuda.so.1",
+    os.path.join(os.environ.get("SystemRoot", r"C:\Windows"), "System32", "nvcuda.dll"),
+]
+DRIVER_VERSION_FILE = "/proc/driver/nvidia/version"
+
+
+def check_cuda_result(cuda, result_val):
+    if result_val != 0:
+        error_str = ctypes.c_char_p()
+        cuda.cuGetErrorString(result_val, ctypes.byref(error_str))
+        print(f"CUDA exception! Error code: {error_str.value.decode() if error_str.value else result_val}")
+        return False
+    return True
+
+
+def find_driver_paths():
+    paths = [path for path in DRIVER_CANDIDATES if os.path.exists(path)]
+    for folder in os.environ.get("LD_LIBRARY_PATH", "").split(os.pathsep):
+        path = os.path.join(folder, "libcuda.so.1")
+        if folder and os.path.exists(path):
+            paths.append(path)
+    return paths
+
+
+def driver_present():
+    # checked before touching ctypes so CPU-only hosts bail out right away
+    return bool(find_driver_paths()) or os.path.exists(DRIVER_VERSION_FILE)
+
+
+def cache_key(cudart_path):
+    key = {"version": CACHE_VERSION, "visible_devices": os.environ.get("CUDA_VISIBLE_DEVICES"), "files": []}
+    for path in find_driver_paths() + ([cudart_path] if cudart_path else []):
+        try:
+            stat = os.stat(path)
+            key["files"].append([str(path), stat.st_mtime, stat.st_size])
+        except OSError:
+            key["files"].append([str(path), None, None])
+    try:
+        with open(DRIVER_VERSION_FILE) as f:
+            key["driver_version"] = f.readline().strip()
+    except OSError:
+        key["driver_version"] = None
+    return key
+
+
+def load_cache(key, cache_path=CACHE_PATH):
+    try:
+        with open(cache_path) as f:
+            cached = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if cached.get("key") != key:
+        return None
+    return cached.get("result")
+
+
+def save_cache(key, result, cache_path=CACHE_PATH):
+    try:
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+        tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"key": key, "result": result}, f, indent=4)
+        os.replace(tmp_path, cache_path)
+    except OSError as e:
+        print(f"CUDA SETUP: could not write the probe cache to {cache_path}: {e}")
+
+
+def load_driver():
+    try:
+        cuda = ctypes.CDLL(DRIVER_NAME)
+    except OSError:
+        return None
+    if not check_cuda_result(cuda, cuda.cuInit(0)):
+        return None
+    return cuda
+
+
+def load_runtime(cudart_path):
+    try:
+        return ctypes.CDLL(cudart_path)
+    except OSError:
+        print(f'ERROR: libcudart.so could not be read from path: {cudart_path}!')
+        return None
+
+
+def probe_runtime_version(cuda, cudart):
+    # returns the runtime version in the format the binaries are named with, 11.7 -> "117"
+    version = ctypes.c_int()
+    if not check_cuda_result(cuda, cudart.cudaRuntimeGetVersion(ctypes.byref(version))):
+        return None
+    version = int(version.value)
+    major = version // 1000
+    minor = (version - (major * 1000)) // 10
+    return f"{major}{minor}"
+
+
+def probe_devices(cuda):
+    count = ctypes.c_int()
+    if not check_cuda_result(cuda, cuda.cuDeviceGetCount(ctypes.byref(count))):
+        return []
+    devices = []
+    for i in range(count.value):
+        device = ctypes.c_int()
+        cc_major = ctypes.c_int()
+        cc_minor = ctypes.c_int()
+        total_memory = ctypes.c_size_t()
+        name = ctypes.create_string_buffer(256)
+        if not check_cuda_result(cuda, cuda.cuDeviceGet(ctypes.byref(device), i)):
+            continue
+        check_cuda_result(cuda, cuda.cuDeviceComputeCapability(ctypes.byref(cc_major), ctypes.byref(cc_minor), device))
+        check_cuda_result(cuda, cuda.cuDeviceGetName(name, len(name), device))
+        check_cuda_result(cuda, cuda.cuDeviceTotalMem_v2(ctypes.byref(total_memory), device))
+        devices.append({"index": i, "name": name.value.decode(errors="replace"),
+                        "compute_capability": f"{cc_major.value}.{cc_minor.value}",
+                        "total_memory": total_memory.value})
+    return devices
+
+
+def probe(cudart_path, use_cache=True, cache_path=CACHE_PATH, driver_check=driver_present,
+          driver_loader=load_driver, runtime_loader=load_runtime):
+    """
+    Returns {"driver": bool, "cuda_version": "117" or None, "devices": [...]}, each device being
+    {"index", "name", "compute_capability", "total_memory"}. The check and loaders can be swapped out for testing.
+    """
+    key = cache_key(cudart_path)
+    if use_cache:
+        cached = load_cache(key, cache_path)
+        if cached is not None:
+            return cached
+    result = {"driver": False, "cuda_version": None, "devices": []}
+    cuda = driver_loader() if driver_check() else None
+    if cuda is not None:
+        result["driver"] = True
+        result["devices"] = probe_devices(cuda)
+        cudart = runtime_loader(cudart_path) if cudart_path else None
+        if cudart is not None:
+            result["cuda_version"] = probe_runtime_version(cuda, cudart)
+    if use_cache:
+        save_cache(key, result, cache_path)
+    return result
+
+
+def compute_capability_value(cc):
+    major, minor = cc.split(".")
+    return int(major), int(minor)
+
+
+def binary_for_device(device, cuda_version):
+    "if not has_cublaslt (CC < 7.5), then we have to choose  _nocublaslt.so"
+    bin_base_name = "libbitsandbytes_cuda"
+    if compute_capability_value(device["compute_capability"]) >= (7, 5):
+        return f"{bin_base_name}{cuda_version}.so"
+    return f"{bin_base_name}{cuda_version}_nocublaslt.so"
+
+
+def choose_binary(result):
+    """
+    Picks the binary for every device, when they disagree the _nocublaslt one is used since it runs on
+    every device, where the cublaslt one would fail on the older cards. Returns None without a GPU.
+    """
+    if not result["devices"] or result["cuda_version"] is None:
+        return None
+    binaries = {device["index"]: binary_for_device(device, result["cuda_version"]) for device in result["devices"]}
+    for device in result["devices"]:
+        print(f"CUDA SETUP: device {device['index']} ({device['name']}) has compute capability "
+              f"{device['compute_capability']} -> {binaries[device['index']]}")
+    if len(set(binaries.values())) == 1:
+        return next(iter(binaries.values()))
+    return next(name for name in binaries.values() if name.endswith("_nocublaslt.so"))
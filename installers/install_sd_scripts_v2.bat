@@ -86,6 +86,7 @@ if ERRORLEVEL 2 goto complete
 echo installing 10X0 card fix
 move ..\LoRA_Easy_Training_Scripts\installables\libbitsandbytes_cudaall.dll venv\Lib\site-packages\bitsandbytes > nul
 move ..\LoRA_Easy_Training_Scripts\installables\main.py venv\Lib\site-packages\bitsandbytes\cuda_setup > nul
+move ..\LoRA_Easy_Training_Scripts\installables\probe.py venv\Lib\site-packages\bitsandbytes\cuda_setup > nul
 goto complete
 
 :noAdmin
@@ -0,0 +1,181 @@
+import argparse
+import itertools
+import json
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compares trained LoRA by their weights, runs on CPU")
+    parser.add_argument("paths", type=str, nargs="+", help=".safetensors files, or folders of them")
+    parser.add_argument("--reference", type=str, default=None,
+                        help="LoRA every other one gets compared against with cosine similarity")
+    parser.add_argument("--pairwise", action="store_true", help="compares every pair of LoRA instead")
+    parser.add_argument("--energy", type=float, default=0.99,
+                        help="share of the energy (squared singular values) the energy rank has to keep")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="number of processes to analyze with")
+    parser.add_argument("--json", type=str, default=None,
+                        help="saves every stat, with the per module stats and spectra, to this json file")
+    args = parser.parse_args()
+
+    files = collect_files(args.paths)
+    if args.reference:
+        args.reference = os.path.normpath(args.reference)
+    if args.reference and args.reference not in files:
+        files.insert(0, args.reference)
+    if not files:
+        print("no .safetensors files found")
+        quit(1)
+    pairs = []
+    if args.pairwise:
+        pairs = list(itertools.combinations(files, 2))
+    elif args.reference:
+        pairs = [(args.reference, file) for file in files if file != args.reference]
+    with ProcessPoolExecutor(max_workers=args.workers, mp_context=multiprocessing.get_context("spawn"),
+                             initializer=single_thread) as pool:
+        stats = list(pool.map(lora_stats, files, itertools.repeat(args.energy)))
+        similarities = list(pool.map(lora_similarity, [pair[0] for pair in pairs], [pair[1] for pair in pairs]))
+    print_table(stats)
+    if pairs:
+        print()
+        for (first, second), similarity in zip(pairs, similarities):
+            print(f"{os.path.basename(first)} vs {os.path.basename(second)}: cosine {similarity['cosine']:.4f}, "
+                  f"mean module cosine {similarity['mean_module_cosine']:.4f} over {similarity['shared_modules']} modules")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"files": stats, "similarities": [dict(similarity, first=first, second=second) for
+                                                        (first, second), similarity in zip(pairs, similarities)]},
+                      f, indent=4)
+
+
+def collect_files(paths) -> list:
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files += sorted(os.path.normpath(os.path.join(path, file)) for file in os.listdir(path)
+                            if file.endswith(".safetensors"))
+        elif path.endswith(".safetensors"):
+            files.append(os.path.normpath(path))
+        else:
+            print(f"skipping {path}, it isn't a .safetensors file or a folder")
+    # a file given on its own and through its folder only gets analyzed once
+    return list(dict.fromkeys(files))
+
+
+def single_thread() -> None:
+    # every worker gets one thread, many processes on small matrices beats torch's threading
+    import torch
+    torch.set_num_threads(1)
+
+
+def load_factors(path) -> dict:
+    # {module name: (up, down, alpha / dim)} with up and down flattened to matrices. safe_open memory maps the file,
+    # so only the tensors that are read get loaded
+    from safetensors import safe_open
+    factors = {}
+    with safe_open(path, framework="pt", device="cpu") as f:
+        keys = set(f.keys())
+        for key in sorted(keys):
+            if not key.endswith(".lora_down.weight"):
+                continue
+            name = key[:-len(".lora_down.weight")]
+            down = f.get_tensor(key).float().flatten(1)
+            up = f.get_tensor(f"{name}.lora_up.weight").float().flatten(1)
+            dim = down.shape[0]
+            alpha = f.get_tensor(f"{name}.alpha").float().item() if f"{name}.alpha" in keys else dim
+            factors[name] = (up, down, alpha / dim)
+    return factors
+
+
+def spectra(ups, downs, scales):
+    # singular values of every up @ down * scale in a batch of same shaped modules. up @ down = Qu Ru Rd^T Qd^T, so they
+    # are the singular values of the small Ru Rd^T and the full sized weight change never gets built
+    import torch
+    r_up = torch.linalg.qr(ups).R
+    r_down = torch.linalg.qr(downs.transpose(1, 2)).R
+    return torch.linalg.svdvals(r_up @ r_down.transpose(1, 2)) * scales[:, None]
+
+
+def lora_stats(path, energy: float = 0.99) -> dict:
+    """
+    Per module stats of a LoRA: the frobenius norm of the weight change it applies, its singular values, its effective
+    rank (the exponential of the entropy of the normalized singular values) and its energy rank (the number of
+    singular values it takes to keep the given share of the squared ones). Modules of the same shape are done as one
+    batch.
+    """
+    import torch
+    factors = load_factors(path)
+    groups = {}
+    for name, (up, down, scale) in factors.items():
+        groups.setdefault((tuple(up.shape), tuple(down.shape)), []).append(name)
+    modules = {}
+    for names in groups.values():
+        singular = spectra(torch.stack([factors[name][0] for name in names]),
+                           torch.stack([factors[name][1] for name in names]),
+                           torch.tensor([factors[name][2] for name in names]))
+        p = singular / singular.sum(1, keepdim=True).clamp_min(1e-12)
+        effective_ranks = torch.exp(-(p * torch.log(p.clamp_min(1e-12))).sum(1))
+        squared = singular ** 2
+        kept = squared.cumsum(1) / squared.sum(1, keepdim=True).clamp_min(1e-12)
+        energy_ranks = (kept < energy).sum(1) + 1
+        norms = singular.norm(dim=1)
+        for i, name in enumerate(names):
+            modules[name] = {"norm": norms[i].item(), "effective_rank": effective_ranks[i].item(),
+                             "energy_rank": int(energy_ranks[i]), "dim": singular.shape[1],
+                             "spectrum": singular[i].tolist()}
+    return {"file": os.path.basename(path), "path": path, "summary": summarize(modules), "modules": modules}
+
+
+def summarize(modules: dict) -> dict:
+    norms = [module["norm"] for module in modules.values()]
+
+    def total_norm(prefix):
+        return sum(module["norm"] ** 2 for name, module in modules.items() if name.startswith(prefix)) ** 0.5
+
+    def mean(key):
+        return sum(module[key] for module in modules.values()) / len(modules) if modules else None
+    return {"modules": len(modules), "mean_norm": mean("norm"), "max_norm": max(norms, default=None),
+            "unet_norm": total_norm("lora_unet"), "te_norm": total_norm("lora_te"),
+            "mean_effective_rank": mean("effective_rank"), "mean_energy_rank": mean("energy_rank")}
+
+
+def lora_similarity(first, second) -> dict:
+    """
+    Cosine similarity between the weight changes of two LoRA, over the whole network and per module. The inner
+    products are worked out as trace((Ua^T Ub)(Db Da^T)), which only builds dim x dim matrices.
+    """
+    import torch
+    a = load_factors(first)
+    b = load_factors(second)
+    inner_total, norm_a, norm_b = 0.0, 0.0, 0.0
+    modules = {}
+    for name in sorted(a.keys() & b.keys()):
+        up_a, down_a, scale_a = a[name]
+        up_b, down_b, scale_b = b[name]
+        inner = torch.trace((up_a.T @ up_b) @ (down_b @ down_a.T)).item() * scale_a * scale_b
+        square_a = torch.trace((up_a.T @ up_a) @ (down_a @ down_a.T)).item() * scale_a ** 2
+        square_b = torch.trace((up_b.T @ up_b) @ (down_b @ down_b.T)).item() * scale_b ** 2
+        inner_total += inner
+        norm_a += square_a
+        norm_b += square_b
+        modules[name] = inner / max((square_a * square_b) ** 0.5, 1e-12)
+    return {"cosine": inner_total / max((norm_a * norm_b) ** 0.5, 1e-12),
+            "mean_module_cosine": sum(modules.values()) / len(modules) if modules else 0.0,
+            "shared_modules": len(modules), "modules": modules}
+
+
+def print_table(stats: list) -> None:
+    columns = [("modules", "modules", "d"), ("mean_norm", "mean norm", ".4f"), ("max_norm", "max norm", ".4f"),
+               ("unet_norm", "unet norm", ".4f"), ("te_norm", "te norm", ".4f"),
+               ("mean_effective_rank", "eff rank", ".2f"), ("mean_energy_rank", "energy rank", ".2f")]
+    width = max(len("file"), *(len(stat["file"]) for stat in stats))
+    print(f"{'file':<{width}}  " + "  ".join(f"{title:>11}" for _, title, _ in columns))
+    for stat in stats:
+        summary = stat["summary"]
+        print(f"{stat['file']:<{width}}  " + "  ".join(
+            f"{summary[key]:>11{fmt}}" if summary[key] is not None else f"{'-':>11}" for key, _, fmt in columns))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,173 @@
+import os
+import queue
+import shutil
+import tempfile
+import threading
+from contextlib import contextmanager
+
+SAVING_FOLDER = ".saving"  # files are written in here and renamed into output_folder once complete
+
+
+def saving_path(path) -> str:
+    # a path on the same drive as path, so the rename that publishes it is atomic
+    folder = os.path.join(os.path.dirname(os.path.abspath(path)), SAVING_FOLDER)
+    os.makedirs(folder, exist_ok=True)
+    return os.path.join(folder, os.path.basename(path))
+
+
+class AsyncSaver:
+    """
+    Writes saves from a background thread so training keeps going while they're written. At most max_pending saves
+    wait to be written, past that the training waits for the oldest one, which keeps a slow drive from filling up
+    memory with snapshots. flush() waits for everything that's queued, close() also stops the thread and returns the
+    saves that failed.
+    """
+    def __init__(self, max_pending=1):
+        self.jobs = queue.Queue(maxsize=max(1, max_pending))
+        self.failed = []
+        self.free_buffers = []
+        self.lock = threading.Lock()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def run(self) -> None:
+        while True:
+            job = self.jobs.get()
+            if job is None:
+                self.jobs.task_done()
+                return
+            name, write, buffers = job
+            try:
+                write()
+                print(f"finished writing {name}")
+            except Exception as e:
+                print(f"failed to write {name}: {e}")
+                self.failed.append(name)
+            finally:
+                if buffers is not None:
+                    with self.lock:
+                        self.free_buffers.append(buffers)
+                self.jobs.task_done()
+
+    def submit(self, name, write, buffers=None) -> None:
+        if self.jobs.full():
+            print(f"waiting for the last save to be written before queueing {name}")
+        self.jobs.put((name, write, buffers))
+
+    def snapshot(self, state_dict: dict) -> dict:
+        # copies every tensor to host memory, pinned when there's a GPU so the copy doesn't stall it. buffers of
+        # saves that are done being written get reused, every epoch has the same shapes
+        import torch
+        with self.lock:
+            buffers = next((buffers for buffers in self.free_buffers if matches(buffers, state_dict)), None)
+            if buffers is not None:
+                self.free_buffers.remove(buffers)
+        if buffers is None:
+            pin = torch.cuda.is_available()
+            buffers = {key: torch.empty(value.shape, dtype=value.dtype, device="cpu", pin_memory=pin)
+                       for key, value in state_dict.items()}
+        for key, value in state_dict.items():
+            buffers[key].copy_(value.detach(), non_blocking=True)
+        if torch.cuda.is_available():
+            torch.cuda.synchronize()
+        return buffers
+
+    def flush(self) -> None:
+        if self.jobs.unfinished_tasks:
+            print(f"waiting for {self.jobs.unfinished_tasks} saves to finish writing")
+        self.jobs.join()
+
+    def close(self) -> list:
+        self.flush()
+        self.jobs.put(None)
+        self.thread.join()
+        return self.failed
+
+
+def matches(buffers: dict, state_dict: dict) -> bool:
+    return buffers.keys() == state_dict.keys() and all(
+        buffers[key].shape == value.shape and buffers[key].dtype == value.dtype for key, value in state_dict.items())
+
+
+class Snapshot:
+    # stands in for the network when its original save_weights writes, it only ever calls state_dict()
+    def __init__(self, state_dict):
+        self.snapshot = state_dict
+
+    def state_dict(self) -> dict:
+        return self.snapshot
+
+
+def patch_save_weights(saver: AsyncSaver, network_class):
+    original = network_class.save_weights
+
+    def save_weights(self, file, dtype, metadata):
+        buffers = saver.snapshot(self.state_dict())
+        metadata = dict(metadata) if metadata is not None else None
+
+        def write():
+            path = saving_path(file)
+            original(Snapshot(buffers), path, dtype, metadata)
+            os.replace(path, file)
+        saver.submit(os.path.basename(file), write, buffers)
+    network_class.save_weights = save_weights
+    return original
+
+
+def patch_save_state(saver: AsyncSaver, accelerator_class, staging_folder):
+    original = accelerator_class.save_state
+
+    def save_state(self, output_dir=None, *args, **kwargs):
+        # the state is written by accelerate to a local folder first, then moved to output_dir in the background
+        if output_dir is None or getattr(self, "num_processes", 1) > 1:
+            return original(self, output_dir, *args, **kwargs)
+        staging = tempfile.mkdtemp(prefix="lora_state_", dir=staging_folder)
+        result = original(self, staging, *args, **kwargs)
+
+        def write():
+            path = saving_path(output_dir)
+            shutil.rmtree(path, ignore_errors=True)
+            shutil.copytree(staging, path)
+            if os.path.exists(output_dir):
+                shutil.rmtree(output_dir)
+            os.replace(path, output_dir)
+            shutil.rmtree(staging, ignore_errors=True)
+        saver.submit(os.path.basename(os.path.normpath(output_dir)), write)
+        return result
+    accelerator_class.save_state = save_state
+    return original
+
+
+@contextmanager
+def async_saves(arg_dict: dict):
+    # used by the training scripts around a training, does nothing unless async_save is set
+    if not arg_dict['async_save']:
+        yield
+        return
+    saver = AsyncSaver(arg_dict['async_save_queue'])
+    patched = []
+    try:
+        import networks.lora as lora
+        patched.append((lora.LoRANetwork, "save_weights", patch_save_weights(saver, lora.LoRANetwork)))
+    except ImportError:
+        print("couldn't find networks.lora, epochs will be saved normally")
+    try:
+        from accelerate import Accelerator
+        if arg_dict['async_save_staging']:
+            os.makedirs(arg_dict['async_save_staging'], exist_ok=True)
+        patched.append((Accelerator, "save_state",
+                        patch_save_state(saver, Accelerator, arg_dict['async_save_staging'])))
+    except ImportError:
+        print("couldn't find accelerate, save states will be saved normally")
+    try:
+        yield saver
+    finally:
+        for owner, name, original in patched:
+            setattr(owner, name, original)
+        failed = saver.close()
+        try:
+            os.rmdir(os.path.join(arg_dict['output_folder'], SAVING_FOLDER))
+        except OSError:
+            pass
+    if failed:
+        raise RuntimeError(f"failed to write {', '.join(failed)}")
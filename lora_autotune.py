@@ -0,0 +1,102 @@
+import gc
+import json
+import shutil
+import tempfile
+
+import lora_placement
+
+
+def is_oom(e: BaseException) -> bool:
+    try:
+        import torch
+        if isinstance(e, getattr(torch.cuda, "OutOfMemoryError", ())):
+            return True
+    except ImportError:
+        pass
+    return isinstance(e, RuntimeError) and "out of memory" in str(e).lower()
+
+
+def memory_model_oracle(device_memory: int, headroom: float = 0.9):
+    # answers from lora_placement's memory estimate, cheap but rough
+    def fits(args: dict) -> bool:
+        return lora_placement.estimate_vram_bytes(args) <= device_memory * headroom
+    return fits
+
+
+def probe_oracle(build_args, train_fn, steps: int = 2):
+    # runs a few real steps of training into a temp folder, exact but each try loads the model again
+    def fits(args: dict) -> bool:
+        output_folder = tempfile.mkdtemp(prefix="lora_autotune_")
+        trial = dict(args)
+        trial.update({"max_steps": steps, "output_folder": output_folder, "save_every_n_epochs": None,
+                      "save_state": False, "change_output_name": "autotune_probe", "log_dir": None})
+        try:
+            train_fn(build_args(trial))
+            return True
+        except Exception as e:
+            if is_oom(e):
+                return False
+            raise
+        finally:
+            gc.collect()
+            try:
+                import torch
+                torch.cuda.empty_cache()
+            except ImportError:
+                pass
+            shutil.rmtree(output_folder, ignore_errors=True)
+    return fits
+
+
+def make_oracle(args: dict, build_args=None, train_fn=None):
+    if args['autotune_method'] == "probe":
+        return probe_oracle(build_args, train_fn)
+    # the largest card that supports the options, placement will only put the job on a card that fits it
+    needs = lora_placement.requirements(args)
+    devices = [d for d in lora_placement.get_devices()
+               if lora_placement.compute_capability_value(d["compute_capability"]) >= needs["compute_capability"]]
+    return memory_model_oracle(max((d["total_memory"] for d in devices), default=0))
+
+
+def autotune(args: dict, fits, max_batch_size: int = 64) -> dict:
+    """
+    Treats batch_size x gradient_acc_steps as the effective batch, then finds the largest batch size that divides it
+    and fits, and makes up the rest with gradient accumulation so the effective batch stays the same.
+    """
+    effective = args['batch_size'] * max(1, args['gradient_acc_steps'] or 1)
+    candidates = [size for size in range(1, min(effective, max_batch_size) + 1) if effective % size == 0]
+    # memory only grows with the batch size, so a binary search over the candidates works
+    low, high, best = 0, len(candidates) - 1, None
+    while low <= high:
+        mid = (low + high) // 2
+        trial = dict(args)
+        trial.update({"batch_size": candidates[mid], "gradient_acc_steps": effective // candidates[mid]})
+        if fits(trial):
+            best = candidates[mid]
+            low = mid + 1
+        else:
+            high = mid - 1
+    if best is None:
+        print(f"autotune couldn't fit even a batch size of 1, keeping batch_size at {args['batch_size']}")
+        return args
+    acc_steps = effective // best
+    print(f"autotune set batch_size to {best} and gradient_acc_steps to {acc_steps} "
+          f"for an effective batch size of {effective}")
+    args['batch_size'] = best
+    args['gradient_acc_steps'] = acc_steps if acc_steps > 1 else None
+    return args
+
+
+def write_back(path, args: dict) -> None:
+    # saves the tuned values into the json the job came from, so the next run doesn't tune again
+    with open(path) as f:
+        json_obj = json.load(f)
+    # kohya_ss jsons use their own names for these
+    for ui_name, name in (("train_batch_size", "batch_size"), ("gradient_accumulation_steps", "gradient_acc_steps")):
+        if ui_name in json_obj:
+            json_obj[ui_name] = args[name]
+    json_obj['batch_size'] = args['batch_size']
+    json_obj['gradient_acc_steps'] = args['gradient_acc_steps']
+    json_obj['autotune_batch_size'] = False
+    with open(path, "w") as f:
+        json.dump(json_obj, f, indent=4)
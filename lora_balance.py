@@ -0,0 +1,161 @@
+import argparse
+import json
+import os
+
+import lora_subset
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Calculates folder repeats that give each concept a target share "
+                                                 "of the steps while keeping the total steps as low as possible")
+    parser.add_argument("--img_folder", type=str, required=True, help="the img folder laid out as x_name folders")
+    parser.add_argument("--shares", type=str, nargs="+", required=True,
+                        help="target shares as key=value, keys are folder names (with or without the repeat "
+                             "prefix) or tags when --by_tag is set. values don't need to add up to 1")
+    parser.add_argument("--by_tag", action="store_true",
+                        help="treat the share keys as tags, a folder counts towards the tag most of its captions have")
+    parser.add_argument("--caption_extension", type=str, default=".txt")
+    parser.add_argument("--tolerance", type=float, default=0.02,
+                        help="how far off each share is allowed to be, 0.02 means within 2 percent of the total")
+    parser.add_argument("--max_repeats", type=int, default=100)
+    parser.add_argument("--rename", action="store_true",
+                        help="rename the folders in place instead of writing an override map")
+    parser.add_argument("--save_to", type=str, default=None,
+                        help="json file to write the override map to, set it as repeat_overrides when training")
+    args = parser.parse_args()
+
+    shares = {}
+    for pair in args.shares:
+        key, _, value = pair.rpartition("=")
+        shares[key] = float(value)
+    counts = count_images(args.img_folder)
+    if args.by_tag:
+        folder_shares = folder_shares_from_tags(args.img_folder, args.caption_extension, counts, shares)
+    else:
+        folder_shares = {folder: shares[key] for folder in counts for key in shares
+                         if key in {folder, concept_name(folder)}}
+        for key in shares:
+            if not any(key in {folder, concept_name(folder)} for folder in counts):
+                print(f"no folder in {args.img_folder} is named {key}, its share is left out")
+    repeats = balance_repeats({folder: counts[folder] for folder in folder_shares}, folder_shares, args.tolerance,
+                              args.max_repeats)
+    if not repeats:
+        print("none of the shares matched a folder with images, nothing to balance")
+        quit(1)
+    total = sum(repeats[folder] * counts[folder] for folder in repeats)
+    for folder, value in repeats.items():
+        print(f"{folder}: {value} repeats, {counts[folder]} images, "
+              f"{repeats[folder] * counts[folder] / total:.1%} of {total} steps per epoch")
+    if args.rename:
+        rename_folders(args.img_folder, repeats)
+    elif args.save_to:
+        with open(args.save_to, "w") as f:
+            json.dump({concept_name(folder): value for folder, value in repeats.items()}, f, indent=4)
+        print(f"saved override map to {args.save_to}")
+
+
+def concept_name(folder: str) -> str:
+    parsed = lora_subset.parse_folder_name(folder)
+    return parsed[1] if parsed else folder
+
+
+def count_images(img_folder) -> dict:
+    counts = {}
+    for folder in sorted(os.listdir(img_folder)):
+        if not os.path.isdir(os.path.join(img_folder, folder)) or lora_subset.parse_folder_name(folder) is None:
+            continue
+        counts[folder] = sum(1 for file in os.listdir(os.path.join(img_folder, folder))
+                             if file.split(".")[-1].lower() in lora_subset.IMG_EXTENSIONS)
+    return counts
+
+
+def folder_shares_from_tags(img_folder, caption_extension, counts: dict, tag_shares: dict) -> dict:
+    # assigns every folder to the target tag most of its captions have, then splits that tag's share
+    # between its folders by image count
+    owners = {}
+    for folder in counts:
+        tag_counts = {tag: 0 for tag in tag_shares}
+        for file in os.listdir(os.path.join(img_folder, folder)):
+            if not file.endswith(caption_extension):
+                continue
+            tags = lora_subset.read_tags(os.path.join(img_folder, folder, file))
+            for tag in tag_counts:
+                if tag in tags:
+                    tag_counts[tag] += 1
+        best = max(tag_counts, key=tag_counts.get)
+        if tag_counts[best] > counts[folder] / 2:
+            owners[folder] = best
+        else:
+            print(f"folder {folder} doesn't mostly contain any of the target tags. skipping")
+    for tag in tag_shares:
+        if tag not in owners.values():
+            print(f"no folder mostly has the tag {tag}, its share is left out")
+    shares = {}
+    for folder, tag in owners.items():
+        tag_imgs = sum(counts[f] for f, t in owners.items() if t == tag)
+        shares[folder] = tag_shares[tag] * counts[folder] / tag_imgs
+    return shares
+
+
+def balance_repeats(counts: dict, shares: dict, tolerance=0.02, max_repeats=100) -> dict:
+    # finds integer repeats that land every folder within tolerance of its share with the fewest total steps,
+    # falls back to the closest mix when nothing is within tolerance, empty when no folder has images and a share
+    counts = {folder: count for folder, count in counts.items() if count > 0 and shares[folder] > 0}
+    if not counts:
+        return {}
+    share_total = sum(shares[folder] for folder in counts)
+    targets = {folder: shares[folder] / share_total for folder in counts}
+    best, best_key = None, None
+    for anchor in counts:
+        for anchor_repeats in range(1, max_repeats + 1):
+            total = anchor_repeats * counts[anchor] / targets[anchor]
+            repeats = {folder: min(max_repeats, max(1, round(targets[folder] * total / counts[folder])))
+                       for folder in counts}
+            steps = sum(repeats[folder] * counts[folder] for folder in counts)
+            error = max(abs(repeats[folder] * counts[folder] / steps - targets[folder]) for folder in counts)
+            key = (0 if error <= tolerance else 1, steps if error <= tolerance else error)
+            if best_key is None or key < best_key:
+                best, best_key = repeats, key
+    return best
+
+
+def rename_folders(img_folder, repeats: dict) -> None:
+    for folder, value in repeats.items():
+        new_name = f"{value}_{concept_name(folder)}"
+        if new_name != folder:
+            os.rename(os.path.join(img_folder, folder), os.path.join(img_folder, new_name))
+            print(f"renamed {folder} to {new_name}")
+
+
+def load_overrides(overrides) -> dict:
+    if isinstance(overrides, str):
+        with open(overrides) as f:
+            return json.load(f)
+    return overrides
+
+
+def apply_overrides(img_folder, overrides, out_dir) -> str:
+    # used by the training scripts, links img_folder into out_dir with the overridden repeats in the folder names
+    # since sd-scripts only reads repeats from the folder names, returns the folder to train on
+    overrides = load_overrides(overrides)
+    marker = os.path.join(img_folder, lora_subset.MARKER_FILE)
+    if os.path.abspath(img_folder) == os.path.abspath(out_dir) and os.path.exists(marker):
+        # already pointed at the linked folder, rebuild it from where it came from
+        with open(marker) as f:
+            img_folder = f.read()
+    folders = {}
+    for folder in sorted(os.listdir(img_folder)):
+        folder_path = os.path.join(img_folder, folder)
+        parsed = lora_subset.parse_folder_name(folder)
+        if not os.path.isdir(folder_path) or parsed is None:
+            continue
+        repeats = overrides.get(folder, overrides.get(parsed[1], parsed[0]))
+        folders[f"{repeats}_{parsed[1]}"] = [[os.path.abspath(os.path.join(folder_path, file))]
+                                             for file in sorted(os.listdir(folder_path))
+                                             if os.path.isfile(os.path.join(folder_path, file))]
+    manifest = {"source": os.path.abspath(img_folder), "folders": folders}
+    return lora_subset.materialize(manifest, out_dir)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,147 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import random
+import shutil
+import statistics
+import tempfile
+import time
+
+import lora_common
+import lora_train_command_line as trainer
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks the dataset scanning, tag counting and config building "
+                                                 "that runs before every training, on a generated img_folder")
+    parser.add_argument("--folders", type=int, default=10, help="number of x_name folders to generate")
+    parser.add_argument("--images", type=int, default=1000, help="number of images per folder")
+    parser.add_argument("--caption_length", type=int, default=30, help="number of tags per caption")
+    parser.add_argument("--vocab", type=int, default=5000, help="number of distinct tags to pick from")
+    parser.add_argument("--repeats", type=int, default=5, help="number of times each benchmark is run")
+    parser.add_argument("--work_dir", type=str, default=None,
+                        help="where to generate the dataset, a temp folder when not set. an existing dataset "
+                             "of the same size there is reused")
+    parser.add_argument("--baseline", type=str, default="benchmark_baseline.json",
+                        help="json file the results are tracked in")
+    parser.add_argument("--update_baseline", action="store_true",
+                        help="makes these results the new baseline instead of comparing against it")
+    parser.add_argument("--threshold", type=float, default=0.2,
+                        help="fails when a benchmark is this much slower than the baseline, 0.2 is 20 percent")
+    parser.add_argument("--min_delta", type=float, default=0.005,
+                        help="slowdowns smaller than this many seconds are never counted, keeps tiny timings from "
+                             "failing on noise")
+    args = parser.parse_args()
+
+    work_dir = args.work_dir if args.work_dir else tempfile.mkdtemp(prefix="lora_bench_")
+    try:
+        print(f"generating {args.folders * args.images} images in {work_dir}...")
+        arg_dict = generate_dataset(work_dir, args.folders, args.images, args.caption_length, args.vocab)
+        results = run_benchmarks(arg_dict, work_dir, args.repeats)
+    finally:
+        if not args.work_dir:
+            shutil.rmtree(work_dir, ignore_errors=True)
+    case = f"{args.folders}x{args.images}_tags{args.caption_length}_vocab{args.vocab}"
+    regressions = track_results(args.baseline, case, results, args.threshold, args.update_baseline,
+                                {"min": args.min_delta})
+    if regressions:
+        quit(1)
+
+
+def generate_dataset(work_dir, folders, images, caption_length, vocab, seed=23) -> dict:
+    # builds img_folder, output_folder and a stand in base model, returns the arg dict pointing at them
+    rng = random.Random(seed)
+    tags = [f"tag_{i}" for i in range(vocab)]
+    img_folder = os.path.join(work_dir, "img")
+    output_folder = os.path.join(work_dir, "output")
+    base_model = os.path.join(work_dir, "model.safetensors")
+    os.makedirs(output_folder, exist_ok=True)
+    open(base_model, "a").close()
+    for folder in range(folders):
+        folder_path = os.path.join(img_folder, f"{folder % 20 + 1}_concept{folder}")
+        if os.path.isdir(folder_path) and len(os.listdir(folder_path)) == images * 2:
+            continue
+        os.makedirs(folder_path, exist_ok=True)
+        for img in range(images):
+            # find_max_steps only looks at extensions, so empty images are enough
+            open(os.path.join(folder_path, f"{img}.png"), "a").close()
+            with open(os.path.join(folder_path, f"{img}.txt"), "w") as f:
+                f.write(", ".join(rng.sample(tags, min(caption_length, vocab))))
+    arg_dict = trainer.ArgStore.convert_args_to_dict()
+    arg_dict.update({"base_model": base_model, "img_folder": img_folder, "output_folder": output_folder,
+                     "change_output_name": "benchmark"})
+    return arg_dict
+
+
+def run_benchmarks(arg_dict: dict, work_dir, repeats) -> dict:
+    json_path = os.path.join(work_dir, "config.json")
+    with open(json_path, "w") as f:
+        json.dump(arg_dict, f, indent=4)
+
+    def load_json():
+        fresh = trainer.ArgStore.convert_args_to_dict()
+        fresh["json_load_skip_list"] = None
+        trainer.load_json(json_path, fresh)
+
+    def compile_sweep():
+        # a sweep over learning rates, with the cache cleared so every config really gets compiled
+        lora_common.compile_key.cache_clear()
+        for i in range(1000):
+            lora_common.compile_args(dict(arg_dict, learning_rate=(i + 1) * 1e-6))
+
+    benchmarks = {"find_max_steps": lambda: lora_common.find_max_steps(dict(arg_dict)),
+                  "get_occurrence_of_tags": lambda: lora_common.get_occurrence_of_tags(dict(arg_dict)),
+                  "load_json": load_json,
+                  "create_arg_space": lambda: lora_common.create_arg_space(dict(arg_dict)),
+                  "compile_args_1000": compile_sweep}
+    results = {}
+    for name, func in benchmarks.items():
+        times = []
+        for _ in range(repeats):
+            # the scripts print a lot, keep it out of the timings
+            with contextlib.redirect_stdout(io.StringIO()):
+                start = time.perf_counter()
+                func()
+                times.append(time.perf_counter() - start)
+        results[name] = {"min": min(times), "median": statistics.median(times)}
+        print(f"{name}: min {min(times) * 1000:.2f}ms, median {statistics.median(times) * 1000:.2f}ms")
+    return results
+
+
+def track_results(path, case: str, results: dict, threshold: float, update_baseline: bool, metrics=None) -> list:
+    # appends the results to the history in path, and compares them against the baseline of the case.
+    # metrics maps each compared key of a result to the smallest absolute increase that counts, lower is better for all
+    if metrics is None:
+        metrics = {"min": 0.0}
+    data = {"baseline": {}, "history": []}
+    if os.path.exists(path):
+        with open(path) as f:
+            data = json.load(f)
+    data["history"].append({"time": time.time(), "case": case, "results": results})
+    regressions = []
+    baseline = data["baseline"].get(case)
+    if update_baseline or baseline is None:
+        data["baseline"][case] = results
+        print(f"saved results as the baseline for {case}")
+    else:
+        for name, result in results.items():
+            if name not in baseline:
+                continue
+            for metric, min_delta in metrics.items():
+                old, new = baseline[name].get(metric), result.get(metric)
+                if not old or new is None:
+                    continue
+                change = new / old - 1
+                regressed = change > threshold and new - old > min_delta
+                print(f"{name} {metric}: {change:+.1%} against baseline, {'REGRESSION' if regressed else 'ok'}")
+                if regressed:
+                    regressions.append(f"{name} {metric}")
+    with open(path, "w") as f:
+        json.dump(data, f, indent=4)
+    return regressions
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,685 @@
+import copy
+import functools
+import hashlib
+import json
+import os
+from typing import Union
+
+import library.train_util as util
+import lora_subset
+import lora_balance
+import lora_profile
+
+
+class ArgStore:
+    # Represents the entirety of all possible inputs for sd-scripts. they are ordered from most important to least.
+    # these are the defaults both front-ends start from, each of them subclasses it and sets its own values on top
+    def __init__(self):
+        # Important, these are the most likely things you will modify
+        self.base_model: str = r""  # example path, r"E:\sd\stable-diffusion-webui\models\Stable-diffusion\nai.ckpt"
+        self.img_folder: str = r""  # is the folder path to your img folder, make sure to follow the guide
+                                    # here for folder setup: https://rentry.org/2chAI_LoRA_Dreambooth_guide_english#for-kohyas-script
+        self.output_folder: str = r""  # just the folder all epochs/safetensors are output
+        self.subset_manifest: Union[str, None] = None  # OPTIONAL, a manifest made by lora_subset.py, the subset gets linked into
+                                                       # a folder next to the manifest and is used in place of img_folder
+        self.repeat_overrides: Union[dict, str, None] = None  # OPTIONAL, a dict of {folder name: repeats} or the path to the json lora_balance.py makes,
+                                                              # img_folder gets linked into output_folder with the new repeats since sd-scripts reads them from folder names
+        self.change_output_name: Union[str, None] = None  # changes the output name of the epochs
+        self.save_json_folder: Union[str, None] = None  # OPTIONAL, saves a json folder of your config to whatever location you set here.
+        self.load_json_path: Union[str, None] = None  # OPTIONAL, loads a json file partially changes the config to match.
+        self.json_load_skip_list: Union[list[str], None] = None  # OPTIONAL, allows the user to define what they skip when loading a json,
+                                                                 # IMPORTANT: by default it loads everything, including all paths,
+                                                                 # format to exclude things is like so: ["base_model", "img_folder", "output_folder"]
+        self.multi_run_folder: Union[str, None] = None  # OPTIONAL, set to a folder with jsons generated by my script and it will begin training using those scripts.
+                                                        # keep in mind, it will ignore the json_load_skip_list to ensure that everything gets loaded.
+                                                        # IMPORTANT: This will also ignore all params set here and instead use all params in the json files.
+        self.multi_run_lease: int = 600  # seconds without a heartbeat before another machine sharing the multi_run_folder takes over a job
+        self.multi_run_wait: bool = False  # keeps polling the multi_run_folder for new jobs, or jobs of dead machines, instead of stopping once it's empty
+        self.save_json_only: bool = False  # set to true if you don't want to do any training, but rather just want to generate a json
+        self.skip_if_trained: bool = True  # skips a training when output_folder already has the outputs of the exact same config and dataset
+        self.gpu_placement: bool = False  # OPTIONAL, trains on the best GPU that supports the options you set (bf16, xformers, 8bit adam)
+                                          # and has enough vram, jobs that no GPU can run get skipped
+        self.telemetry_file: Union[str, None] = None  # OPTIONAL, appends a json line for the start and end of every training to this file,
+                                                      # with wall time, steps/sec, images/sec and peak memory use
+        self.watch_outputs: bool = False  # OPTIONAL, post-processes every LoRA as soon as it gets saved during training,
+                                          # writes the norm and effective rank of every layer to a .stats.json next to it
+        self.watch_resize_ranks: Union[list[int], None] = None  # OPTIONAL, ranks the watcher resizes every saved LoRA to, they go in output_folder/resized
+        self.watch_workers: int = 2  # the number of processes the watcher post-processes with, they run at a lower priority than training
+        self.caption_dropout_rate: Union[float, None] = None  # The rate at which captions for files get dropped.
+        self.caption_dropout_every_n_epochs: Union[int, None] = None  # Defines how often an epoch will completely ignore
+                                                                      # captions, EX. 3 means it will ignore captions at epochs 3, 6, and 9
+        self.caption_tag_dropout_rate: Union[float, None] = None  # Defines the rate at which a tag would be dropped, rather than the entire caption file
+
+        self.net_dim: int = 128  # network dimension, 128 is the most common, however you might be able to get lesser to work
+        self.alpha: float = 64  # represents the scalar for training. the lower the alpha,
+                                # the less gets learned per step. if you want the older way of training, set this to dim
+        # list of schedulers: linear, cosine, cosine_with_restarts, polynomial, constant, constant_with_warmup
+        self.scheduler: str = "cosine_with_restarts"  # the scheduler for learning rate. Each does something specific
+        self.cosine_restarts: Union[int, None] = 1  # OPTIONAL, represents the number of times it restarts. Only matters if you are using cosine_with_restarts
+        self.scheduler_power: Union[float, None] = 1  # OPTIONAL, represents the power of the polynomial. Only matters if you are using polynomial
+        self.warmup_lr_ratio: Union[float, None] = None  # OPTIONAL, Calculates the number of warmup steps based on the
+                                                         # ratio given. Make sure to set this if you are using
+                                                         # constant_with_warmup, None to ignore
+        self.learning_rate: Union[float, None] = 1e-4  # OPTIONAL, when not set, lr gets set to 1e-3 as per adamW. Personally, I suggest actually setting this as lower lr seems to be a small bit better.
+        self.text_encoder_lr: Union[float, None] = None  # OPTIONAL, Sets a specific lr for the text encoder, this overwrites the base lr I believe, None to ignore
+        self.unet_lr: Union[float, None] = None  # OPTIONAL, Sets a specific lr for the unet, this overwrites the base lr I believe, None to ignore
+        self.num_workers: int = 1  # The number of threads that are being used to load images, lower speeds up
+                                   # the start of epochs, but slows down the loading of data. The assumption here is
+                                   # that it increases the training time as you reduce this value
+        self.persistent_workers: bool = True  # makes workers persistent, further reduces/eliminates the lag in between epochs. however it may increase memory usage
+
+        self.batch_size: int = 1  # The number of images that get processed at one time, this is directly proportional
+                                  # to your vram and resolution. with 12gb of vram, at 512 reso, you can get a maximum of 6 batch size
+        self.autotune_batch_size: bool = False  # OPTIONAL, treats batch_size x gradient_acc_steps as the effective batch size you want and finds the largest
+                                                # batch size that fits in vram, making up the rest with gradient accumulation. set batch_size high when using this
+        self.autotune_method: str = "model"  # "model" uses a rough vram estimate, "probe" runs 2 steps of training for every batch size it tries, slower but exact
+        self.oom_retry_policy: Union[list[str], None] = ["batch_size", "gradient_checkpointing", "max_bucket_resolution"]
+                                                        # OPTIONAL, what to change, in order, when a training runs out of vram before trying again.
+                                                        # batch_size halves it and doubles gradient_acc_steps, gradient_checkpointing turns it on,
+                                                        # max_bucket_resolution lowers it by 128. None to stop on the first out of memory error
+        self.oom_max_retries: int = 6  # the most times a single training gets retried after running out of vram
+        self.num_epochs: int = 1  # The number of epochs, if you set max steps this value is ignored as it doesn't calculate steps.
+        self.save_every_n_epochs: Union[int, None] = 1  # OPTIONAL, how often to save epochs, None to ignore
+        self.shuffle_captions: bool = False  # OPTIONAL, False to ignore
+        self.keep_tokens: Union[int, None] = None  # OPTIONAL, None to ignore
+        self.max_steps: Union[int, None] = None  # OPTIONAL, if you have specific steps you want to hit, this allows you to set it directly. None to ignore
+        self.tag_occurrence_txt_file: bool = False  # OPTIONAL, creates a txt file that has the entire occurrence of all tags in your dataset
+                                                    # the metadata will also have this so long as you have metadata on, so no reason to have this on by default
+                                                    # will automatically output to the same folder as your output checkpoints
+
+        # These are the second most likely things you will modify
+        self.train_resolution: int = 512
+        self.min_bucket_resolution: int = 320
+        self.max_bucket_resolution: int = 960
+        self.lora_model_for_resume: Union[str, None] = None  # OPTIONAL, takes an input lora to continue training from,
+                                                             # not exactly the way it *should* be, but it works, None to ignore
+        self.save_state: bool = False  # OPTIONAL, is the intended way to save a training state to use for continuing training, False to ignore
+        self.load_previous_save_state: Union[str, None] = None  # OPTIONAL, is the intended way to load a training state to use for continuing training, None to ignore
+        self.async_save: bool = False  # OPTIONAL, writes epochs and save states from a background thread, so training keeps going while they save
+        self.async_save_queue: int = 2  # how many saves can wait to be written before training waits for them
+        self.async_save_staging: Union[str, None] = None  # OPTIONAL, fast local folder save states are written to before they're moved
+                                                          # into output_folder, None uses the temp folder of the system
+        self.retention_keep_last: Union[int, None] = None  # OPTIONAL, keeps only the newest this many epochs, older ones are deleted during training
+        self.retention_keep_best: Union[int, None] = None  # OPTIONAL, also keeps this many epochs with the lowest loss, needs log_dir
+        self.retention_budget_gb: Union[float, None] = None  # OPTIONAL, most space the epochs and save states of a training can take,
+                                                             # the newest epoch and save state are always kept
+        self.retention_global_budget_gb: Union[float, None] = None  # OPTIONAL, most space everything in retention_global_folder can take
+        self.retention_global_folder: Union[str, None] = None  # OPTIONAL, the folder the global budget covers, None for the folder output_folder is in
+        self.training_comment: Union[str, None] = None  # OPTIONAL, great way to put in things like activation tokens right
+                                                        # into the metadata. seems to not work at this point and time
+        self.unet_only: bool = False  # OPTIONAL, set it to only train the unet
+        self.te_cache_folder: Union[str, None] = None  # OPTIONAL, with unet_only, caches the text encoder output of every caption here,
+                                                       # so each caption only goes through the text encoder once, even across trainings
+        self.text_only: bool = False  # OPTIONAL, set it to only train the text encoder
+
+        # These are the least likely things you will modify
+        self.reg_img_folder: Union[str, None] = None  # OPTIONAL, None to ignore
+        self.check_images: bool = False  # OPTIONAL, fully decodes every image in img_folder and reg_img_folder before training and reports missing or empty captions,
+                                         # results are cached by file hash so only new images get decoded next time
+        self.image_check_action: str = "report"  # "report" skips the training when an image can't be read, "quarantine" moves those images
+                                                 # and their captions into output_folder/quarantine and trains without them
+        self.clip_skip: int = 2  # If you are training on a model that is anime based, keep this at 2 as most models are designed for that
+        self.test_seed: int = 23  # this is the "reproducable seed", basically if you set the seed to this,
+                                  # you should be able to input a prompt from one of your training images and get a close representation of it
+        self.prior_loss_weight: float = 1  # is the loss weight much like Dreambooth, is required for LoRA training
+        self.gradient_checkpointing: bool = False  # OPTIONAL, enables gradient checkpointing
+        self.gradient_acc_steps: Union[int, None] = None  # OPTIONAL, the number of batches to accumulate before each optimizer step
+        self.mixed_precision: str = "fp16"  # If you have the ability to use bf16, do it, it's better
+        self.save_precision: str = "fp16"  # You can also save in bf16, but because it's not universally supported, I suggest you keep saving at fp16
+        self.save_as: str = "safetensors"  # list is pt, ckpt, safetensors
+        self.caption_extension: str = ".txt"  # the other option is .captions, but since wd1.4 tagger outputs as txt files, this is the default
+        self.max_clip_token_length = 150  # can be 75, 150, or 225, lora_token_length.py finds the smallest one your captions fit in
+        self.buckets: bool = True
+        self.xformers: bool = True
+        self.use_8bit_adam: bool = True
+        self.cache_latents: bool = True
+        self.color_aug: bool = False  # IMPORTANT: Clashes with cache_latents, only have one of the two on!
+        self.flip_aug: bool = False
+        self.random_crop: bool = False  # IMPORTANT: Clashes with cache_latents
+        self.vae: Union[str, None] = None  # Seems to only make results worse when not using that specific vae, should probably not use
+        self.no_meta: bool = False  # This removes the metadata that now gets saved into safetensors, (you should keep this on)
+        self.log_dir: Union[str, None] = None  # output of logs, not useful to most people.
+        self.bucket_reso_steps: Union[int, None] = None  # is the steps that is taken when making buckets, can be any
+                                                         # can be any positive value from 1 up
+        self.bucket_no_upscale: bool = False  # Disables up-scaling for images in buckets
+        self.v2: bool = False  # Sets up training for SD2.1
+        self.v_parameterization: bool = False  # Only is used when v2 is also set and you are using the 768x version of v2
+
+    # Creates the dict that is used for the rest of the code, to facilitate easier json saving and loading
+    @classmethod
+    def convert_args_to_dict(cls):
+        return cls().__dict__
+
+
+# fields that got renamed, configs made with the old name still load
+LEGACY_NAMES = {"save_at_n_epochs": "save_every_n_epochs"}
+
+
+class Flag:
+    """
+    One sd-scripts flag and the ArgStore field it comes from. kind is when it gets written: "value" always,
+    "optional" when the field is set, "positive" when it is above 0, and "switch" writes just the flag when the
+    field is set. requires maps other fields to the value they need (True for just being set), conflicts are fields
+    that have to be unset, a conflict either drops the flag or, with on_conflict="error", fails the config.
+    value(args, steps) replaces the field's value in the output.
+    """
+    def __init__(self, flag: str, field: Union[str, None] = None, kind: str = "optional", value=None,
+                 requires: Union[dict, None] = None, conflicts: tuple = (), on_conflict: str = "drop"):
+        self.flag = flag
+        self.field = field
+        self.kind = kind
+        self.value = value
+        self.requires = requires if requires else {}
+        self.conflicts = conflicts
+        self.on_conflict = on_conflict
+
+    def fields(self) -> set:
+        return ({self.field} if self.field else set()) | set(self.requires) | set(self.conflicts)
+
+
+def warmup_steps(args: dict, steps) -> int:
+    if steps is None:
+        raise ValueError("warmup_lr_ratio needs the total number of steps to work out the warmup steps")
+    return int(steps * args['warmup_lr_ratio'])
+
+
+# every flag in the order it gets written, the first block is the list of args that are used regardless of setup
+ARG_TABLE = [
+    Flag("network_module", kind="value", value=lambda args, steps: "networks.lora"),
+    Flag("pretrained_model_name_or_path", "base_model", "value"),
+    Flag("train_data_dir", "img_folder", "value"),
+    Flag("output_dir", "output_folder", "value"),
+    Flag("prior_loss_weight", "prior_loss_weight", "value"),
+    Flag("caption_extension", "caption_extension", "value"),
+    Flag("resolution", "train_resolution", "value"),
+    Flag("train_batch_size", "batch_size", "value"),
+    Flag("mixed_precision", "mixed_precision", "value"),
+    Flag("save_precision", "save_precision", "value"),
+    Flag("network_dim", "net_dim", "value"),
+    Flag("save_model_as", "save_as", "value"),
+    Flag("clip_skip", "clip_skip", "value"),
+    Flag("seed", "test_seed", "value"),
+    Flag("max_token_length", "max_clip_token_length", "value"),
+    Flag("lr_scheduler", "scheduler", "value"),
+    Flag("network_alpha", "alpha", "value"),
+    Flag("max_data_loader_n_workers", "num_workers", "value"),
+    Flag("max_train_epochs", "num_epochs", "value", conflicts=("max_steps",)),
+    Flag("max_train_steps", "max_steps"),
+
+    Flag("reg_data_dir", "reg_img_folder"),
+    Flag("network_weights", "lora_model_for_resume"),
+    Flag("save_every_n_epochs", "save_every_n_epochs", "value",
+         value=lambda args, steps: args['save_every_n_epochs'] if args['save_every_n_epochs'] else 999999),
+    Flag("shuffle_caption", "shuffle_captions", "switch"),
+    Flag("keep_tokens", "keep_tokens", "positive"),
+    Flag("enable_bucket", "buckets", "switch"),
+    Flag("min_bucket_reso", "min_bucket_resolution", "value", requires={"buckets": True}),
+    Flag("max_bucket_reso", "max_bucket_resolution", "value", requires={"buckets": True}),
+    Flag("use_8bit_adam", "use_8bit_adam", "switch"),
+    Flag("xformers", "xformers", "switch"),
+    Flag("color_aug", "color_aug", "switch", conflicts=("cache_latents",), on_conflict="error"),
+    Flag("flip_aug", "flip_aug", "switch"),
+    Flag("cache_latents", "cache_latents", "switch"),
+    Flag("lr_warmup_steps", "warmup_lr_ratio", "positive", value=lambda args, steps: warmup_steps(args, steps)),
+    Flag("gradient_checkpointing", "gradient_checkpointing", "switch"),
+    Flag("gradient_accumulation_steps", "gradient_acc_steps", "positive",
+         requires={"gradient_acc_steps": lambda value: value > 1}),
+    Flag("learning_rate", "learning_rate", "positive"),
+    Flag("text_encoder_lr", "text_encoder_lr", "positive"),
+    Flag("unet_lr", "unet_lr", "positive"),
+    Flag("vae", "vae"),
+    Flag("no_metadata", "no_meta", "switch"),
+    Flag("save_state", "save_state", "switch"),
+    Flag("resume", "load_previous_save_state"),
+    Flag("output_name", "change_output_name"),
+    Flag("training_comment", "training_comment"),
+    Flag("lr_scheduler_num_cycles", "cosine_restarts", requires={"scheduler": "cosine_with_restarts"}),
+    Flag("lr_scheduler_power", "scheduler_power", requires={"scheduler": "polynomial"}),
+    Flag("persistent_data_loader_workers", "persistent_workers", "switch"),
+    Flag("network_train_unet_only", "unet_only", "switch"),
+    Flag("network_train_text_encoder_only", "text_only", "switch", conflicts=("unet_only",)),
+    Flag("logging_dir", "log_dir"),
+    Flag("bucket_reso_steps", "bucket_reso_steps"),
+    Flag("bucket_no_upscale", "bucket_no_upscale", "switch"),
+    Flag("random_crop", "random_crop", "switch", conflicts=("cache_latents",)),
+    Flag("caption_dropout_rate", "caption_dropout_rate"),
+    Flag("caption_dropout_every_n_epochs", "caption_dropout_every_n_epochs"),
+    Flag("caption_tag_dropout_rate", "caption_tag_dropout_rate"),
+    Flag("v2", "v2", "switch"),
+    Flag("v_parameterization", "v_parameterization", "switch", requires={"v2": True}),
+]
+
+# (field, accepted extensions, required, error) of every path that gets checked before compiling, no extensions means a folder
+PATH_TABLE = [
+    ("base_model", {"ckpt", "safetensors"}, True, "Failed to find base model, make sure you have the correct path"),
+    ("img_folder", None, True, "Failed to find the image folder, make sure you have the correct path"),
+    ("output_folder", None, True, "Failed to find the output folder, make sure you have the correct path"),
+    ("reg_img_folder", None, False, "Failed to find the reg image folder, make sure you have the correct path"),
+    ("lora_model_for_resume", {"pt", "ckpt", "safetensors"}, False,
+     "Failed to find the lora model, make sure you have the correct path"),
+    ("load_previous_save_state", None, False,
+     "Failed to find the save state folder, make sure you have the correct path"),
+]
+
+
+def compile_flag(flag: Flag):
+    # turns a table entry into a list of checks and a writer, so compiling a config doesn't look at kind again
+    checks = []
+    field = flag.field
+    if flag.kind in {"optional", "switch"}:
+        checks.append(lambda args: bool(args[field]))
+    elif flag.kind == "positive":
+        checks.append(lambda args: bool(args[field]) and args[field] > 0)
+    for other, needed in flag.requires.items():
+        if needed is True:
+            checks.append(lambda args, other=other: bool(args[other]))
+        elif callable(needed):
+            checks.append(lambda args, other=other, needed=needed: needed(args[other]))
+        else:
+            checks.append(lambda args, other=other, needed=needed: args[other] == needed)
+
+    def write(args: dict, steps):
+        for check in checks:
+            if not check(args):
+                return None
+        for other in flag.conflicts:
+            if args[other]:
+                if flag.on_conflict == "error":
+                    raise ValueError(f"{field} and {other} conflict with one another. Please select only one")
+                return None
+        if flag.kind == "switch":
+            return f"--{flag.flag}"
+        return f"--{flag.flag}={flag.value(args, steps) if flag.value else args[field]}"
+    return write
+
+
+COMPILED_TABLE = [compile_flag(flag) for flag in ARG_TABLE]
+TABLE_FIELDS = sorted(set().union(*(flag.fields() for flag in ARG_TABLE)))
+
+
+@functools.lru_cache(maxsize=4096)
+def compile_key(key: str) -> tuple:
+    values = json.loads(key)
+    args = dict(zip(TABLE_FIELDS, values[:-1]))
+    steps = values[-1]
+    output = []
+    for write in COMPILED_TABLE:
+        arg = write(args, steps)
+        if arg is not None:
+            output.append(arg)
+    return tuple(output)
+
+
+def compile_args(args: dict, steps: Union[int, None] = None) -> list:
+    """
+    Turns a config into the sd-scripts argv through ARG_TABLE. Only the fields the table reads are part of the key,
+    so configs that only differ in anything else share the cached output. Doesn't touch the filesystem, steps is the
+    total step count the warmup is worked out from.
+    """
+    key = json.dumps([args.get(field) for field in TABLE_FIELDS] + [steps], default=str)
+    return list(compile_key(key))
+
+
+def normalize_args(args: dict) -> dict:
+    # renames legacy fields and fills in anything the config is missing with the defaults
+    for old, new in LEGACY_NAMES.items():
+        if old in args:
+            value = args.pop(old)
+            if new not in args:
+                args[new] = value
+    for key, value in ArgStore().__dict__.items():
+        if key not in args:
+            args[key] = copy.copy(value)
+    return args
+
+
+def validate_paths(args: dict) -> None:
+    for field, ext_list, required, error in PATH_TABLE:
+        if not required and not args[field]:
+            continue
+        if not ensure_path(args[field], field, ext_list):
+            raise FileNotFoundError(error)
+
+
+def validate_options(args: dict) -> None:
+    # checks between fields that ARG_TABLE doesn't write
+    if args['retention_keep_best'] and not args['log_dir']:
+        raise ValueError("retention_keep_best needs log_dir, the loss of every epoch is read from its logs")
+    # autotune only splits the effective batch into batch size and accumulation, it never makes it bigger
+    if args['autotune_batch_size'] and args['batch_size'] * max(1, args['gradient_acc_steps'] or 1) <= 1:
+        raise ValueError("autotune_batch_size needs an effective batch size (batch_size x gradient_acc_steps) above 1, "
+                         "set batch_size to the batch size you want to train at")
+
+
+def prepare_img_folder(args: dict) -> None:
+    # swaps img_folder for the subset or rebalanced copy, doing it again for the same config is cheap
+    if args['subset_manifest']:
+        if not ensure_path(args['subset_manifest'], "subset_manifest", {"json"}):
+            raise FileNotFoundError("Failed to find the subset manifest, make sure you have the correct path")
+        args['img_folder'] = lora_subset.materialize_manifest(args['subset_manifest'])
+    if args['repeat_overrides']:
+        if isinstance(args['repeat_overrides'], str) and \
+                not ensure_path(args['repeat_overrides'], "repeat_overrides", {"json"}):
+            raise FileNotFoundError("Failed to find the repeat overrides, make sure you have the correct path")
+        if not ensure_path(args["output_folder"], "output_folder"):
+            raise FileNotFoundError("Failed to find the output folder, make sure you have the correct path")
+        args['img_folder'] = lora_balance.apply_overrides(args['img_folder'], args['repeat_overrides'],
+                                                          os.path.join(args['output_folder'], "balanced_img_folder"))
+
+
+@lora_profile.profiled
+def create_arg_space(args: dict) -> [str]:
+    normalize_args(args)
+    prepare_img_folder(args)
+    validate_paths(args)
+    validate_options(args)
+    steps = None
+    if args['warmup_lr_ratio'] and args['warmup_lr_ratio'] > 0:
+        # only the warmup needs the step count, and counting it means reading every folder
+        steps = args['max_steps'] if args['max_steps'] else find_max_steps(args)
+    return compile_args(args, steps)
+
+
+def validate_args(args: dict) -> None:
+    # the same checks create_arg_space does, without linking anything or counting steps
+    normalize_args(args)
+    validate_paths(args)
+    validate_options(args)
+    compile_args(args, 0)
+
+
+# fields that don't change what gets trained, so two configs that only differ in these share a hash
+HASH_IGNORED_FIELDS = {"save_json_folder", "load_json_path", "json_load_skip_list", "multi_run_folder", "multi_run_lease",
+                       "multi_run_wait", "save_json_only", "skip_if_trained", "gpu_placement", "telemetry_file",
+                       "autotune_batch_size", "autotune_method", "oom_retry_policy", "oom_max_retries",
+                       "tag_occurrence_txt_file", "num_workers", "persistent_workers", "log_dir", "output_folder",
+                       "watch_outputs", "watch_resize_ranks", "watch_workers", "te_cache_folder", "async_save",
+                       "async_save_queue", "async_save_staging", "retention_keep_last", "retention_keep_best",
+                       "retention_budget_gb", "retention_global_budget_gb", "retention_global_folder", "check_images",
+                       "image_check_action"}
+HASH_LENGTH = 16  # characters of the hash used in file names
+MODEL_EXTENSIONS = {"safetensors", "ckpt", "pt"}
+
+
+def file_fingerprint(path):
+    # size and modification time rather than the contents, reading every image and model on every check would be slow
+    if not path or not os.path.exists(path):
+        return path
+    stat = os.stat(path)
+    return [os.path.abspath(path), stat.st_size, stat.st_mtime_ns]
+
+
+def dataset_fingerprint(img_folder, subset_manifest=None) -> dict:
+    """
+    Fingerprints a dataset from the name, size and modification time of every file in its x_name folders, or of every
+    file a subset manifest picks. Returns the number of files in each folder next to the digest, so diffs can show
+    which folders changed. A folder that doesn't exist yet, like one a config is saved for before it's made, is
+    fingerprinted by its path alone.
+    """
+    if not subset_manifest and (not img_folder or not os.path.isdir(img_folder)):
+        return {"folders": {}, "digest": None, "missing": img_folder}
+    if subset_manifest:
+        manifest = lora_subset.load_manifest(subset_manifest)
+        folders = {folder: [file for pair in files for file in pair if file is not None]
+                   for folder, files in manifest['folders'].items()}
+    else:
+        folders = {}
+        for folder in sorted(os.listdir(img_folder)):
+            folder_path = os.path.join(img_folder, folder)
+            if not os.path.isdir(folder_path) or lora_subset.parse_folder_name(folder) is None:
+                continue
+            folders[folder] = [os.path.join(folder_path, file) for file in os.listdir(folder_path)
+                               if not file.startswith(".")]
+    digest = hashlib.sha256()
+    for folder in sorted(folders):
+        for file in sorted(folders[folder], key=os.path.basename):
+            stat = os.stat(file)
+            digest.update(f"{folder}/{os.path.basename(file)}:{stat.st_size}:{stat.st_mtime_ns}\n".encode("utf-8"))
+    return {"folders": {folder: len(files) for folder, files in sorted(folders.items())}, "digest": digest.hexdigest()}
+
+
+def canonical_config(args: dict) -> dict:
+    # the config as far as the training result goes, with the dataset and model files swapped for their fingerprints.
+    # call it before create_arg_space, which points img_folder at the linked folders
+    args = normalize_args(copy.deepcopy(args))
+    canonical = {key: value for key, value in args.items() if key not in HASH_IGNORED_FIELDS}
+    canonical['img_folder'] = dataset_fingerprint(args['img_folder'], args['subset_manifest'])
+    canonical['subset_manifest'] = None
+    if args['reg_img_folder']:
+        canonical['reg_img_folder'] = dataset_fingerprint(args['reg_img_folder'])
+    if args['repeat_overrides']:
+        canonical['repeat_overrides'] = lora_balance.load_overrides(args['repeat_overrides'])
+    for key in ("base_model", "lora_model_for_resume", "vae"):
+        canonical[key] = file_fingerprint(args[key])
+    return canonical
+
+
+def config_hash(args: dict) -> str:
+    return hashlib.sha256(json.dumps(canonical_config(args), sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+
+def trained_marker(args: dict, job_hash: str) -> str:
+    return os.path.join(args['output_folder'], f"trained-{job_hash[:HASH_LENGTH]}.json")
+
+
+def already_trained(args: dict, job_hash: str) -> bool:
+    # true when a training with this hash finished into output_folder and everything it saved is still there
+    try:
+        with open(trained_marker(args, job_hash)) as f:
+            outputs = json.load(f)['outputs']
+    except (OSError, ValueError, KeyError):
+        return False
+    return len(outputs) > 0 and all(os.path.exists(os.path.join(args['output_folder'], file)) for file in outputs)
+
+
+def record_trained(args: dict, job_hash: str, started: float) -> None:
+    # lists the models saved since the training started next to them, so the same config gets skipped next time
+    outputs = sorted(file for file in os.listdir(args['output_folder'])
+                     if file.split(".")[-1] in MODEL_EXTENSIONS
+                     and os.path.getmtime(os.path.join(args['output_folder'], file)) >= started)
+    if not outputs:
+        return
+    with open(trained_marker(args, job_hash), "w") as f:
+        json.dump({"hash": job_hash, "outputs": outputs, "config": args}, f, indent=4)
+
+
+@lora_profile.profiled
+def find_max_steps(args: dict) -> int:
+    total_steps = 0
+    folders = os.listdir(args["img_folder"])
+    for folder in folders:
+        if not os.path.isdir(os.path.join(args["img_folder"], folder)):
+            continue
+        num_repeats = folder.split("_")
+        if len(num_repeats) < 2:
+            print(f"folder {folder} is not in the correct format. Format is x_name. skipping")
+            continue
+        try:
+            num_repeats = int(num_repeats[0])
+        except ValueError:
+            print(f"folder {folder} is not in the correct format. Format is x_name. skipping")
+            continue
+        imgs = 0
+        for file in os.listdir(os.path.join(args["img_folder"], folder)):
+            if os.path.isdir(file):
+                continue
+            ext = file.split(".")
+            if ext[-1].lower() in {"png", "bmp", "gif", "jpeg", "jpg", "webp"}:
+                imgs += 1
+        total_steps += (num_repeats * imgs)
+    # steps are counted in optimizer steps, which only happen once every gradient_acc_steps batches
+    total_steps = int((total_steps / (args["batch_size"] * max(1, args["gradient_acc_steps"] or 1))) * args["num_epochs"])
+    return total_steps
+
+
+def add_misc_args(parser) -> None:
+    parser.add_argument("--save_json_path", type=str, default=None,
+                        help="Path to save a configuration json file to")
+    parser.add_argument("--load_json_path", type=str, default=None,
+                        help="Path to a json file to configure things from")
+    parser.add_argument("--telemetry_file", type=str, default=None,
+                        help="Path to a jsonl file that training telemetry gets appended to")
+    parser.add_argument("--profile", action="store_true",
+                        help="Times every phase before training starts and prints a summary of them")
+    parser.add_argument("--profile_output", type=str, default=None,
+                        help="Path to save the profile to, .pstats or .prof saves a cProfile, anything else a chrome trace json")
+    parser.add_argument("--no_metadata", action='store_true',
+                        help="do not save metadata in output model / メタデータを出力先モデルに保存しない")
+    parser.add_argument("--save_model_as", type=str, default="safetensors", choices=[None, "ckpt", "pt", "safetensors"],
+                        help="format to save the model (default is .safetensors) / モデル保存時の形式（デフォルトはsafetensors）")
+
+    parser.add_argument("--unet_lr", type=float, default=None, help="learning rate for U-Net / U-Netの学習率")
+    parser.add_argument("--text_encoder_lr", type=float, default=None,
+                        help="learning rate for Text Encoder / Text Encoderの学習率")
+    parser.add_argument("--lr_scheduler_num_cycles", type=int, default=1,
+                        help="Number of restarts for cosine scheduler with restarts / cosine with restartsスケジューラでのリスタート回数")
+    parser.add_argument("--lr_scheduler_power", type=float, default=1,
+                        help="Polynomial power for polynomial scheduler / polynomialスケジューラでのpolynomial power")
+
+    parser.add_argument("--network_weights", type=str, default=None,
+                        help="pretrained weights for network / 学習するネットワークの初期重み")
+    parser.add_argument("--network_module", type=str, default=None,
+                        help='network module to train / 学習対象のネットワークのモジュール')
+    parser.add_argument("--network_dim", type=int, default=None,
+                        help='network dimensions (depends on each network) / モジュールの次元数（ネットワークにより定義は異なります）')
+    parser.add_argument("--network_alpha", type=float, default=1,
+                        help='alpha for LoRA weight scaling, default 1 (same as network_dim for same behavior as old version) / LoRaの重み調整のalpha値、デフォルト1（旧バージョンと同じ動作をするにはnetwork_dimと同じ値を指定）')
+    parser.add_argument("--network_args", type=str, default=None, nargs='*',
+                        help='additional argmuments for network (key=value) / ネットワークへの追加の引数')
+    parser.add_argument("--network_train_unet_only", action="store_true",
+                        help="only training U-Net part / U-Net関連部分のみ学習する")
+    parser.add_argument("--network_train_text_encoder_only", action="store_true",
+                        help="only training Text Encoder part / Text Encoder関連部分のみ学習する")
+    parser.add_argument("--training_comment", type=str, default=None,
+                        help="arbitrary comment string stored in metadata / メタデータに記録する任意のコメント文字列")
+
+
+def setup_args(parser) -> None:
+    util.add_sd_models_arguments(parser)
+    util.add_dataset_arguments(parser, True, True, True)
+    util.add_training_arguments(parser, True)
+    add_misc_args(parser)
+
+
+# the names kohya_ss uses in its json files, mapped to ours
+UI_NAME_SCHEME = {"pretrained_model_name_or_path": "base_model", "logging_dir": "log_dir",
+                  "train_data_dir": "img_folder", "reg_data_dir": "reg_img_folder",
+                  "output_dir": "output_folder", "max_resolution": "train_resolution",
+                  "lr_scheduler": "scheduler", "lr_warmup": "warmup_lr_ratio",
+                  "train_batch_size": "batch_size", "epoch": "num_epochs",
+                  "save_at_n_epochs": "save_every_n_epochs", "num_cpu_threads_per_process": "num_workers",
+                  "enable_bucket": "buckets", "save_model_as": "save_as", "shuffle_caption": "shuffle_captions",
+                  "resume": "load_previous_save_state", "network_dim": "net_dim",
+                  "gradient_accumulation_steps": "gradient_acc_steps", "output_name": "change_output_name",
+                  "network_alpha": "alpha", "lr_scheduler_num_cycles": "cosine_restarts",
+                  "lr_scheduler_power": "scheduler_power"}
+
+
+@lora_profile.profiled
+def ensure_path(path, name, ext_list=None) -> bool:
+    if ext_list is None:
+        ext_list = {}
+    folder = len(ext_list) == 0
+    if path is None or not os.path.exists(path):
+        print(f"Failed to find {name}, Please make sure path is correct.")
+        return False
+    elif folder and os.path.isfile(path):
+        print(f"Path given for {name} is that of a file, please select a folder.")
+        return False
+    elif not folder and os.path.isdir(path):
+        print(f"Path given for {name} is that of a folder, please select a file.")
+        return False
+    elif not folder and path.split(".")[-1] not in ext_list:
+        print(f"Found a file for {name}, however it wasn't of the accepted types: {ext_list}")
+        return False
+    return True
+
+
+@lora_profile.profiled
+def save_json(path, obj: dict) -> None:
+    if not ensure_path(path, "save_json_path"):
+        raise FileNotFoundError("Failed to find folder to put json into, make sure you have the correct path")
+    # set these to None and False to prevent them from modifying the output when loaded back up
+    obj = dict(obj)
+    obj['multi_run_folder'] = None
+    obj['save_json_only'] = False
+    # named by hash, so saving the same config twice gives one file
+    with open(os.path.join(path, f"config-{config_hash(obj)[:HASH_LENGTH]}.json"), "w") as f:
+        json.dump(obj, f, indent=4)
+
+
+@lora_profile.profiled
+def load_json(path, obj: dict) -> dict:
+    if not ensure_path(path, "load_json_path", {"json"}):
+        raise FileNotFoundError("Failed to find the json file, make sure you have the correct path")
+    with open(path) as f:
+        json_obj = json.loads(f.read())
+    print("loaded json, setting variables...")
+    return apply_json(json_obj, obj)
+
+
+def apply_json(json_obj: dict, obj: dict) -> dict:
+    # sets every field of a loaded json on obj, fields named the way kohya_ss names them get renamed
+    for key in list(json_obj):
+        if key in UI_NAME_SCHEME:
+            json_obj[UI_NAME_SCHEME[key]] = json_obj[key]
+            if UI_NAME_SCHEME[key] in {"batch_size", "num_epochs"}:
+                try:
+                    json_obj[UI_NAME_SCHEME[key]] = int(json_obj[UI_NAME_SCHEME[key]])
+                except ValueError:
+                    print(f"attempting to load {key} from json failed as input isn't an integer")
+                    quit(1)
+
+    for key in list(json_obj):
+        if obj["json_load_skip_list"] and key in obj["json_load_skip_list"]:
+            continue
+        if key in obj:
+            if key in {"keep_tokens", "warmup_lr_ratio"}:
+                json_obj[key] = int(json_obj[key]) if json_obj[key] is not None else None
+            if key in {"learning_rate", "unet_lr", "text_encoder_lr"}:
+                json_obj[key] = float(json_obj[key]) if json_obj[key] is not None else None
+            if obj[key] != json_obj[key]:
+                print_change(key, obj[key], json_obj[key])
+                obj[key] = json_obj[key]
+    print("completed changing variables.")
+    return obj
+
+
+def print_change(value, old, new):
+    print(f"{value} changed from {old} to {new}")
+
+
+@lora_profile.profiled
+def get_occurrence_of_tags(args):
+    extension = args['caption_extension']
+    img_folder = args['img_folder']
+    output_folder = args['output_folder']
+    occurrence_dict = {}
+    print(img_folder)
+    for folder in os.listdir(img_folder):
+        print(folder)
+        if not os.path.isdir(os.path.join(img_folder, folder)):
+            continue
+        for file in os.listdir(os.path.join(img_folder, folder)):
+            if not os.path.isfile(os.path.join(img_folder, folder, file)):
+                continue
+            ext = os.path.splitext(file)[1]
+            if ext != extension:
+                continue
+            get_tags_from_file(os.path.join(img_folder, folder, file), occurrence_dict)
+    output_list = {k: v for k, v in sorted(occurrence_dict.items(), key=lambda item: item[1], reverse=True)}
+    with open(os.path.join(output_folder, f"{args['change_output_name']}.txt"), "w") as f:
+        f.write(f"Below is a list of keywords used during the training of {args['change_output_name']}:\n")
+        for k, v in output_list.items():
+            f.write(f"[{v}] {k}\n")
+
+
+def get_tags_from_file(file, occurrence_dict):
+    f = open(file)
+    temp = f.read().replace(", ", ",").split(",")
+    f.close()
+    for tag in temp:
+        if tag in occurrence_dict:
+            occurrence_dict[tag] += 1
+        else:
+            occurrence_dict[tag] = 1
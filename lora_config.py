@@ -0,0 +1,56 @@
+import argparse
+import contextlib
+import io
+
+import lora_common
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Hashes and compares training configs the way the training scripts "
+                                                 "see them, with the dataset and models fingerprinted")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    hash_parser = subparsers.add_parser("hash", help="prints the hash of every config")
+    hash_parser.add_argument("configs", type=str, nargs="+", help="json configs, from either script or kohya_ss")
+    diff_parser = subparsers.add_parser("diff", help="prints every field that differs between two configs")
+    diff_parser.add_argument("first", type=str)
+    diff_parser.add_argument("second", type=str)
+    args = parser.parse_args()
+
+    if args.command == "hash":
+        for path in args.configs:
+            print(f"{lora_common.config_hash(read_config(path))[:lora_common.HASH_LENGTH]}  {path}")
+        return
+    first = lora_common.canonical_config(read_config(args.first))
+    second = lora_common.canonical_config(read_config(args.second))
+    changes = diff_configs(first, second)
+    if not changes:
+        print("the configs train the same thing")
+        return
+    for key, old, new in changes:
+        print(f"{key}: {old} -> {new}")
+    quit(1)
+
+
+def read_config(path) -> dict:
+    # loads a json over the defaults, the same way a multi run does
+    arg_dict = lora_common.ArgStore.convert_args_to_dict()
+    arg_dict['json_load_skip_list'] = None
+    with contextlib.redirect_stdout(io.StringIO()):
+        lora_common.load_json(path, arg_dict)
+    return arg_dict
+
+
+def diff_configs(first: dict, second: dict, prefix="") -> list:
+    # (key, first value, second value) of every difference, nested dicts like the dataset fingerprint get walked into
+    changes = []
+    for key in sorted(set(first) | set(second)):
+        old, new = first.get(key), second.get(key)
+        if isinstance(old, dict) and isinstance(new, dict):
+            changes += diff_configs(old, new, f"{prefix}{key}.")
+        elif old != new:
+            changes.append((f"{prefix}{key}", old, new))
+    return changes
+
+
+if __name__ == "__main__":
+    main()
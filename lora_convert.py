@@ -0,0 +1,215 @@
+import argparse
+import itertools
+import json
+import multiprocessing
+import os
+import struct
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from lora_analyze import single_thread
+
+EXTENSIONS = (".ckpt", ".pt")
+PRECISIONS = {"float": "float32", "fp16": "float16", "bf16": "bfloat16"}
+# safetensors names of the torch dtypes
+DTYPES = {"float64": "F64", "float32": "F32", "float16": "F16", "bfloat16": "BF16", "int64": "I64", "int32": "I32",
+          "int16": "I16", "int8": "I8", "uint8": "U8", "bool": "BOOL"}
+EMA_PREFIX = "model_ema."
+MB = 1024 ** 2
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Converts .ckpt and .pt models and LoRA to .safetensors, which load "
+                                                 "faster and can be memory mapped")
+    parser.add_argument("paths", type=str, nargs="+", help=".ckpt or .pt files, or folders of them")
+    parser.add_argument("--output_folder", type=str, default=None,
+                        help="folder the .safetensors files are saved to, next to each file when not set")
+    parser.add_argument("--save_precision", type=str, default=None, choices=[None, "float", "fp16", "bf16"],
+                        help="precision to save the weights in, the precision they have now when not set")
+    parser.add_argument("--strip_ema", action="store_true", help="leaves out the EMA weights of base models")
+    parser.add_argument("--overwrite", action="store_true", help="converts files that already have a .safetensors")
+    parser.add_argument("--workers", type=int, default=min(4, os.cpu_count() or 1),
+                        help="number of files converted at once, each one takes up to the memory of its largest layer, "
+                             "or of the whole file for old ckpt files")
+    args = parser.parse_args()
+
+    files = collect_files(args.paths)
+    if not files:
+        print("no .ckpt or .pt files found")
+        quit(1)
+    if args.output_folder:
+        os.makedirs(args.output_folder, exist_ok=True)
+    jobs = []
+    for path in files:
+        save_to = output_path(path, args.output_folder)
+        if os.path.exists(save_to) and not args.overwrite:
+            print(f"skipping {os.path.basename(path)}, {save_to} already exists")
+            continue
+        jobs.append((path, save_to))
+    failed = 0
+    with ProcessPoolExecutor(max_workers=args.workers, mp_context=multiprocessing.get_context("spawn"),
+                             initializer=single_thread) as pool:
+        for (path, save_to), report in zip(jobs, pool.map(convert_file, [job[0] for job in jobs],
+                                                          [job[1] for job in jobs],
+                                                          itertools.repeat(args.save_precision),
+                                                          itertools.repeat(args.strip_ema))):
+            if report['error']:
+                failed += 1
+                print(f"failed to convert {os.path.basename(path)}: {report['error']}")
+                continue
+            print(f"{os.path.basename(path)} -> {save_to}: {report['tensors']} tensors, "
+                  f"{report['size'] / MB:.1f} MB -> {report['new_size'] / MB:.1f} MB in {report['seconds']:.1f}s, "
+                  f"verified")
+            if report['dropped']:
+                print(f"    left out {', '.join(report['dropped'])}")
+    if failed:
+        quit(1)
+
+
+def collect_files(paths) -> list:
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files += sorted(os.path.normpath(os.path.join(path, file)) for file in os.listdir(path)
+                            if file.endswith(EXTENSIONS))
+        elif path.endswith(EXTENSIONS):
+            files.append(os.path.normpath(path))
+        else:
+            print(f"skipping {path}, it isn't a .ckpt or .pt file or a folder")
+    return list(dict.fromkeys(files))
+
+
+def output_path(path, output_folder) -> str:
+    name = os.path.splitext(os.path.basename(path))[0]
+    return os.path.join(output_folder or os.path.dirname(path), f"{name}.safetensors")
+
+
+def load_checkpoint(path):
+    # memory mapped when the file was saved by torch 1.6 or newer, only the tensors that get used are read then.
+    # weights_only refuses files that pickle more than tensors, like lightning checkpoints, so those are tried again
+    # without it
+    import pickle
+    import torch
+    try:
+        return torch.load(path, map_location="cpu", mmap=True, weights_only=True)
+    except (pickle.UnpicklingError, RuntimeError):
+        pass
+    try:
+        return torch.load(path, map_location="cpu", mmap=True, weights_only=False)
+    except RuntimeError:
+        print(f"{os.path.basename(path)} can't be memory mapped, loading all of it")
+        return torch.load(path, map_location="cpu", weights_only=False)
+
+
+def split_checkpoint(checkpoint, strip_ema: bool = False):
+    """
+    Splits a loaded checkpoint into (tensors, metadata, dropped). Base models keep their weights under state_dict, next
+    to optimizer states and training counters, LoRA are a flat dict of tensors. Only tensors can go in a safetensors
+    file, so everything else is dropped, besides the step and epoch which go in the metadata.
+    """
+    import torch
+    metadata = {"format": "pt"}
+    dropped = []
+    if isinstance(checkpoint, dict) and isinstance(checkpoint.get("state_dict"), dict):
+        for key, value in checkpoint.items():
+            if key in ("global_step", "epoch") and isinstance(value, int):
+                metadata[key] = str(value)
+            elif key != "state_dict":
+                dropped.append(key)
+        checkpoint = checkpoint["state_dict"]
+    if not isinstance(checkpoint, dict):
+        raise ValueError("it doesn't hold a dict of tensors")
+    tensors = {}
+    ema = 0
+    for key, value in checkpoint.items():
+        if not isinstance(value, torch.Tensor):
+            dropped.append(key)
+        elif strip_ema and key.startswith(EMA_PREFIX):
+            ema += 1
+        else:
+            tensors[key] = value
+    if ema:
+        dropped.append(f"{ema} EMA weights")
+    return tensors, metadata, dropped
+
+
+def cast(tensor, dtype):
+    # only floating point weights change precision, things like position ids stay integers
+    if dtype is None or not tensor.is_floating_point():
+        return tensor
+    return tensor.to(dtype)
+
+
+def write_safetensors(path, tensors: dict, metadata: dict, dtype=None) -> None:
+    """
+    Writes tensors in the safetensors layout, an 8 byte header length, the json header, then the data of every tensor
+    in order. Tensors are cast and written one at a time, so only one of them is ever copied in memory, where
+    safetensors.torch.save_file needs all of them at once.
+    """
+    import torch
+    header = {"__metadata__": metadata}
+    offset = 0
+    for key, tensor in tensors.items():
+        out_dtype = dtype if dtype is not None and tensor.is_floating_point() else tensor.dtype
+        size = tensor.numel() * torch.empty(0, dtype=out_dtype).element_size()
+        header[key] = {"dtype": DTYPES[str(out_dtype).replace("torch.", "")], "shape": list(tensor.shape),
+                       "data_offsets": [offset, offset + size]}
+        offset += size
+    encoded = json.dumps(header, separators=(",", ":")).encode()
+    # the data starts 8 byte aligned, safetensors pads the header with spaces
+    encoded += b" " * (-len(encoded) % 8)
+    with open(path, "wb") as f:
+        f.write(struct.pack("<Q", len(encoded)))
+        f.write(encoded)
+        for tensor in tensors.values():
+            f.write(cast(tensor, dtype).detach().contiguous().reshape(-1).view(torch.uint8).numpy().data)
+
+
+def verify(path, tensors: dict, dtype=None) -> list:
+    # keys that didn't come back bit for bit the same, or are missing or extra
+    import torch
+    from safetensors import safe_open
+    with safe_open(path, framework="pt", device="cpu") as f:
+        keys = set(f.keys())
+        bad = sorted(keys ^ tensors.keys())
+        for key in sorted(keys & tensors.keys()):
+            saved = f.get_tensor(key)
+            expected = cast(tensors[key], dtype)
+            if saved.dtype != expected.dtype or saved.shape != expected.shape or not torch.equal(
+                    saved.reshape(-1).view(torch.uint8), expected.contiguous().reshape(-1).view(torch.uint8)):
+                bad.append(key)
+    return bad
+
+
+def convert_file(path, save_to, save_precision=None, strip_ema: bool = False) -> dict:
+    """
+    Converts one .ckpt or .pt file to save_to, then reads the result back and checks every tensor against the original.
+    The file is written next to save_to first and only renamed into place once it checks out, so a failed conversion
+    never leaves a broken .safetensors behind.
+    """
+    import torch
+    start = time.perf_counter()
+    report = {"path": path, "save_to": save_to, "error": None, "dropped": [], "tensors": 0}
+    temp = f"{save_to}.tmp"
+    try:
+        tensors, metadata, report['dropped'] = split_checkpoint(load_checkpoint(path), strip_ema)
+        if not tensors:
+            raise ValueError("it has no tensors")
+        dtype = getattr(torch, PRECISIONS[save_precision]) if save_precision else None
+        write_safetensors(temp, tensors, metadata, dtype)
+        bad = verify(temp, tensors, dtype)
+        if bad:
+            raise ValueError(f"{len(bad)} tensors didn't match after saving, like {bad[0]}")
+        os.replace(temp, save_to)
+    except Exception as e:
+        report['error'] = str(e)
+        if os.path.exists(temp):
+            os.remove(temp)
+        return report
+    report.update(tensors=len(tensors), size=os.path.getsize(path), new_size=os.path.getsize(save_to),
+                  seconds=time.perf_counter() - start)
+    return report
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,235 @@
+import argparse
+import json
+import multiprocessing
+import os
+import re
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+from lora_analyze import single_thread
+from lora_convert import load_checkpoint
+
+PRECISIONS = {"float": "float32", "fp16": "float16", "bf16": "bfloat16"}
+GB = 1024 ** 3
+MEMORY_FACTOR = 5  # copies of a layer in float32 that factoring it takes at once, the delta, U, Vh and svd workspace
+# the layers networks.lora trains, as they are named in a stable diffusion checkpoint
+UNET_PATTERN = re.compile(r"^model\.diffusion_model\.(?P<block>input_blocks\.(?P<input>\d+)\.1|middle_block\.1|"
+                          r"output_blocks\.(?P<output>\d+)\.1)\.(?P<layer>proj_in|proj_out|transformer_blocks\.\d+\."
+                          r"(attn[12]\.(to_q|to_k|to_v|to_out\.0)|ff\.net\.(0\.proj|2)))\.weight$")
+TE_PATTERN = re.compile(r"^cond_stage_model\.transformer\.(text_model\.)?encoder\.layers\.(?P<index>\d+)\."
+                        r"(?P<layer>self_attn\.(q|k|v|out)_proj|mlp\.fc[12])\.weight$")
+# the sd2 text encoder is open clip, which names its layers differently and keeps q, k and v in one weight
+V2_TE_PATTERN = re.compile(r"^cond_stage_model\.model\.transformer\.resblocks\.(?P<index>\d+)\."
+                           r"(?P<layer>attn\.in_proj_weight|attn\.out_proj\.weight|mlp\.c_fc\.weight|"
+                           r"mlp\.c_proj\.weight)$")
+V2_TE_LAYERS = {"attn.out_proj.weight": "self_attn_out_proj", "mlp.c_fc.weight": "mlp_fc1",
+                "mlp.c_proj.weight": "mlp_fc2"}
+V2_TE_SKIPPED = 23  # sd-scripts drops the last layer of the sd2 text encoder, so it never gets a LoRA
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Extracts a LoRA from the difference between a fine tuned model and "
+                                                 "the model it was trained from, runs on CPU")
+    parser.add_argument("--base", type=str, required=True, help="the model the fine tune was trained from, ckpt or "
+                                                                 "safetensors")
+    parser.add_argument("--tuned", type=str, required=True, help="the fine tuned model, ckpt or safetensors")
+    parser.add_argument("--save_to", type=str, required=True, help="the .safetensors file to save the LoRA to")
+    parser.add_argument("--rank", type=int, default=32,
+                        help="rank of every layer, or the highest rank a layer can get with --energy")
+    parser.add_argument("--energy", type=float, default=None,
+                        help="gives every layer the rank that keeps this share of its energy (squared singular "
+                             "values) instead of a fixed rank, like 0.9")
+    parser.add_argument("--min_diff", type=float, default=1e-6,
+                        help="layers that changed less than this anywhere are left out, like an untrained text "
+                             "encoder")
+    parser.add_argument("--save_precision", type=str, default="fp16", choices=["float", "fp16", "bf16"])
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="number of layers factored at once")
+    parser.add_argument("--max_memory_gb", type=float, default=None,
+                        help="most memory the layers being factored can take, fewer are done at once when over it")
+    parser.add_argument("--json", type=str, default=None, help="saves the rank and error of every layer to this file")
+    args = parser.parse_args()
+
+    if not args.save_to.endswith(".safetensors"):
+        print("--save_to has to be a .safetensors file")
+        quit(1)
+    start = time.perf_counter()
+    layers = extract(args.base, args.tuned, args.rank, args.energy, args.min_diff, args.workers,
+                     args.max_memory_gb * GB if args.max_memory_gb else None)
+    if not layers:
+        print("none of the layers LoRA train changed between the two models, nothing to save")
+        quit(1)
+    save_lora(layers, args.save_to, args.save_precision, args.rank, args.energy)
+    errors = [layer['error'] for layer in layers.values()]
+    ranks = [layer['rank'] for layer in layers.values()]
+    print(f"extracted {len(layers)} layers in {time.perf_counter() - start:.1f}s, "
+          f"mean rank {sum(ranks) / len(ranks):.1f}, mean relative error {sum(errors) / len(errors):.4f}, "
+          f"max {max(errors):.4f}, saved to {args.save_to}")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({name: {"rank": layer['rank'], "error": layer['error']} for name, layer in layers.items()},
+                      f, indent=4)
+
+
+class CheckpointReader:
+    """
+    Reads tensors of a model one at a time. safetensors files are memory mapped, and so are ckpt files saved by newer
+    versions of torch. Older ckpt files have to be loaded whole, convert them with lora_convert.py to avoid that.
+    """
+    def __init__(self, path):
+        self.file = None
+        if path.endswith(".safetensors"):
+            from safetensors import safe_open
+            self.file = safe_open(path, framework="pt", device="cpu")
+            self.tensors = None
+            return
+        checkpoint = load_checkpoint(path)
+        self.tensors = checkpoint.get("state_dict", checkpoint)
+
+    def keys(self):
+        return self.file.keys() if self.file is not None else self.tensors.keys()
+
+    def get(self, key):
+        return self.file.get_tensor(key) if self.file is not None else self.tensors[key]
+
+
+def find_layers(keys) -> dict:
+    # {lora name: (checkpoint key, rows of the weight or None for all of them)} of every layer a LoRA could train
+    layers = {}
+    for key in keys:
+        match = UNET_PATTERN.match(key)
+        if match:
+            # ldm counts input and output blocks over the whole unet, diffusers in 3 per block. output block 2 has
+            # an upsampler in place of attention, so it never matches
+            if match.group("input"):
+                index = int(match.group("input")) - 1
+                block = f"down_blocks_{index // 3}_attentions_{index % 3}"
+            elif match.group("output"):
+                index = int(match.group("output"))
+                block = f"up_blocks_{index // 3}_attentions_{index % 3}"
+            else:
+                block = "mid_block_attentions_0"
+            layers[f"lora_unet_{block}_{match.group('layer').replace('.', '_')}"] = (key, None)
+            continue
+        match = TE_PATTERN.match(key)
+        if match:
+            layers[f"lora_te_text_model_encoder_layers_{match.group('index')}_"
+                   f"{match.group('layer').replace('.', '_')}"] = (key, None)
+            continue
+        match = V2_TE_PATTERN.match(key)
+        if match and int(match.group("index")) != V2_TE_SKIPPED:
+            prefix = f"lora_te_text_model_encoder_layers_{match.group('index')}_"
+            if match.group("layer") == "attn.in_proj_weight":
+                for i, projection in enumerate("qkv"):
+                    layers[f"{prefix}self_attn_{projection}_proj"] = (key, i)
+            else:
+                layers[prefix + V2_TE_LAYERS[match.group("layer")]] = (key, None)
+    return layers
+
+
+def read_weight(reader: CheckpointReader, key, part):
+    weight = reader.get(key)
+    if part is not None:
+        rows = weight.shape[0] // 3
+        weight = weight[part * rows:(part + 1) * rows]
+    return weight
+
+
+def factor(delta, rank: int, energy=None, min_diff: float = 1e-6):
+    """
+    Truncated svd of the change of one layer, as the (up, down) of a LoRA module with alpha equal to its rank, so
+    up @ down is the change itself. With energy, the rank is the smallest that keeps that share of the squared
+    singular values, capped at rank, otherwise a randomized svd only works out the singular values it keeps. Returns
+    None when the layer barely changed.
+    """
+    import torch
+    if delta.abs().max().item() < min_diff:
+        return None
+    matrix = delta.flatten(1)
+    rank = min(rank, *matrix.shape)
+    if energy is not None:
+        u, s, vh = torch.linalg.svd(matrix, full_matrices=False)
+        kept = s.square().cumsum(0) / s.square().sum().clamp_min(1e-24)
+        rank = min(rank, int((kept < energy).sum()) + 1)
+    else:
+        u, s, v = torch.svd_lowrank(matrix, q=min(rank + 8, *matrix.shape), niter=4)
+        vh = v.T
+    total = matrix.square().sum().item()
+    kept = s[:rank].square().sum().item()
+    up = (u[:, :rank] * s[:rank]).contiguous()
+    down = vh[:rank].contiguous()
+    if delta.dim() == 4:
+        up = up[:, :, None, None]
+        down = down.reshape(rank, *delta.shape[1:])
+    return {"up": up, "down": down, "rank": rank, "error": max(0.0, 1 - kept / max(total, 1e-24)) ** 0.5}
+
+
+def extract(base_path, tuned_path, rank: int, energy=None, min_diff: float = 1e-6, workers=None, max_memory=None):
+    """
+    Factors the change of every layer LoRA train into {lora name: factor(...)}. Layers are read from both models one at
+    a time and factored in a pool of processes, and no more are read ahead than the pool can take, or than fit in
+    max_memory bytes, so memory use stays around a few layers no matter the size of the models.
+    """
+    base = CheckpointReader(base_path)
+    tuned = CheckpointReader(tuned_path)
+    base_keys = set(base.keys())
+    layers = find_layers(tuned.keys())
+    if not layers:
+        raise ValueError(f"{tuned_path} doesn't look like a stable diffusion checkpoint, none of its layers match")
+    workers = workers or os.cpu_count()
+    results = {}
+    pending = {}
+    used = 0
+
+    def collect(return_when):
+        nonlocal used
+        done, _ = wait(pending, return_when=return_when)
+        for future in done:
+            name, cost = pending.pop(future)
+            used -= cost
+            result = future.result()
+            if result is not None:
+                results[name] = result
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"),
+                             initializer=single_thread) as pool:
+        for name, (key, part) in sorted(layers.items()):
+            if key not in base_keys:
+                print(f"skipping {name}, the base model doesn't have {key}")
+                continue
+            tuned_weight = read_weight(tuned, key, part)
+            base_weight = read_weight(base, key, part)
+            if tuned_weight.shape != base_weight.shape:
+                raise ValueError(f"{key} is {tuple(base_weight.shape)} in the base model but "
+                                 f"{tuple(tuned_weight.shape)} in the fine tune, they aren't the same architecture")
+            cost = tuned_weight.numel() * 4 * MEMORY_FACTOR
+            while pending and (len(pending) >= workers * 2 or (max_memory and used + cost > max_memory)):
+                collect(FIRST_COMPLETED)
+            delta = tuned_weight.float() - base_weight.float()
+            pending[pool.submit(factor, delta, rank, energy, min_diff)] = (name, cost)
+            used += cost
+        while pending:
+            collect(FIRST_COMPLETED)
+    skipped = len(layers) - len(results)
+    if skipped:
+        print(f"left out {skipped} layers that didn't change or aren't in the base model")
+    return dict(sorted(results.items()))
+
+
+def save_lora(layers: dict, save_to, save_precision, rank: int, energy=None) -> None:
+    # the same keys networks.lora saves, alpha is the rank of each layer so the LoRA applies the change at full strength
+    import torch
+    from safetensors.torch import save_file
+    dtype = getattr(torch, PRECISIONS[save_precision])
+    state_dict = {}
+    for name, layer in layers.items():
+        state_dict[f"{name}.lora_up.weight"] = layer['up'].to(dtype)
+        state_dict[f"{name}.lora_down.weight"] = layer['down'].to(dtype)
+        state_dict[f"{name}.alpha"] = torch.tensor(layer['rank']).to(dtype)
+    dim = "Dynamic" if energy is not None else str(rank)
+    metadata = {"ss_network_module": "networks.lora", "ss_network_dim": dim, "ss_network_alpha": dim}
+    if os.path.dirname(save_to):
+        os.makedirs(os.path.dirname(save_to), exist_ok=True)
+    save_file(state_dict, save_to, metadata)
+
+
+if __name__ == "__main__":
+    main()
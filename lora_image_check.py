@@ -0,0 +1,205 @@
+import argparse
+import hashlib
+import io
+import json
+import multiprocessing
+import os
+import shutil
+from concurrent.futures import ProcessPoolExecutor
+
+import lora_subset
+
+CACHE_FILE = ".image_check.json"
+QUARANTINE_FOLDER = "quarantine"
+ACTIONS = {"report", "quarantine"}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Decodes every image of a dataset to find the ones that would crash "
+                                                 "a training, and checks their captions")
+    parser.add_argument("--img_folder", type=str, required=True, help="the img folder, laid out as x_name folders")
+    parser.add_argument("--reg_img_folder", type=str, default=None, help="the reg img folder, its captions aren't "
+                                                                          "checked")
+    parser.add_argument("--caption_extension", type=str, default=".txt")
+    parser.add_argument("--quarantine", type=str, default=None,
+                        help="moves images that can't be read, and their captions, into this folder")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="number of processes to decode with")
+    parser.add_argument("--json", type=str, default=None, help="saves every problem found to this json file")
+    args = parser.parse_args()
+
+    reports = {}
+    for folder, caption_extension in ((args.img_folder, args.caption_extension), (args.reg_img_folder, None)):
+        if not folder:
+            continue
+        reports[folder] = check_folder(folder, caption_extension, args.workers)
+        print_report(folder, reports[folder])
+        if args.quarantine and reports[folder]['corrupt']:
+            quarantine(folder, reports[folder], args.quarantine, args.caption_extension)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(reports, f, indent=4)
+    if not args.quarantine and any(report['corrupt'] for report in reports.values()):
+        quit(1)
+
+
+def find_images(folder) -> list:
+    # paths relative to folder of every image in its x_name folders, the ones sd-scripts trains on
+    images = []
+    for sub_folder in sorted(os.listdir(folder)):
+        path = os.path.join(folder, sub_folder)
+        if not os.path.isdir(path) or lora_subset.parse_folder_name(sub_folder) is None:
+            continue
+        images += [os.path.join(sub_folder, file) for file in sorted(os.listdir(path))
+                   if os.path.splitext(file)[1][1:].lower() in lora_subset.IMG_EXTENSIONS]
+    return images
+
+
+def check_image(path):
+    """
+    Reads and fully decodes one image the way the dataloader will, returning (sha1 of the file, error or None).
+    Opening an image only reads its header, a truncated file only fails once the pixels are decoded.
+    """
+    from PIL import Image, UnidentifiedImageError
+    try:
+        with open(path, "rb") as f:
+            data = f.read()
+    except OSError as e:
+        return None, str(e)
+    digest = hashlib.sha1(data).hexdigest()
+    try:
+        with Image.open(io.BytesIO(data)) as image:
+            image.load()
+            if image.width == 0 or image.height == 0:
+                return digest, "the image is empty"
+    except UnidentifiedImageError:
+        return digest, "it isn't an image, or isn't in a format Pillow can read"
+    except Exception as e:
+        return digest, f"{type(e).__name__}: {e}"
+    return digest, None
+
+
+def load_cache(folder) -> dict:
+    try:
+        with open(os.path.join(folder, CACHE_FILE)) as f:
+            cache = json.load(f)
+        return {"files": cache.get("files", {}), "results": cache.get("results", {})}
+    except (OSError, ValueError):
+        return {"files": {}, "results": {}}
+
+
+def save_cache(folder, cache: dict) -> None:
+    path = os.path.join(folder, CACHE_FILE)
+    try:
+        with open(f"{path}.tmp", "w") as f:
+            json.dump(cache, f)
+        os.replace(f"{path}.tmp", path)
+    except OSError as e:
+        print(f"couldn't save the image check cache to {path}: {e}")
+
+
+def check_folder(folder, caption_extension=None, workers=None) -> dict:
+    """
+    Checks every image of a dataset folder in a pool of processes. Results are cached in the folder by the hash of
+    each file, and files whose size and modification time didn't change since the last check aren't read again, so
+    only new or changed images get decoded. Returns the images that couldn't be read as {path: error}, and the images
+    with a missing or empty caption when caption_extension is given.
+    """
+    images = find_images(folder)
+    cache = load_cache(folder)
+    files = {}
+    errors = {}
+    unchecked = []
+    for image in images:
+        stat = os.stat(os.path.join(folder, image))
+        cached = cache['files'].get(image)
+        if cached and cached[:2] == [stat.st_size, stat.st_mtime_ns] and cached[2] in cache['results']:
+            files[image] = cached
+            errors[image] = cache['results'][cached[2]]
+        else:
+            unchecked.append((image, [stat.st_size, stat.st_mtime_ns]))
+    if unchecked:
+        print(f"decoding {len(unchecked)} new images in {folder}")
+        with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+            for (image, stat), (digest, error) in zip(unchecked, pool.map(
+                    check_image, [os.path.join(folder, image) for image, _ in unchecked], chunksize=16)):
+                # files that couldn't be opened at all aren't cached, they get another try next time
+                if digest is not None:
+                    files[image] = stat + [digest]
+                    cache['results'][digest] = error
+                errors[image] = error
+    save_cache(folder, {"files": files, "results": {digest: cache['results'][digest] for _, _, digest in
+                                                    files.values()}})
+    corrupt = {image: error for image, error in errors.items() if error is not None}
+    missing, empty = [], []
+    if caption_extension:
+        for image in (image for image in images if image not in corrupt):
+            caption = os.path.join(folder, os.path.splitext(image)[0] + caption_extension)
+            if not os.path.exists(caption):
+                missing.append(image)
+            elif os.path.getsize(caption) == 0 or not read_caption(caption):
+                empty.append(image)
+    return {"images": len(images), "checked": len(unchecked), "corrupt": corrupt, "missing_captions": missing,
+            "empty_captions": empty}
+
+
+def read_caption(path) -> str:
+    with open(path, "r", encoding="utf-8", errors="replace") as f:
+        return f.read().strip()
+
+
+def print_report(folder, report: dict) -> None:
+    print(f"{folder}: {report['images']} images, {len(report['corrupt'])} can't be read, "
+          f"{len(report['missing_captions'])} missing captions, {len(report['empty_captions'])} empty captions")
+    for image, error in report['corrupt'].items():
+        print(f"    can't read {image}: {error}")
+    # sd-scripts trains an image without a caption on the class token of its folder, so these are only warnings
+    for image in report['missing_captions'][:20]:
+        print(f"    no caption for {image}")
+    for image in report['empty_captions'][:20]:
+        print(f"    empty caption for {image}")
+    hidden = max(0, len(report['missing_captions']) - 20) + max(0, len(report['empty_captions']) - 20)
+    if hidden:
+        print(f"    and {hidden} more captions")
+
+
+def quarantine(folder, report: dict, quarantine_folder, caption_extension) -> None:
+    # moves the images that can't be read, with their captions, into quarantine_folder keeping their x_name folders
+    for image in report['corrupt']:
+        for file in (image, os.path.splitext(image)[0] + caption_extension):
+            src = os.path.join(folder, file)
+            if not os.path.exists(src):
+                continue
+            dst = os.path.join(quarantine_folder, os.path.basename(os.path.normpath(folder)), file)
+            os.makedirs(os.path.dirname(dst), exist_ok=True)
+            shutil.move(src, dst)
+        print(f"moved {image} into {quarantine_folder}")
+
+
+def check(arg_dict: dict) -> bool:
+    # used by the training scripts before a training, does nothing unless check_images is set. returns False when an
+    # image can't be read and image_check_action is report, the training should be skipped then
+    if not arg_dict['check_images']:
+        return True
+    if arg_dict['image_check_action'] not in ACTIONS:
+        raise ValueError(f"image_check_action has to be one of {', '.join(sorted(ACTIONS))}")
+    passed = True
+    for folder, caption_extension in ((arg_dict['img_folder'], arg_dict['caption_extension']),
+                                      (arg_dict['reg_img_folder'], None)):
+        if not folder or not os.path.isdir(folder):
+            continue
+        report = check_folder(folder, caption_extension)
+        print_report(folder, report)
+        if not report['corrupt']:
+            continue
+        if arg_dict['image_check_action'] == "quarantine":
+            quarantine(folder, report, os.path.join(arg_dict['output_folder'], QUARANTINE_FOLDER),
+                       arg_dict['caption_extension'])
+        else:
+            print(f"{len(report['corrupt'])} images in {folder} can't be read, fix or remove them, or set "
+                  f"image_check_action to quarantine")
+            passed = False
+    return passed
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+import argparse
+import contextlib
+import io
+import re
+import time
+from typing import Union
+
+import train_network
+import lora_common
+from lora_common import create_arg_space, find_max_steps, get_occurrence_of_tags, save_json, config_hash
+import lora_telemetry
+import lora_profile
+import lora_placement
+import lora_autotune
+import lora_retry
+import lora_watch
+import lora_te_cache
+import lora_async_save
+import lora_retention
+import lora_image_check
+
+# matches the "120/1000 [01:02<07:40," part of a tqdm progress bar
+PROGRESS_PATTERN = re.compile(r"(\d+)/(\d+) \[([\d:]+)<([\d:?]+)")
+# autotune_write_back is a json the autotuned batch size gets written back to, the queued file of a multi run.
+# profile and profile_output are read by the front ends, which turn profiling on before loading the config
+DEFAULT_OPTIONS = {"telemetry_file": None, "save_json_path": None, "profile": False, "profile_output": None,
+                   "autotune_write_back": None}
+# exit codes of a job run through main, anything else means it failed. unplaced is a job gpu_placement found no card
+# for, a multi run leaves those for another machine
+EXIT_CODES = {"done": 0, "skipped": 3, "unplaced": 4}
+
+
+def main():
+    # runs one job from a json holding the whole config, used by lora_server.py to train each job in its own process
+    parser = argparse.ArgumentParser(description="Trains a single job from a json config")
+    parser.add_argument("config", type=str, help="json config of the job")
+    args = parser.parse_args()
+    arg_dict = lora_common.ArgStore.convert_args_to_dict()
+    arg_dict['json_load_skip_list'] = None
+    lora_common.load_json(args.config, arg_dict)
+    quit(EXIT_CODES[train_job(arg_dict, dict(DEFAULT_OPTIONS))])
+
+
+def to_seconds(text) -> Union[int, None]:
+    # "07:40" or "1:07:40" from a tqdm bar, "?" before it knows
+    if not text or "?" in text:
+        return None
+    seconds = 0
+    for part in text.split(":"):
+        seconds = seconds * 60 + int(part)
+    return seconds
+
+
+def read_config(body) -> dict:
+    """
+    Builds a full config out of a json object shaped like ArgStore, loaded over the defaults the same way a json file
+    is, and checked the same way create_arg_space checks it. Raises ValueError with everything that's wrong.
+    """
+    if not isinstance(body, dict):
+        raise ValueError("a config has to be a json object")
+    unknown = sorted(key for key in body if key not in lora_common.ArgStore().__dict__
+                     and key not in lora_common.UI_NAME_SCHEME)
+    if unknown:
+        raise ValueError(f"unknown fields: {', '.join(unknown)}")
+    arg_dict = lora_common.ArgStore.convert_args_to_dict()
+    arg_dict['json_load_skip_list'] = None
+    loading, checking = io.StringIO(), io.StringIO()
+    try:
+        with contextlib.redirect_stdout(loading):
+            lora_common.apply_json(dict(body), arg_dict)
+        with contextlib.redirect_stdout(checking):
+            lora_common.validate_args(arg_dict)
+    except (ValueError, FileNotFoundError, TypeError) as e:
+        raise ValueError("\n".join(filter(None, [checking.getvalue().strip(), str(e)])))
+    except SystemExit:
+        # apply_json quits on a batch size or epoch count that isn't a number, the last thing it printed says which
+        raise ValueError(loading.getvalue().strip().splitlines()[-1])
+    return arg_dict
+
+
+def train_job(arg_dict: dict, options: dict) -> str:
+    """
+    Runs one job the same way for every front end, from the checks before it to recording it as trained. Returns done,
+    skipped, or unplaced when gpu_placement found no card that can run it. With save_json_only set, the config is
+    checked and saved without training it.
+    """
+    parser = argparse.ArgumentParser()
+    lora_common.setup_args(parser)
+    if not arg_dict['save_json_only'] and not lora_image_check.check(arg_dict):
+        print("Skipping this training session.")
+        return "skipped"
+    if arg_dict['autotune_batch_size']:
+        lora_common.validate_options(arg_dict)
+        lora_autotune.autotune(arg_dict, lora_autotune.make_oracle(
+            arg_dict, lambda d: parser.parse_args(create_arg_space(d)), train_network.train))
+        if options['autotune_write_back']:
+            lora_autotune.write_back(options['autotune_write_back'], arg_dict)
+    if options['save_json_path'] or arg_dict["save_json_folder"]:
+        save_json(options['save_json_path'] if options['save_json_path'] else arg_dict['save_json_folder'], arg_dict)
+    job_hash = config_hash(arg_dict)
+    if not arg_dict['save_json_only'] and arg_dict['skip_if_trained'] and \
+            lora_common.already_trained(arg_dict, job_hash):
+        print(f"this config has already been trained into {arg_dict['output_folder']}, "
+              f"skipping this training session.")
+        return "skipped"
+    telemetry = lora_telemetry.Telemetry(options['telemetry_file'] or arg_dict['telemetry_file'])
+    # the dataset scan, timed for the telemetry along with the step count it needs
+    scan_start = time.perf_counter()
+    args = create_arg_space(arg_dict)
+    steps = lora_telemetry.count_steps(arg_dict, find_max_steps) if telemetry.path else None
+    scan_time = time.perf_counter() - scan_start
+    with lora_profile.span("parse_args"):
+        args = parser.parse_args(args)
+    if arg_dict['tag_occurrence_txt_file']:
+        get_occurrence_of_tags(arg_dict)
+    lora_profile.report()
+    if arg_dict['save_json_only']:
+        return "done"
+    if arg_dict['gpu_placement'] and not lora_placement.pin_job(arg_dict):
+        print("Skipping this training session.")
+        return "unplaced"
+    started = time.time()
+    with lora_te_cache.cache(arg_dict), lora_retention.retain(arg_dict), lora_watch.watch(arg_dict), \
+            lora_async_save.async_saves(arg_dict), telemetry.job(arg_dict, job_hash, steps, scan_time, find_max_steps):
+        lora_retry.run_with_retries(arg_dict, args, lambda d: parser.parse_args(create_arg_space(d)),
+                                    telemetry.attempt(train_network.train))
+    lora_common.record_trained(arg_dict, job_hash, started)
+    return "done"
+
+
+if __name__ == "__main__":
+    main()
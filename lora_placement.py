@@ -0,0 +1,111 @@
+# minimum compute capability an option needs to work, or to not crawl, on a card
+REQUIREMENTS = {
+    "mixed_precision=bf16": (8, 0),  # bf16 math only exists from ampere (30X0) on
+    "xformers": (7, 0),  # older cards fall back to xformers' slow kernels
+    "use_8bit_adam": (6, 0),  # the oldest cards the bitsandbytes fix for 10X0 cards covers
+}
+
+GB = 1024 ** 3
+
+
+def get_devices() -> list:
+    # devices in the same format installables/probe.py caches them in
+    import torch
+    devices = []
+    if not torch.cuda.is_available():
+        return devices
+    for i in range(torch.cuda.device_count()):
+        props = torch.cuda.get_device_properties(i)
+        devices.append({"index": i, "name": props.name, "compute_capability": f"{props.major}.{props.minor}",
+                        "total_memory": props.total_memory})
+    return devices
+
+
+def compute_capability_value(cc) -> tuple:
+    major, minor = str(cc).split(".")
+    return int(major), int(minor)
+
+
+def estimate_vram_bytes(args: dict) -> int:
+    # rough memory model, fp16 sd1 weights plus activations that scale with the batch and the pixel count.
+    # only meant to rule out cards that obviously can't fit a job, it is not exact
+    base = 3.0 * GB
+    per_image = 1.1 * GB * (args['train_resolution'] / 512) ** 2
+    if args['gradient_checkpointing']:
+        per_image /= 3
+    if args['xformers']:
+        per_image *= 0.6
+    if args['mixed_precision'] not in {"fp16", "bf16"}:
+        base *= 2
+        per_image *= 2
+    # lora weights with their gradients and adam states, sd1 LoRA have about 0.75M params per dim
+    network = args['net_dim'] * 0.75e6 * (4 + 4 + (2 if args['use_8bit_adam'] else 8))
+    return int(base + per_image * args['batch_size'] + network)
+
+
+def requirements(args: dict) -> dict:
+    needed = (0, 0)
+    reasons = []
+    for option, cc in REQUIREMENTS.items():
+        key, _, value = option.partition("=")
+        if args.get(key) and (not value or str(args[key]) == value):
+            reasons.append(option)
+            needed = max(needed, cc)
+    return {"compute_capability": needed, "reasons": reasons, "memory": estimate_vram_bytes(args)}
+
+
+def is_compatible(args: dict, device: dict, needs=None) -> bool:
+    needs = needs if needs else requirements(args)
+    return compute_capability_value(device["compute_capability"]) >= needs["compute_capability"] and \
+        device["total_memory"] >= needs["memory"]
+
+
+def pick_device(args: dict, devices: list):
+    # the most capable device that can run the job, None when none of them can
+    needs = requirements(args)
+    compatible = [device for device in devices if is_compatible(args, device, needs)]
+    if not compatible:
+        return None
+    return max(compatible, key=lambda d: (compute_capability_value(d["compute_capability"]), d["total_memory"]))
+
+
+def place_jobs(jobs: list, devices: list) -> list:
+    """
+    Assigns every job to a device for running them side by side, returns a device (or None) for every job in order.
+    Jobs with the strictest needs are placed first, each on the least capable device that can run it with the
+    fewest jobs so far, which keeps the newer cards free for the jobs that need them.
+    """
+    needs = [requirements(args) for args in jobs]
+    load = {device["index"]: 0 for device in devices}
+    placement = [None] * len(jobs)
+    order = sorted(range(len(jobs)), key=lambda i: (needs[i]["compute_capability"], needs[i]["memory"]), reverse=True)
+    for i in order:
+        compatible = [device for device in devices if is_compatible(jobs[i], device, needs[i])]
+        if not compatible:
+            continue
+        device = min(compatible, key=lambda d: (load[d["index"]], compute_capability_value(d["compute_capability"]),
+                                                d["total_memory"]))
+        load[device["index"]] += 1
+        placement[i] = device
+    return placement
+
+
+def describe_incompatible(args: dict, devices: list) -> str:
+    needs = requirements(args)
+    cc = ".".join(str(v) for v in needs["compute_capability"])
+    return f"no GPU can run this config, it needs compute capability {cc} for {needs['reasons']} and about " \
+           f"{needs['memory'] / GB:.1f}GB of vram. GPUs found: " + \
+           ", ".join(f"{d['name']} ({d['compute_capability']}, {d['total_memory'] / GB:.1f}GB)" for d in devices)
+
+
+def pin_job(args: dict, devices=None):
+    # picks a device for the job and makes it the current cuda device, returns the device or None
+    import torch
+    devices = devices if devices is not None else get_devices()
+    device = pick_device(args, devices)
+    if device is None:
+        print(describe_incompatible(args, devices))
+        return None
+    torch.cuda.set_device(device["index"])
+    print(f"placing training on GPU {device['index']} ({device['name']})")
+    return device
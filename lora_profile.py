@@ -0,0 +1,104 @@
+import cProfile
+import functools
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+_profiler = None
+
+
+class Profiler:
+    # Records nested timing spans, and optionally a cProfile of everything in between enable and report
+    def __init__(self, output=None):
+        self.output = output
+        self.spans = []  # (path, start, duration, thread id) in the order they finished
+        self.stack = []
+        self.origin = time.perf_counter()
+        self.cprofile = None
+        if output and os.path.splitext(output)[1] in {".pstats", ".prof"}:
+            self.cprofile = cProfile.Profile()
+            self.cprofile.enable()
+
+    @contextmanager
+    def span(self, name: str):
+        self.stack.append(name)
+        path = "/".join(self.stack)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.spans.append((path, start - self.origin, time.perf_counter() - start, threading.get_ident()))
+            self.stack.pop()
+
+    def summary(self) -> str:
+        totals = {}
+        first_start = {}
+        for path, start, duration, _ in self.spans:
+            calls, total = totals.get(path, (0, 0.0))
+            totals[path] = (calls + 1, total + duration)
+            first_start[path] = min(start, first_start.get(path, start))
+        wall = time.perf_counter() - self.origin
+        width = max([len("phase")] + [len(path.split("/")[-1]) + 2 * path.count("/") for path in totals])
+        lines = [f"{'phase':<{width}}  {'calls':>6}  {'total s':>9}  {'mean ms':>9}  {'% wall':>6}"]
+        # parents always start before their children, so this keeps children right under their parents
+        for path in sorted(totals, key=first_start.get):
+            calls, total = totals[path]
+            name = "  " * path.count("/") + path.split("/")[-1]
+            lines.append(f"{name:<{width}}  {calls:>6}  {total:>9.3f}  {total / calls * 1000:>9.2f}  "
+                         f"{total / wall * 100 if wall else 0:>5.1f}%")
+        lines.append(f"total wall time {wall:.3f}s")
+        return "\n".join(lines)
+
+    def save(self) -> None:
+        if not self.output:
+            return
+        if self.cprofile is not None:
+            self.cprofile.disable()
+            self.cprofile.dump_stats(self.output)
+            return
+        # anything that isn't a pstats file is written as a chrome trace, open it in chrome://tracing or perfetto
+        events = [{"name": path.split("/")[-1], "cat": "phase", "ph": "X", "ts": start * 1e6, "dur": duration * 1e6,
+                   "pid": os.getpid(), "tid": tid, "args": {"path": path}}
+                  for path, start, duration, tid in self.spans]
+        with open(self.output, "w") as f:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
+
+
+def enable(output=None) -> Profiler:
+    global _profiler
+    _profiler = Profiler(output)
+    return _profiler
+
+
+def report() -> None:
+    # prints the summary, writes the output file and turns profiling back off so training isn't profiled
+    global _profiler
+    if _profiler is None:
+        return
+    profiler, _profiler = _profiler, None
+    profiler.save()
+    print(profiler.summary())
+    if profiler.output:
+        print(f"saved profile to {profiler.output}")
+
+
+@contextmanager
+def span(name: str):
+    if _profiler is None:
+        yield
+        return
+    with _profiler.span(name):
+        yield
+
+
+def profiled(func):
+    # times every call of func as a span named after it, costs a single check when profiling is off
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if _profiler is None:
+            return func(*args, **kwargs)
+        with _profiler.span(func.__name__):
+            return func(*args, **kwargs)
+    return wrapper
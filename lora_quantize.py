@@ -0,0 +1,217 @@
+import argparse
+import itertools
+import json
+import math
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from lora_analyze import collect_files, single_thread
+
+METADATA_KEY = "lora_quantization"  # json of the bits, original dtype and shapes, only set on quantized files
+QUANT_SUFFIX = ".quant"
+SCALE_SUFFIX = ".scale"
+PRECISIONS = {"float": "float32", "fp16": "float16", "bf16": "bfloat16"}
+MB = 1024 ** 2
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Quantizes LoRA to int8 or 4 bit per channel for smaller files, and "
+                                                 "turns them back into regular LoRA, runs on CPU")
+    parser.add_argument("paths", type=str, nargs="+", help=".safetensors files, or folders of them")
+    parser.add_argument("--bits", type=int, default=8, choices=[8, 4], help="bits per weight of the quantized files")
+    parser.add_argument("--output_folder", type=str, default=None,
+                        help="folder the new files are saved to, next to each file when not set")
+    parser.add_argument("--dequantize", action="store_true",
+                        help="turns quantized files back into regular LoRA that anything can load")
+    parser.add_argument("--save_precision", type=str, default=None, choices=[None, "float", "fp16", "bf16"],
+                        help="precision of dequantized files, the precision the LoRA had before when not set")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="number of processes to convert with")
+    parser.add_argument("--worst_layers", type=int, default=0,
+                        help="number of layers with the highest error to print for each file")
+    parser.add_argument("--json", type=str, default=None, help="saves the error of every layer to this json file")
+    args = parser.parse_args()
+
+    files = collect_files(args.paths)
+    if not files:
+        print("no .safetensors files found")
+        quit(1)
+    if args.output_folder:
+        os.makedirs(args.output_folder, exist_ok=True)
+    with ProcessPoolExecutor(max_workers=args.workers, mp_context=multiprocessing.get_context("spawn"),
+                             initializer=single_thread) as pool:
+        if args.dequantize:
+            for path, save_to in zip(files, pool.map(dequantize_file, files, itertools.repeat(args.output_folder),
+                                                     itertools.repeat(args.save_precision))):
+                print(f"{os.path.basename(path)} -> {save_to}" if save_to else
+                      f"skipping {os.path.basename(path)}, it isn't quantized")
+            return
+        reports = [report for report in pool.map(quantize_file, files, itertools.repeat(args.bits),
+                                                 itertools.repeat(args.output_folder)) if report is not None]
+    print_table(reports, args.worst_layers)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(reports, f, indent=4)
+
+
+def quantize(weight, bits: int, rows_first: bool = True):
+    """
+    Symmetric per channel quantization of a weight flattened to a matrix, every channel gets its own scale so its
+    largest weight lands on the largest quantized value. Channels are rows, or columns with rows_first off, which is
+    how lora_up weights get one scale per rank like lora_down weights do. 4 bit values are stored two to a byte, offset
+    to be unsigned.
+    """
+    import torch
+    matrix = weight.float().flatten(1)
+    if not rows_first:
+        matrix = matrix.T
+    limit = 2 ** (bits - 1) - 1
+    scale = matrix.abs().amax(1).clamp_min(1e-12) / limit
+    quantized = torch.round(matrix / scale[:, None]).clamp(-limit, limit)
+    if bits == 8:
+        return quantized.to(torch.int8), scale
+    quantized = (quantized + 8).to(torch.uint8)
+    if quantized.shape[1] % 2:
+        quantized = torch.nn.functional.pad(quantized, (0, 1))
+    return quantized[:, 0::2] | (quantized[:, 1::2] << 4), scale
+
+
+def dequantize(quantized, scale, bits: int, shape, dtype, rows_first: bool = True):
+    import torch
+    if bits == 4:
+        columns = math.prod(shape) // len(scale)
+        quantized = torch.stack([quantized & 15, quantized >> 4], dim=2).flatten(1)[:, :columns].to(torch.int8) - 8
+    matrix = quantized.float() * scale[:, None]
+    if not rows_first:
+        matrix = matrix.T
+    return matrix.reshape(shape).to(dtype).contiguous()
+
+
+def relative_error(up, down, new_up, new_down) -> float:
+    # ||U D - U' D'|| / ||U D|| of the weight change a module applies, worked out from dim x dim products the same way
+    # lora_analyze compares LoRA, in double precision since the errors are tiny next to the norms
+    import torch
+    up, down, new_up, new_down = (matrix.double().flatten(1) for matrix in (up, down, new_up, new_down))
+    original = torch.trace((up.T @ up) @ (down @ down.T))
+    cross = torch.trace((up.T @ new_up) @ (new_down @ down.T))
+    new = torch.trace((new_up.T @ new_up) @ (new_down @ new_down.T))
+    return ((original - 2 * cross + new).clamp_min(0) / original.clamp_min(1e-24)).sqrt().item()
+
+
+def output_path(path, output_folder, suffix) -> str:
+    name = os.path.splitext(os.path.basename(path))[0]
+    for bits in (8, 4):
+        if name.endswith(f"-int{bits}"):
+            name = name[:-len(f"-int{bits}")]
+    return os.path.join(output_folder or os.path.dirname(path), f"{name}-{suffix}.safetensors")
+
+
+def quantize_file(path, bits: int = 8, output_folder=None):
+    """
+    Quantizes the lora_up and lora_down weights of a LoRA into path-int8.safetensors or path-int4.safetensors, every
+    other tensor is kept as it is. The file is read a module at a time, so only the quantized copy is ever fully in
+    memory. Returns the file sizes and the relative error of the weight change of every module, None when the file is
+    already quantized.
+    """
+    from safetensors import safe_open
+    from safetensors.torch import save_file
+    tensors = {}
+    shapes = {}
+    errors = {}
+    with safe_open(path, framework="pt", device="cpu") as f:
+        metadata = dict(f.metadata() or {})
+        if METADATA_KEY in metadata:
+            print(f"skipping {os.path.basename(path)}, it's already quantized")
+            return None
+        keys = set(f.keys())
+        dtype = None
+        for key in sorted(keys):
+            if key.endswith(".lora_up.weight") or key.endswith(".lora_down.weight"):
+                continue
+            tensors[key] = f.get_tensor(key)
+        for key in sorted(keys):
+            if not key.endswith(".lora_down.weight"):
+                continue
+            name = key[:-len(".lora_down.weight")]
+            factors = {}
+            for part in ("lora_up", "lora_down"):
+                weight_key = f"{name}.{part}.weight"
+                weight = f.get_tensor(weight_key)
+                dtype = dtype or weight.dtype
+                quantized, scale = quantize(weight, bits, part == "lora_down")
+                tensors[weight_key + QUANT_SUFFIX] = quantized.contiguous()
+                tensors[weight_key + SCALE_SUFFIX] = scale
+                shapes[weight_key] = list(weight.shape)
+                factors[part] = (weight, dequantize(quantized, scale, bits, weight.shape, weight.dtype,
+                                                    part == "lora_down"))
+            errors[name] = relative_error(factors["lora_up"][0], factors["lora_down"][0],
+                                          factors["lora_up"][1], factors["lora_down"][1])
+    metadata[METADATA_KEY] = json.dumps({"bits": bits, "dtype": str(dtype).replace("torch.", ""), "shapes": shapes})
+    save_to = output_path(path, output_folder, f"int{bits}")
+    save_file(tensors, save_to, metadata)
+    return {"file": os.path.basename(path), "path": path, "save_to": save_to, "size": os.path.getsize(path),
+            "quantized_size": os.path.getsize(save_to), "modules": len(errors),
+            "mean_error": sum(errors.values()) / len(errors) if errors else None,
+            "max_error": max(errors.values(), default=None), "errors": errors}
+
+
+def load_lora(path, dtype=None):
+    """
+    Loads a LoRA, quantized or not, as (state dict, metadata) with regular lora_up and lora_down weights, in dtype or
+    the precision it had before being quantized. The state dict loads into networks.lora like any other.
+    """
+    import torch
+    from safetensors import safe_open
+    state_dict = {}
+    with safe_open(path, framework="pt", device="cpu") as f:
+        metadata = dict(f.metadata() or {})
+        quantization = json.loads(metadata.pop(METADATA_KEY)) if METADATA_KEY in metadata else None
+        if quantization is None:
+            return {key: f.get_tensor(key).to(dtype) if dtype else f.get_tensor(key) for key in f.keys()}, metadata
+        dtype = dtype or getattr(torch, quantization['dtype'])
+        for key in f.keys():
+            if key.endswith(SCALE_SUFFIX):
+                continue
+            if key.endswith(QUANT_SUFFIX):
+                weight_key = key[:-len(QUANT_SUFFIX)]
+                state_dict[weight_key] = dequantize(f.get_tensor(key), f.get_tensor(weight_key + SCALE_SUFFIX),
+                                                    quantization['bits'], quantization['shapes'][weight_key], dtype,
+                                                    not weight_key.endswith(".lora_up.weight"))
+            else:
+                tensor = f.get_tensor(key)
+                state_dict[key] = tensor.to(dtype) if tensor.is_floating_point() else tensor
+    return state_dict, metadata
+
+
+def dequantize_file(path, output_folder=None, save_precision=None):
+    # writes a quantized LoRA back out as a regular one, returns where it went or None when it isn't quantized
+    import torch
+    from safetensors import safe_open
+    from safetensors.torch import save_file
+    with safe_open(path, framework="pt", device="cpu") as f:
+        metadata = f.metadata() or {}
+    if METADATA_KEY not in metadata:
+        return None
+    dtype = getattr(torch, PRECISIONS[save_precision]) if save_precision else None
+    state_dict, metadata = load_lora(path, dtype)
+    save_to = output_path(path, output_folder, save_precision or "dequantized")
+    save_file(state_dict, save_to, metadata)
+    return save_to
+
+
+def print_table(reports: list, worst_layers: int = 0) -> None:
+    if not reports:
+        return
+    width = max(len("file"), *(len(report["file"]) for report in reports))
+    print(f"{'file':<{width}}  {'size MB':>9}  {'new MB':>9}  {'ratio':>7}  {'mean error':>10}  {'max error':>10}")
+    for report in reports:
+        errors = [f"{report[key]:>10.5f}" if report[key] is not None else f"{'-':>10}"
+                  for key in ("mean_error", "max_error")]
+        print(f"{report['file']:<{width}}  {report['size'] / MB:>9.2f}  {report['quantized_size'] / MB:>9.2f}  "
+              f"{report['quantized_size'] / report['size']:>7.1%}  {errors[0]}  {errors[1]}")
+        for layer, error in sorted(report["errors"].items(), key=lambda item: item[1], reverse=True)[:worst_layers]:
+            print(f"    {layer}: {error:.5f}")
+
+
+if __name__ == "__main__":
+    main()
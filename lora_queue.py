@@ -0,0 +1,186 @@
+import json
+import os
+import socket
+import threading
+import time
+
+# a multi_run_folder shared between machines looks like this, every move between folders is a single os.rename, which
+# is atomic on the same filesystem (NFS included), so only one worker can ever win a given json:
+#   multi_run_folder/job.json                     waiting to be trained
+#   multi_run_folder/claimed/<worker>/job.json    being trained by that worker
+#   multi_run_folder/claimed/<worker>/job.lease   last heartbeat of that worker
+#   multi_run_folder/complete/job.json            done
+CLAIMED = "claimed"
+COMPLETE = "complete"
+HEARTBEAT_FRACTION = 0.2  # share of the lease time between heartbeats
+
+
+def worker_name() -> str:
+    # host and pid, so several workers on one machine each get their own claimed folder
+    return f"{socket.gethostname()}-{os.getpid()}"
+
+
+def pending_jobs(multi_path) -> list:
+    return sorted(file for file in os.listdir(multi_path)
+                  if file.endswith(".json") and os.path.isfile(os.path.join(multi_path, file)))
+
+
+def lease_expired(lease_path, json_path, lease_seconds) -> bool:
+    # the newest of the heartbeat inside the lease and its modification time counts, a job claimed by a worker that
+    # died before writing its lease falls back to the time of the claim, which touches the json
+    try:
+        with open(lease_path) as f:
+            heartbeat = json.load(f)['heartbeat']
+        heartbeat = max(heartbeat, os.path.getmtime(lease_path))
+    except (OSError, ValueError, KeyError):
+        try:
+            heartbeat = os.path.getmtime(json_path)
+        except OSError:
+            return False
+    return time.time() - heartbeat > lease_seconds
+
+
+def reclaim_expired(multi_path, lease_seconds) -> list:
+    """
+    Puts the jobs of every worker whose lease ran out back into the queue. Two workers reclaiming the same job at once
+    is fine, only one rename can succeed.
+    """
+    claimed = os.path.join(multi_path, CLAIMED)
+    if not os.path.isdir(claimed):
+        return []
+    reclaimed = []
+    for worker in sorted(os.listdir(claimed)):
+        folder = os.path.join(claimed, worker)
+        if not os.path.isdir(folder):
+            continue
+        for file in sorted(os.listdir(folder)):
+            if not file.endswith(".json"):
+                continue
+            json_path = os.path.join(folder, file)
+            lease_path = os.path.splitext(json_path)[0] + ".lease"
+            if not lease_expired(lease_path, json_path, lease_seconds):
+                continue
+            try:
+                os.rename(json_path, os.path.join(multi_path, file))
+            except OSError:
+                continue
+            try:
+                os.remove(lease_path)
+            except OSError:
+                pass
+            print(f"reclaimed {file} from {worker}, its lease expired")
+            reclaimed.append(file)
+    return reclaimed
+
+
+class Lease:
+    """
+    A job claimed by this worker. While held, a thread rewrites the lease file every so often so other workers know
+    it's still being trained. complete() moves the json into complete, release() puts it back in the queue.
+    """
+    def __init__(self, multi_path, file, worker, lease_seconds):
+        self.multi_path = multi_path
+        self.file = file
+        self.path = os.path.join(multi_path, CLAIMED, worker, file)
+        self.lease_path = os.path.splitext(self.path)[0] + ".lease"
+        self.worker = worker
+        self.lease_seconds = lease_seconds
+        self.released = False
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def __enter__(self):
+        self.heartbeat()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+    def run(self) -> None:
+        while not self.stopped.wait(self.lease_seconds * HEARTBEAT_FRACTION):
+            if not os.path.exists(self.path):
+                print(f"lost the lease on {self.file}, another worker reclaimed it")
+                return
+            self.heartbeat()
+
+    def heartbeat(self) -> None:
+        temp_path = f"{self.lease_path}.tmp"
+        with open(temp_path, "w") as f:
+            json.dump({"worker": self.worker, "heartbeat": time.time(), "lease_seconds": self.lease_seconds}, f)
+        os.replace(temp_path, self.lease_path)
+
+    def stop(self) -> None:
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    def finish(self, destination) -> None:
+        self.stop()
+        try:
+            os.rename(self.path, destination)
+        except OSError:
+            print(f"{self.file} was reclaimed by another worker while this one held it")
+        try:
+            os.remove(self.lease_path)
+        except OSError:
+            pass
+
+    def complete(self) -> None:
+        os.makedirs(os.path.join(self.multi_path, COMPLETE), exist_ok=True)
+        self.finish(os.path.join(self.multi_path, COMPLETE, self.file))
+
+    def release(self) -> None:
+        self.released = True
+        self.finish(os.path.join(self.multi_path, self.file))
+
+
+def claim_next(multi_path, worker, lease_seconds, skip=()):
+    # tries every waiting json in order until a rename goes through, losing a race just means trying the next one
+    folder = os.path.join(multi_path, CLAIMED, worker)
+    os.makedirs(folder, exist_ok=True)
+    for file in pending_jobs(multi_path):
+        if file in skip:
+            continue
+        path = os.path.join(folder, file)
+        try:
+            os.rename(os.path.join(multi_path, file), path)
+        except OSError:
+            continue
+        # the claim time, until the first heartbeat is written
+        os.utime(path)
+        return Lease(multi_path, file, worker, lease_seconds)
+    return None
+
+
+def claim_jobs(multi_path, lease_seconds=600, wait=False, poll_interval=30):
+    """
+    Yields a Lease for every job this worker manages to claim. When the queue is empty, jobs of workers whose lease
+    ran out get put back and claimed. With wait set, it keeps polling for new or reclaimable jobs instead of stopping.
+    Jobs that get released are not claimed again by the same worker.
+    """
+    worker = worker_name()
+    skip = set()
+    while True:
+        lease = claim_next(multi_path, worker, lease_seconds, skip)
+        if lease is None and reclaim_expired(multi_path, lease_seconds):
+            lease = claim_next(multi_path, worker, lease_seconds, skip)
+        if lease is None:
+            if not wait:
+                try:
+                    # the folder is named after the pid, so it would never be used again
+                    os.rmdir(os.path.join(multi_path, CLAIMED, worker))
+                except OSError:
+                    pass
+                return
+            time.sleep(poll_interval)
+            continue
+        with lease:
+            yield lease
+        if os.path.exists(lease.path):
+            # the caller neither completed nor released it, so it goes back for someone else
+            lease.release()
+        if lease.released:
+            skip.add(lease.file)
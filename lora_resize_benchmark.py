@@ -0,0 +1,144 @@
+import argparse
+import contextlib
+import io
+import os
+import shutil
+import statistics
+import tempfile
+import time
+
+import torch
+from safetensors.torch import load_file, save_file
+
+import networks.resize_lora as resize
+from lora_benchmark import track_results
+
+# (lora name prefix, channels) of every attention block in the sd1 unet
+UNET_ATTENTIONS = [(f"down_blocks_{block}_attentions_{i}", ch) for block, ch in enumerate([320, 640, 1280])
+                   for i in range(2)] + [("mid_block_attentions_0", 1280)] + \
+                  [(f"up_blocks_{block}_attentions_{i}", ch) for block, ch in zip([1, 2, 3], [1280, 640, 320])
+                   for i in range(3)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks the speed and accuracy of lora resizing on generated "
+                                                 "LoRA files, runs on CPU")
+    parser.add_argument("--dims", type=int, nargs="+", default=[32, 64, 128], help="dims of the generated LoRA")
+    parser.add_argument("--ranks", type=int, nargs="+", default=[4, 8, 16, 32], help="ranks to resize them to")
+    parser.add_argument("--save_precision", type=str, default="fp16", choices=["float", "fp16", "bf16"])
+    parser.add_argument("--work_dir", type=str, default=None, help="where to put the LoRA files, temp when not set")
+    parser.add_argument("--baseline", type=str, default="benchmark_baseline.json",
+                        help="json file the results are tracked in")
+    parser.add_argument("--update_baseline", action="store_true",
+                        help="makes these results the new baseline instead of comparing against it")
+    parser.add_argument("--threshold", type=float, default=0.2,
+                        help="fails when resizing is this much slower or less accurate than the baseline")
+    parser.add_argument("--worst_layers", type=int, default=5,
+                        help="number of layers with the highest error to print for each resize")
+    parser.add_argument("--repeats", "--repeat", type=int, default=3, help="number of times each resize is run")
+    args = parser.parse_args()
+
+    work_dir = args.work_dir if args.work_dir else tempfile.mkdtemp(prefix="lora_resize_bench_")
+    results = {}
+    try:
+        for dim in args.dims:
+            model = os.path.join(work_dir, f"synthetic_dim{dim}.safetensors")
+            generate_lora(model, dim)
+            for rank in args.ranks:
+                if rank >= dim:
+                    continue
+                name = f"resize_dim{dim}_rank{rank}"
+                results[name], layer_errors = benchmark_resize(model, rank, args.save_precision, work_dir,
+                                                               args.repeats)
+                worst = sorted(layer_errors.items(), key=lambda item: item[1], reverse=True)[:args.worst_layers]
+                print(f"{name}: min {results[name]['min']:.2f}s, median {results[name]['median']:.2f}s, "
+                      f"mean error {results[name]['mean_error']:.4f}, max error {results[name]['max_error']:.4f}, "
+                      f"size {results[name]['size_ratio']:.1%} of original")
+                for layer, error in worst:
+                    print(f"    {layer}: {error:.4f}")
+    finally:
+        if not args.work_dir:
+            shutil.rmtree(work_dir, ignore_errors=True)
+    regressions = track_results(args.baseline, f"lora_resize_{args.save_precision}", results, args.threshold,
+                                args.update_baseline, {"min": 0.05, "mean_error": 1e-4, "max_error": 1e-4})
+    if regressions:
+        quit(1)
+
+
+def lora_layers():
+    # (lora name, in features, out features, is 1x1 conv) of every module an sd1 LoRA trains
+    layers = []
+    for prefix, ch in UNET_ATTENTIONS:
+        layers.append((f"lora_unet_{prefix}_proj_in", ch, ch, True))
+        layers.append((f"lora_unet_{prefix}_proj_out", ch, ch, True))
+        block = f"lora_unet_{prefix}_transformer_blocks_0"
+        for attn, ctx in (("attn1", ch), ("attn2", 768)):
+            layers.append((f"{block}_{attn}_to_q", ch, ch, False))
+            layers.append((f"{block}_{attn}_to_k", ctx, ch, False))
+            layers.append((f"{block}_{attn}_to_v", ctx, ch, False))
+            layers.append((f"{block}_{attn}_to_out_0", ch, ch, False))
+        layers.append((f"{block}_ff_net_0_proj", ch, ch * 8, False))
+        layers.append((f"{block}_ff_net_2", ch * 4, ch, False))
+    for i in range(12):
+        prefix = f"lora_te_text_model_encoder_layers_{i}"
+        for proj in ("q_proj", "k_proj", "v_proj", "out_proj"):
+            layers.append((f"{prefix}_self_attn_{proj}", 768, 768, False))
+        layers.append((f"{prefix}_mlp_fc1", 768, 3072, False))
+        layers.append((f"{prefix}_mlp_fc2", 3072, 768, False))
+    return layers
+
+
+def generate_lora(path, dim, seed=23) -> None:
+    # trained LoRA have a decaying singular value spectrum, so the up weights get one too
+    generator = torch.Generator().manual_seed(seed)
+    decay = torch.exp(-torch.arange(dim, dtype=torch.float32) / (dim / 4))
+    state_dict = {}
+    for name, in_features, out_features, conv in lora_layers():
+        down = torch.randn(dim, in_features, generator=generator) / in_features ** 0.5
+        up = torch.randn(out_features, dim, generator=generator) * decay * 0.01
+        if conv:
+            down, up = down[:, :, None, None], up[:, :, None, None]
+        state_dict[f"{name}.lora_down.weight"] = down.half().contiguous()
+        state_dict[f"{name}.lora_up.weight"] = up.half().contiguous()
+        state_dict[f"{name}.alpha"] = torch.tensor(dim / 2).half()
+    save_file(state_dict, path, {"ss_network_dim": str(dim), "ss_network_alpha": str(dim / 2)})
+
+
+def lora_deltas(state_dict: dict) -> dict:
+    # the weight change each module applies, up @ down * alpha / dim
+    deltas = {}
+    for key in state_dict:
+        if not key.endswith(".lora_down.weight"):
+            continue
+        name = key[:-len(".lora_down.weight")]
+        down = state_dict[key].float().flatten(1)
+        up = state_dict[f"{name}.lora_up.weight"].float().flatten(1)
+        alpha = state_dict.get(f"{name}.alpha", torch.tensor(down.shape[0])).float()
+        deltas[name] = up @ down * (alpha / down.shape[0])
+    return deltas
+
+
+def benchmark_resize(model, rank, save_precision, work_dir, repeats=3):
+    # resizes the same file repeats times, every run writes the same output so the errors come from the last one
+    save_to = os.path.join(work_dir, f"resized_rank{rank}.safetensors")
+    args = argparse.Namespace(save_precision=save_precision, new_rank=rank, save_to=save_to, model=model,
+                              device="cpu", verbose=False, dynamic_method=None, dynamic_param=None)
+    resize.args = args
+    times = []
+    with contextlib.redirect_stdout(io.StringIO()):
+        for _ in range(max(1, repeats)):
+            start = time.perf_counter()
+            resize.resize(args)
+            times.append(time.perf_counter() - start)
+    original = lora_deltas(load_file(model))
+    resized = lora_deltas(load_file(save_to))
+    errors = {name: (torch.linalg.matrix_norm(original[name] - resized[name]) /
+                     torch.linalg.matrix_norm(original[name])).item()
+              for name in original if name in resized}
+    result = {"min": min(times), "median": statistics.median(times), "mean_error": sum(errors.values()) / len(errors),
+              "max_error": max(errors.values()), "size_ratio": os.path.getsize(save_to) / os.path.getsize(model)}
+    return result, errors
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,225 @@
+import argparse
+import os
+import re
+import shutil
+import threading
+import time
+from contextlib import contextmanager
+
+import lora_common
+
+# how train_util names what it saves every epoch, <name>-000003.safetensors and <name>-000003-state
+EPOCH_PATTERN = re.compile(r"^(?P<name>.+)-(?P<epoch>\d{6})(?P<state>-state)?(?P<ext>\.[^.]+)?$")
+DEFAULT_EPOCH_NAME = "epoch"
+LOSS_TAG = "loss/epoch"
+GB = 1024 ** 3
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Deletes epochs and save states of a training that aren't worth "
+                                                 "keeping, the same way retention_* does during training")
+    parser.add_argument("output_folder", type=str)
+    parser.add_argument("--name", type=str, default=DEFAULT_EPOCH_NAME,
+                        help="change_output_name of the training, epoch when it wasn't set")
+    parser.add_argument("--keep_last", type=int, default=None, help="newest epochs to keep")
+    parser.add_argument("--keep_best", type=int, default=None, help="epochs with the lowest loss to keep")
+    parser.add_argument("--log_dir", type=str, default=None, help="log_dir of the training, to read the loss from")
+    parser.add_argument("--budget_gb", type=float, default=None, help="most space the epochs and states can take")
+    parser.add_argument("--dry_run", action="store_true", help="only prints what would be deleted")
+    args = parser.parse_args()
+    policy = RetentionPolicy(args.keep_last, args.keep_best, args.budget_gb)
+    losses = read_losses(args.log_dir) if args.keep_best else {}
+    for item in policy.select(scan(args.output_folder, args.name), losses):
+        print(f"{'would delete' if args.dry_run else 'deleting'} {item['path']} ({item['size'] / GB:.2f} GB)")
+        if not args.dry_run:
+            remove(item)
+
+
+def folder_size(path) -> int:
+    if os.path.isfile(path):
+        return os.path.getsize(path)
+    total = 0
+    for root, _, files in os.walk(path):
+        for file in files:
+            try:
+                total += os.path.getsize(os.path.join(root, file))
+            except OSError:
+                pass
+    return total
+
+
+def scan(output_folder, name) -> list:
+    # every epoch model and save state of one training in output_folder, final outputs aren't included so they are
+    # never deleted
+    items = []
+    if not os.path.isdir(output_folder):
+        return items
+    for file in os.listdir(output_folder):
+        match = EPOCH_PATTERN.match(file)
+        if not match or match.group("name") != name:
+            continue
+        path = os.path.join(output_folder, file)
+        state = match.group("state") is not None
+        if state != os.path.isdir(path):
+            continue
+        if not state and (match.group("ext") or ".")[1:] not in lora_common.MODEL_EXTENSIONS:
+            continue
+        items.append({"path": path, "epoch": int(match.group("epoch")), "state": state, "size": folder_size(path)})
+    return sorted(items, key=lambda item: item['epoch'])
+
+
+def read_losses(log_dir, since=None) -> dict:
+    # {epoch: loss} from the tensorboard logs, the newest run wins when a log_dir holds several. with since, only runs
+    # that started after that time are read, so a training never goes by the loss of an older one in the same log_dir
+    if not log_dir or not os.path.isdir(log_dir):
+        return {}
+    try:
+        from tensorboard.backend.event_processing.event_accumulator import EventAccumulator
+    except ImportError:
+        print("tensorboard isn't installed, retention can't keep the best epochs")
+        return {}
+    runs = sorted({root for root, _, files in os.walk(log_dir) if any("tfevents" in file for file in files)},
+                  key=os.path.getmtime)
+    losses = {}
+    for run in runs:
+        if since is not None and os.path.getmtime(run) < since:
+            continue
+        accumulator = EventAccumulator(run, size_guidance={"scalars": 0})
+        accumulator.Reload()
+        try:
+            if since is not None and accumulator.FirstEventTimestamp() < since:
+                continue
+        except ValueError:
+            continue
+        if LOSS_TAG in accumulator.Tags().get("scalars", []):
+            # train_network logs the loss of epoch n at step n
+            losses.update({event.step: event.value for event in accumulator.Scalars(LOSS_TAG)})
+    return losses
+
+
+def remove(item) -> None:
+    if item['state']:
+        shutil.rmtree(item['path'], ignore_errors=True)
+        return
+    os.remove(item['path'])
+    # the stats lora_watch wrote next to it go with it
+    stats = os.path.splitext(item['path'])[0] + ".stats.json"
+    if os.path.exists(stats):
+        os.remove(stats)
+
+
+class RetentionPolicy:
+    """
+    Picks what to delete. The newest epoch and the newest save state are always kept so the training can be used and
+    resumed. Past those, the newest keep_last epochs and the keep_best epochs with the lowest loss are kept, along
+    with epochs whose loss isn't logged yet, and everything else goes, older save states included. When the kept files
+    are still over a budget, save states go first, then the epochs with the highest loss, oldest first when there's no
+    loss to go by.
+    """
+    def __init__(self, keep_last=None, keep_best=None, budget_gb=None):
+        self.keep_last = keep_last
+        self.keep_best = keep_best
+        self.budget = budget_gb * GB if budget_gb else None
+
+    def select(self, items: list, losses: dict, over_budget: int = 0) -> list:
+        models = [item for item in items if not item['state']]
+        states = [item for item in items if item['state']]
+        required = {id(item) for item in models[-1:] + states[-1:]}
+        if self.keep_last is None and self.keep_best is None:
+            kept = list(items)
+        else:
+            kept = models[-self.keep_last:] if self.keep_last else []
+            if self.keep_best:
+                scored = [item for item in models if item['epoch'] in losses]
+                kept += sorted(scored, key=lambda item: losses[item['epoch']])[:self.keep_best]
+                # the loss of an epoch can be logged after it's saved, it can't be judged before that
+                kept += [item for item in models if item['epoch'] not in losses]
+            kept += [item for item in items if id(item) in required]
+        kept_ids = {id(item) for item in kept}
+        delete = [item for item in items if id(item) not in kept_ids]
+        kept_size = sum(item['size'] for item in items if id(item) in kept_ids)
+        excess = max(over_budget - sum(item['size'] for item in delete), kept_size - self.budget if self.budget else 0)
+        if excess <= 0:
+            return delete
+        # the order things go in when over budget, save states, then the worst epochs
+        optional = [item for item in items if id(item) in kept_ids and id(item) not in required]
+        optional.sort(key=lambda item: (not item['state'], -losses.get(item['epoch'], float("inf")), item['epoch']))
+        for item in optional:
+            if excess <= 0:
+                break
+            delete.append(item)
+            excess -= item['size']
+        if excess > 0:
+            print(f"still {excess / GB:.2f} GB over the retention budget, the newest epoch and state are never deleted")
+        return delete
+
+
+class RetentionManager:
+    """
+    Applies a RetentionPolicy to the output_folder of a training from a background thread every interval seconds,
+    so deleting old epochs never holds up training. stop() runs it one last time once training is done.
+    """
+    def __init__(self, arg_dict: dict, interval=30.0):
+        self.output_folder = arg_dict['output_folder']
+        self.name = arg_dict['change_output_name'] or DEFAULT_EPOCH_NAME
+        self.log_dir = arg_dict['log_dir']
+        self.started = time.time()
+        self.policy = RetentionPolicy(arg_dict['retention_keep_last'], arg_dict['retention_keep_best'],
+                                      arg_dict['retention_budget_gb'])
+        self.global_budget = arg_dict['retention_global_budget_gb'] * GB \
+            if arg_dict['retention_global_budget_gb'] else None
+        self.global_folder = arg_dict['retention_global_folder'] or \
+            os.path.dirname(os.path.abspath(self.output_folder))
+        self.interval = interval
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def start(self) -> None:
+        self.prune()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def run(self) -> None:
+        while not self.stopped.wait(self.interval):
+            self.prune()
+
+    def prune(self) -> None:
+        try:
+            items = scan(self.output_folder, self.name)
+            losses = read_losses(self.log_dir, self.started) if self.policy.keep_best else {}
+            # the global budget can only be met by pruning this training harder, the others are pruned by their own
+            over_budget = folder_size(self.global_folder) - self.global_budget if self.global_budget else 0
+            for item in self.policy.select(items, losses, over_budget):
+                print(f"retention: deleting {os.path.basename(item['path'])}")
+                remove(item)
+        except OSError as e:
+            print(f"retention couldn't clean up {self.output_folder}: {e}")
+
+    def stop(self) -> None:
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+        self.prune()
+
+
+def enabled(arg_dict: dict) -> bool:
+    return any(arg_dict[field] for field in ("retention_keep_last", "retention_keep_best", "retention_budget_gb",
+                                             "retention_global_budget_gb"))
+
+
+@contextmanager
+def retain(arg_dict: dict):
+    # used by the training scripts around a training, does nothing unless one of the retention_* options is set
+    if not enabled(arg_dict):
+        yield
+        return
+    manager = RetentionManager(arg_dict)
+    manager.start()
+    try:
+        yield manager
+    finally:
+        manager.stop()
+
+
+if __name__ == "__main__":
+    main()
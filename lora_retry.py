@@ -0,0 +1,102 @@
+import gc
+import json
+import math
+import os
+
+from lora_autotune import is_oom
+
+DEFAULT_POLICY = ["batch_size", "gradient_checkpointing", "max_bucket_resolution"]
+
+
+def degrade_batch_size(args: dict):
+    # halves the batch size and doubles the accumulation so the effective batch size stays about the same
+    if args['batch_size'] <= 1:
+        return None
+    effective = args['batch_size'] * max(1, args['gradient_acc_steps'] or 1)
+    batch_size = args['batch_size'] // 2
+    return {"batch_size": batch_size, "gradient_acc_steps": math.ceil(effective / batch_size)}
+
+
+def degrade_gradient_checkpointing(args: dict):
+    if args['gradient_checkpointing']:
+        return None
+    return {"gradient_checkpointing": True}
+
+
+def degrade_max_bucket_resolution(args: dict):
+    # lowers the largest bucket by 128 at a time, but never below the training resolution
+    if not args['buckets'] or args['max_bucket_resolution'] <= args['train_resolution']:
+        return None
+    return {"max_bucket_resolution": max(args['train_resolution'], args['max_bucket_resolution'] - 128)}
+
+
+DEGRADATIONS = {"batch_size": degrade_batch_size, "gradient_checkpointing": degrade_gradient_checkpointing,
+                "max_bucket_resolution": degrade_max_bucket_resolution}
+
+
+def next_degradation(args: dict, policy: list):
+    # the first step of the policy that can still lower memory use, as {key: new value}, None when all are used up
+    for step in policy:
+        if step not in DEGRADATIONS:
+            print(f"unknown oom retry step {step}, the options are {list(DEGRADATIONS)}")
+            continue
+        change = DEGRADATIONS[step](args)
+        if change:
+            return change
+    return None
+
+
+def free_memory() -> None:
+    gc.collect()
+    try:
+        import torch
+        torch.cuda.empty_cache()
+    except ImportError:
+        pass
+
+
+def run_with_retries(arg_dict: dict, args, build_args, train_fn) -> list:
+    """
+    Runs train_fn(args), and on a CUDA out of memory error retries with the next change of oom_retry_policy applied
+    to arg_dict, rebuilt through build_args. Any other error is raised as is. Returns the list of changes made.
+    """
+    policy = arg_dict['oom_retry_policy'] or []
+    changes = []
+    while True:
+        try:
+            train_fn(args)
+            break
+        except Exception as e:
+            if not policy or not is_oom(e):
+                raise
+            if len(changes) >= arg_dict['oom_max_retries']:
+                print(f"ran out of memory and already retried oom_max_retries ({arg_dict['oom_max_retries']}) times.")
+                raise
+            change = next_degradation(arg_dict, policy)
+            if change is None:
+                print("ran out of memory and there is nothing left in oom_retry_policy to try.")
+                raise
+        # memory is only freed once out of the except block, until then the traceback keeps the frames of the failed
+        # attempt alive, and with them its model, optimizer and activations
+        free_memory()
+        changes.append({key: [arg_dict[key], value] for key, value in change.items()})
+        for key, value in change.items():
+            print_retry_change(key, arg_dict[key], value)
+            arg_dict[key] = value
+        args = build_args(arg_dict)
+    if changes:
+        record_changes(arg_dict, changes)
+    return changes
+
+
+def print_retry_change(value, old, new):
+    print(f"ran out of memory, retrying with {value} changed from {old} to {new}")
+
+
+def record_changes(arg_dict: dict, changes: list, path=None) -> None:
+    # writes the config that finally trained with the changes that got it there, next to the outputs by default
+    if path is None:
+        path = os.path.join(arg_dict['output_folder'], f"{arg_dict['change_output_name'] or 'last'}-oom_retries.json")
+    with open(path, "w") as f:
+        json.dump({"oom_retries": changes, "config": arg_dict}, f, indent=4)
+    print(f"saved the changes made to fit in memory to {path}")
@@ -0,0 +1,279 @@
+import argparse
+import asyncio
+import codecs
+import collections
+import json
+import os
+import re
+import sys
+import time
+import uuid
+from urllib.parse import parse_qs, urlsplit
+
+import lora_common
+import lora_job
+
+JOB_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "lora_job.py")
+LOG_LINES = 2000  # lines of output kept in memory per job, the whole log is in its .log file
+MAX_BODY = 64 * 1024 * 1024
+FINISHED = {"done", "skipped", "unplaced", "failed", "cancelled"}
+REASONS = {200: "OK", 201: "Created", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed",
+           409: "Conflict", 413: "Payload Too Large"}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local HTTP API to queue trainings and follow their progress")
+    parser.add_argument("--host", type=str, default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8470)
+    parser.add_argument("--jobs_folder", type=str, default="server_jobs",
+                        help="folder the config and full log of every job are written to")
+    parser.add_argument("--workers", type=int, default=1, help="number of jobs that train at the same time")
+    args = parser.parse_args()
+    server = JobServer(args.jobs_folder, args.workers)
+    try:
+        asyncio.run(server.serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+
+
+class Job:
+    def __init__(self, job_id, config, folder):
+        self.id = job_id
+        self.config = config
+        self.config_path = os.path.join(folder, f"{job_id}.json")
+        self.log_path = os.path.join(folder, f"{job_id}.log")
+        self.status = "queued"
+        self.submitted = time.time()
+        self.started = None
+        self.finished = None
+        self.step = 0
+        self.total = None
+        self.eta = None
+        self.outputs = []
+        self.lines = collections.deque(maxlen=LOG_LINES)
+        self.partial_line = ""
+        self.listeners = set()
+        self.process = None
+
+    def progress(self) -> dict:
+        return {"step": self.step, "total": self.total, "eta_seconds": self.eta}
+
+    def summary(self) -> dict:
+        name = self.config['change_output_name'] or os.path.basename(os.path.normpath(self.config['img_folder']))
+        return {"id": self.id, "name": name, "status": self.status, "submitted": self.submitted,
+                "started": self.started, "finished": self.finished, "progress": self.progress(),
+                "output_folder": self.config['output_folder'], "outputs": self.outputs}
+
+    def publish(self, event, data) -> None:
+        for listener in self.listeners:
+            try:
+                listener.put_nowait((event, data))
+            except asyncio.QueueFull:
+                # a client that stopped reading misses events instead of growing the queue forever
+                pass
+
+    def set_status(self, status) -> None:
+        self.status = status
+        self.publish("status", status)
+
+    def add_output(self, text) -> None:
+        # the same split the popup does, tqdm redraws with carriage returns which only update the progress
+        lines = re.split(r"(\r|\n)", self.partial_line + text)
+        self.partial_line = lines.pop()
+        for i in range(0, len(lines), 2):
+            line, end = lines[i], lines[i + 1]
+            match = lora_job.PROGRESS_PATTERN.search(line)
+            if match:
+                self.step, self.total = int(match.group(1)), int(match.group(2))
+                self.eta = lora_job.to_seconds(match.group(4))
+                self.publish("progress", self.progress())
+            elif end == "\n" and line.strip():
+                self.lines.append(line)
+                self.publish("log", line)
+
+
+class JobServer:
+    """
+    Keeps every submitted job in memory and trains them in order, each one in its own process running lora_job.py so
+    a crash or an out of memory error only takes out that job. Configs are checked the same way the training scripts
+    check them before they're accepted.
+    """
+    def __init__(self, jobs_folder, workers=1):
+        self.jobs_folder = jobs_folder
+        self.workers = workers
+        self.jobs = {}
+        self.queue = None
+
+    async def serve(self, host, port) -> None:
+        os.makedirs(self.jobs_folder, exist_ok=True)
+        self.queue = asyncio.Queue()
+        for _ in range(self.workers):
+            asyncio.create_task(self.work())
+        server = await asyncio.start_server(self.handle, host, port)
+        print(f"listening on http://{host}:{port}")
+        async with server:
+            await server.serve_forever()
+
+    async def work(self) -> None:
+        while True:
+            job = await self.queue.get()
+            if job.status == "queued":
+                await self.run(job)
+
+    async def run(self, job: Job) -> None:
+        job.started = time.time()
+        job.set_status("running")
+        decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        with open(job.log_path, "w", encoding="utf-8") as log:
+            job.process = await asyncio.create_subprocess_exec(
+                sys.executable, "-u", JOB_SCRIPT, job.config_path,
+                stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.STDOUT)
+            while True:
+                chunk = await job.process.stdout.read(4096)
+                if not chunk:
+                    break
+                text = decoder.decode(chunk)
+                log.write(text)
+                job.add_output(text)
+            code = await job.process.wait()
+        job.add_output("\n")
+        job.process = None
+        job.finished = time.time()
+        job.outputs = find_outputs(job.config['output_folder'], job.started)
+        if job.status != "cancelled":
+            job.set_status({code: status for status, code in lora_job.EXIT_CODES.items()}.get(code, "failed"))
+
+    def submit(self, body: bytes):
+        try:
+            payload = json.loads(body)
+        except ValueError:
+            return 400, {"error": "the body isn't valid json"}
+        configs = payload if isinstance(payload, list) else [payload]
+        checked, errors = [], {}
+        for i, config in enumerate(configs):
+            try:
+                checked.append(lora_job.read_config(config))
+            except ValueError as e:
+                errors[i] = str(e)
+        if errors:
+            # nothing of a batch gets queued unless all of it is valid
+            return 400, {"errors": errors} if isinstance(payload, list) else {"error": errors[0]}
+        jobs = [self.add_job(config) for config in checked]
+        return 201, [job.summary() for job in jobs] if isinstance(payload, list) else jobs[0].summary()
+
+    def add_job(self, config: dict) -> Job:
+        job = Job(uuid.uuid4().hex[:12], config, self.jobs_folder)
+        with open(job.config_path, "w") as f:
+            json.dump(config, f, indent=4)
+        self.jobs[job.id] = job
+        self.queue.put_nowait(job)
+        return job
+
+    def cancel(self, job: Job):
+        if job.status in FINISHED:
+            return 409, {"error": f"the job is already {job.status}"}
+        if job.process is not None:
+            job.process.terminate()
+        job.finished = time.time()
+        job.set_status("cancelled")
+        return 200, job.summary()
+
+    async def handle(self, reader, writer) -> None:
+        try:
+            try:
+                head = await reader.readuntil(b"\r\n\r\n")
+                lines = head.decode("latin-1").split("\r\n")
+                method, target, _ = lines[0].split(" ", 2)
+                headers = dict((key.strip().lower(), value.strip()) for key, value in
+                               (line.split(":", 1) for line in lines[1:] if ":" in line))
+                length = int(headers.get("content-length") or 0)
+            except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ValueError):
+                return
+            if length > MAX_BODY:
+                await respond(writer, 413, {"error": "the body is too large"})
+                return
+            body = await reader.readexactly(length) if length else b""
+            url = urlsplit(target)
+            parts = [part for part in url.path.split("/") if part]
+            if not parts or parts[0] != "jobs" or len(parts) > 3:
+                await respond(writer, 404, {"error": "not found"})
+                return
+            if len(parts) == 1:
+                if method == "POST":
+                    await respond(writer, *self.submit(body))
+                elif method == "GET":
+                    wanted = parse_qs(url.query).get("status")
+                    await respond(writer, 200, {"jobs": [job.summary() for job in self.jobs.values()
+                                                         if not wanted or job.status in wanted]})
+                else:
+                    await respond(writer, 405, {"error": "use GET or POST"})
+                return
+            job = self.jobs.get(parts[1])
+            if job is None:
+                await respond(writer, 404, {"error": "no job with that id"})
+            elif len(parts) == 3 and parts[2] == "logs" and method == "GET":
+                await stream_logs(job, writer)
+            elif len(parts) == 3:
+                await respond(writer, 404, {"error": "not found"})
+            elif method == "GET":
+                await respond(writer, 200, dict(job.summary(), config=job.config, log=list(job.lines)[-50:]))
+            elif method == "DELETE":
+                await respond(writer, *self.cancel(job))
+            else:
+                await respond(writer, 405, {"error": "use GET or DELETE"})
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+
+def find_outputs(output_folder, started) -> list:
+    # the models saved since the job started, the same ones record_trained lists
+    if not os.path.isdir(output_folder):
+        return []
+    return sorted(os.path.join(output_folder, file) for file in os.listdir(output_folder)
+                  if file.split(".")[-1] in lora_common.MODEL_EXTENSIONS
+                  and os.path.getmtime(os.path.join(output_folder, file)) >= started)
+
+
+async def respond(writer, status, payload) -> None:
+    body = json.dumps(payload).encode()
+    writer.write(f"HTTP/1.1 {status} {REASONS[status]}\r\nContent-Type: application/json\r\n"
+                 f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode() + body)
+    await writer.drain()
+
+
+async def stream_logs(job: Job, writer) -> None:
+    # server-sent events, the lines kept so far first, then log, progress and status events as they happen until
+    # the job is finished
+    writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: text/event-stream\r\nCache-Control: no-cache\r\n"
+                 b"Connection: close\r\n\r\n")
+    for line in job.lines:
+        writer.write(event_bytes("log", line))
+    writer.write(event_bytes("progress", job.progress()))
+    if job.status in FINISHED:
+        writer.write(event_bytes("status", job.status))
+        await writer.drain()
+        return
+    listener = asyncio.Queue(maxsize=LOG_LINES)
+    job.listeners.add(listener)
+    try:
+        await writer.drain()
+        while True:
+            event, data = await listener.get()
+            writer.write(event_bytes(event, data))
+            await writer.drain()
+            if event == "status" and data in FINISHED:
+                return
+    finally:
+        job.listeners.discard(listener)
+
+
+def event_bytes(event, data) -> bytes:
+    if not isinstance(data, str):
+        data = json.dumps(data)
+    return f"event: {event}\ndata: {data}\n\n".encode()
+
+
+if __name__ == "__main__":
+    main()
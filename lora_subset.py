@@ -0,0 +1,178 @@
+import argparse
+import json
+import os
+import shutil
+
+IMG_EXTENSIONS = {"png", "bmp", "gif", "jpeg", "jpg", "webp"}
+MARKER_FILE = ".lora_subset"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Builds a subset of a tagged dataset using links instead of copies")
+    parser.add_argument("--img_folder", type=str, required=True,
+                        help="the img folder to take the subset from, laid out as x_name folders")
+    parser.add_argument("--output", type=str, required=True,
+                        help="folder to build the subset in, or a .json file when --mode=manifest")
+    parser.add_argument("--include", type=str, nargs="*", default=[],
+                        help="tags that every selected image must have")
+    parser.add_argument("--exclude", type=str, nargs="*", default=[],
+                        help="tags that no selected image may have")
+    parser.add_argument("--any_of", type=str, nargs="*", default=[],
+                        help="selected images must have at least one of these tags")
+    parser.add_argument("--caption_extension", type=str, default=".txt",
+                        help="extension of the caption files the tags are read from")
+    parser.add_argument("--mode", type=str, default="hardlink", choices=["hardlink", "symlink", "manifest"],
+                        help="hardlink and symlink build the folder right away, manifest writes a json that "
+                             "the training scripts link into place through subset_manifest")
+    parser.add_argument("--target_steps", type=int, default=None,
+                        help="steps per epoch each concept folder should get, repeats are recalculated to "
+                             "hit it. keeps the original repeats when not set")
+    args = parser.parse_args()
+
+    selection = select_images(args.img_folder, args.caption_extension, args.include, args.exclude, args.any_of)
+    if not selection:
+        print("No images matched the query, nothing to build")
+        quit(1)
+    try:
+        manifest = build_manifest(args.img_folder, args.caption_extension, selection, args.target_steps,
+                                  {"include": args.include, "exclude": args.exclude, "any_of": args.any_of})
+    except ValueError as e:
+        print(e)
+        quit(1)
+    for folder, files in manifest['folders'].items():
+        print(f"{folder}: {len(files)} images")
+    if args.mode == "manifest":
+        save_manifest(args.output, manifest)
+        print(f"saved manifest to {args.output}")
+    else:
+        materialize(manifest, args.output, args.mode)
+        print(f"built subset in {args.output}")
+
+
+def parse_folder_name(folder: str):
+    # same rules find_max_steps uses, returns (repeats, name) or None when the folder isn't x_name
+    split = folder.split("_")
+    if len(split) < 2:
+        return None
+    try:
+        return int(split[0]), "_".join(split[1:])
+    except ValueError:
+        return None
+
+
+def read_tags(file) -> set:
+    with open(file, encoding="utf-8") as f:
+        temp = f.read().replace(", ", ",").split(",")
+    return {tag.strip() for tag in temp if tag.strip()}
+
+
+def matches_query(tags: set, include, exclude, any_of) -> bool:
+    if any(tag not in tags for tag in include):
+        return False
+    if any(tag in tags for tag in exclude):
+        return False
+    if any_of and not any(tag in tags for tag in any_of):
+        return False
+    return True
+
+
+def select_images(img_folder, caption_extension, include, exclude, any_of) -> dict:
+    # returns {folder: [(image_path, caption_path), ...]} of all images whose captions match the query
+    selection = {}
+    for folder in sorted(os.listdir(img_folder)):
+        folder_path = os.path.join(img_folder, folder)
+        if not os.path.isdir(folder_path):
+            continue
+        if parse_folder_name(folder) is None:
+            print(f"folder {folder} is not in the correct format. Format is x_name. skipping")
+            continue
+        files = set(os.listdir(folder_path))
+        selected = []
+        for file in sorted(files):
+            base, ext = os.path.splitext(file)
+            if ext[1:].lower() not in IMG_EXTENSIONS:
+                continue
+            caption = base + caption_extension
+            tags = read_tags(os.path.join(folder_path, caption)) if caption in files else set()
+            if not matches_query(tags, include, exclude, any_of):
+                continue
+            selected.append((os.path.abspath(os.path.join(folder_path, file)),
+                             os.path.abspath(os.path.join(folder_path, caption)) if caption in files else None))
+        if selected:
+            selection[folder] = selected
+    return selection
+
+
+def rebalance_repeats(selection: dict, target_steps) -> dict:
+    # maps each source folder to the x_name folder it gets built as. two source folders that would end up as the same
+    # folder, like 5_cat and 10_cat getting the same repeats, are an error since one would overwrite the other
+    names = {}
+    built = {}
+    for folder, files in selection.items():
+        repeats, name = parse_folder_name(folder)
+        if target_steps:
+            repeats = max(1, round(target_steps / len(files)))
+        names[folder] = f"{repeats}_{name}"
+        if names[folder] in built:
+            raise ValueError(f"{built[names[folder]]} and {folder} would both be built as {names[folder]}, give the "
+                             f"concepts different names or merge the two folders")
+        built[names[folder]] = folder
+    return names
+
+
+def build_manifest(img_folder, caption_extension, selection: dict, target_steps=None, query=None) -> dict:
+    names = rebalance_repeats(selection, target_steps)
+    return {"source": os.path.abspath(img_folder), "caption_extension": caption_extension,
+            "query": query, "target_steps": target_steps,
+            "folders": {names[folder]: [list(pair) for pair in files] for folder, files in selection.items()}}
+
+
+def save_manifest(path, manifest: dict) -> None:
+    with open(path, "w") as f:
+        json.dump(manifest, f, indent=4)
+
+
+def load_manifest(path) -> dict:
+    with open(path) as f:
+        return json.load(f)
+
+
+def link_file(src, dst, mode) -> None:
+    if mode == "hardlink":
+        try:
+            os.link(src, dst)
+            return
+        except OSError:
+            # hardlinks can't cross drives, symlinks still avoid the copy
+            pass
+    os.symlink(src, dst)
+
+
+def materialize(manifest: dict, out_dir, mode="hardlink") -> str:
+    # builds the x_name folders of the manifest out of links, only ever removes folders it built itself
+    if os.path.exists(out_dir):
+        if not os.path.exists(os.path.join(out_dir, MARKER_FILE)):
+            raise FileExistsError(f"{out_dir} already exists and wasn't built by lora_subset, refusing to overwrite it")
+        shutil.rmtree(out_dir)
+    os.makedirs(out_dir)
+    with open(os.path.join(out_dir, MARKER_FILE), "w") as f:
+        f.write(manifest['source'])
+    for folder, files in manifest['folders'].items():
+        os.makedirs(os.path.join(out_dir, folder))
+        for pair in files:
+            for file in pair:
+                if file is None:
+                    continue
+                link_file(file, os.path.join(out_dir, folder, os.path.basename(file)), mode)
+    return out_dir
+
+
+def materialize_manifest(path, out_dir=None) -> str:
+    # used by the training scripts, links the subset next to the manifest and returns the folder to train on
+    if out_dir is None:
+        out_dir = os.path.splitext(path)[0]
+    return materialize(load_manifest(path), out_dir)
+
+
+if __name__ == "__main__":
+    main()
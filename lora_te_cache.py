@@ -0,0 +1,221 @@
+import argparse
+import hashlib
+import json
+import os
+import socket
+from contextlib import contextmanager
+
+import lora_common
+
+SHARD_ROWS = 4096  # captions per shard file
+INDEX_FLUSH = 1024  # new captions between index saves, so a crash loses little
+LOCK_FILE = "writer.lock"
+# options that change what the text encoder sees from one epoch to the next, so its outputs can't be reused
+UNCACHEABLE = {"shuffle_captions": "shuffles the tags of every caption",
+               "caption_dropout_rate": "drops whole captions",
+               "caption_dropout_every_n_epochs": "drops whole captions",
+               "caption_tag_dropout_rate": "drops tags from captions"}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Shows what's in a text encoder output cache made by te_cache_folder")
+    parser.add_argument("folder", type=str, help="the te_cache_folder")
+    args = parser.parse_args()
+    if not os.path.isdir(args.folder):
+        print(f"{args.folder} isn't a folder")
+        quit(1)
+    for model_key in sorted(os.listdir(args.folder)):
+        meta_path = os.path.join(args.folder, model_key, "meta.json")
+        if not os.path.exists(meta_path):
+            continue
+        with open(meta_path) as f:
+            meta = json.load(f)
+        size = sum(os.path.getsize(os.path.join(args.folder, model_key, file))
+                   for file in os.listdir(os.path.join(args.folder, model_key)))
+        print(f"{model_key}: {meta['rows']} captions, {meta['tokens']}x{meta['dim']} {meta['dtype']}, "
+              f"{size / 1024 ** 2:.1f} MB, base model {meta['base_model']}")
+
+
+def check_args(arg_dict: dict) -> list:
+    # the reasons the text encoder outputs of this config can't be cached, empty when they can
+    reasons = []
+    if not arg_dict['unet_only']:
+        reasons.append("unet_only isn't set, the text encoder is trained so its outputs change every step")
+    for field, reason in UNCACHEABLE.items():
+        if arg_dict[field]:
+            reasons.append(f"{field} {reason}")
+    return reasons
+
+
+def model_key(arg_dict: dict) -> str:
+    # everything besides the caption that changes the text encoder output
+    key = {"base_model": lora_common.file_fingerprint(arg_dict['base_model']), "v2": arg_dict['v2'],
+           "clip_skip": arg_dict['clip_skip'], "max_clip_token_length": arg_dict['max_clip_token_length'],
+           "mixed_precision": arg_dict['mixed_precision']}
+    return hashlib.sha256(json.dumps(key, sort_keys=True, default=str).encode()).hexdigest()[:lora_common.HASH_LENGTH]
+
+
+def acquire_lock(path) -> bool:
+    # the lock holds the host and pid of the writer, a lock left behind by a dead process on this machine is taken over
+    for _ in range(2):
+        try:
+            fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            try:
+                with open(path) as f:
+                    host, pid = f.read().split()
+                if host != socket.gethostname():
+                    return False
+                os.kill(int(pid), 0)
+                return False
+            except ProcessLookupError:
+                os.remove(path)
+                continue
+            except (OSError, ValueError):
+                return False
+        with os.fdopen(fd, "w") as f:
+            f.write(f"{socket.gethostname()} {os.getpid()}")
+        return True
+    return False
+
+
+class HiddenStateCache:
+    """
+    Text encoder outputs on disk, one row per tokenized caption, in shards of SHARD_ROWS rows that are memory mapped
+    with numpy so only the rows a batch needs get read. Rows are keyed by a hash of the token ids, which covers the
+    caption and max_clip_token_length. Only the process holding the writer lock adds rows, any other process sharing
+    the folder just reads.
+    """
+    def __init__(self, folder, key, base_model):
+        self.folder = os.path.join(folder, key)
+        self.base_model = base_model
+        self.index = {}
+        self.meta = None
+        self.shards = {}
+        self.unsaved = 0
+        os.makedirs(self.folder, exist_ok=True)
+        if os.path.exists(os.path.join(self.folder, "meta.json")):
+            with open(os.path.join(self.folder, "meta.json")) as f:
+                self.meta = json.load(f)
+            with open(os.path.join(self.folder, "index.json")) as f:
+                self.index = json.load(f)
+        self.writer = acquire_lock(os.path.join(self.folder, LOCK_FILE))
+        if not self.writer:
+            print(f"another training is writing to the text encoder cache in {self.folder}, only reading from it")
+
+    @staticmethod
+    def row_key(input_ids) -> str:
+        return hashlib.sha1(input_ids.cpu().numpy().tobytes()).hexdigest()
+
+    def shard(self, number):
+        import numpy as np
+        if number not in self.shards:
+            path = os.path.join(self.folder, f"shard-{number:05d}.npy")
+            if os.path.exists(path):
+                self.shards[number] = np.load(path, mmap_mode="r+" if self.writer else "r")
+            else:
+                self.shards[number] = np.lib.format.open_memmap(
+                    path, mode="w+", dtype=self.meta['storage'], shape=(SHARD_ROWS, self.meta['tokens'],
+                                                                       self.meta['dim']))
+        return self.shards[number]
+
+    def put(self, keys, hidden_states) -> None:
+        import torch
+        if not self.writer:
+            return
+        if self.meta is None:
+            # bf16 has no numpy type, its bits get stored as int16 and viewed back on the way out
+            dtype = str(hidden_states.dtype).replace("torch.", "")
+            self.meta = {"tokens": hidden_states.shape[1], "dim": hidden_states.shape[2], "dtype": dtype,
+                         "storage": "int16" if dtype == "bfloat16" else dtype, "rows": 0,
+                         "base_model": self.base_model}
+        values = hidden_states.detach().cpu()
+        if values.dtype == torch.bfloat16:
+            values = values.view(torch.int16)
+        values = values.numpy()
+        for key, value in zip(keys, values):
+            if key in self.index:
+                continue
+            row = self.meta['rows']
+            self.shard(row // SHARD_ROWS)[row % SHARD_ROWS] = value
+            self.index[key] = row
+            self.meta['rows'] += 1
+            self.unsaved += 1
+        if self.unsaved >= INDEX_FLUSH:
+            self.save()
+
+    def get(self, keys, device):
+        import numpy as np
+        import torch
+        rows = [self.index[key] for key in keys]
+        values = torch.from_numpy(np.stack([self.shard(row // SHARD_ROWS)[row % SHARD_ROWS] for row in rows]))
+        if self.meta['dtype'] == "bfloat16":
+            values = values.view(torch.bfloat16)
+        return values.to(device, non_blocking=True)
+
+    def save(self) -> None:
+        if not self.writer or self.meta is None:
+            return
+        for shard in self.shards.values():
+            shard.flush()
+        # the index goes last, so it never points at rows that aren't on disk yet
+        for name, data in (("meta.json", self.meta), ("index.json", self.index)):
+            path = os.path.join(self.folder, name)
+            with open(f"{path}.tmp", "w") as f:
+                json.dump(data, f)
+            os.replace(f"{path}.tmp", path)
+        self.unsaved = 0
+
+    def close(self) -> None:
+        self.save()
+        self.shards = {}
+        if self.writer:
+            os.remove(os.path.join(self.folder, LOCK_FILE))
+
+    def wrap(self, get_hidden_states):
+        # stands in for train_util.get_hidden_states, only captions that aren't cached yet go through the text encoder
+        def cached_get_hidden_states(args, input_ids, tokenizer, text_encoder, weight_dtype=None):
+            keys = [self.row_key(row) for row in input_ids]
+            missing = [i for i, key in enumerate(keys) if key not in self.index]
+            if missing:
+                hidden_states = get_hidden_states(args, input_ids[missing], tokenizer, text_encoder, weight_dtype)
+                if not self.writer:
+                    if len(missing) == len(keys):
+                        return hidden_states
+                    return self.merge(keys, missing, hidden_states, input_ids.device)
+                self.put([keys[i] for i in missing], hidden_states)
+            return self.get(keys, input_ids.device)
+        return cached_get_hidden_states
+
+    def merge(self, keys, missing, hidden_states, device):
+        # a reader that got a batch with some captions it can't add, the rest still comes from the cache
+        import torch
+        cached = [i for i in range(len(keys)) if i not in set(missing)]
+        merged = torch.empty((len(keys),) + tuple(hidden_states.shape[1:]), dtype=hidden_states.dtype, device=device)
+        merged[missing] = hidden_states.to(device)
+        merged[cached] = self.get([keys[i] for i in cached], device).to(hidden_states.dtype)
+        return merged
+
+
+@contextmanager
+def cache(arg_dict: dict):
+    # used by the training scripts around a training, does nothing unless te_cache_folder is set
+    if not arg_dict['te_cache_folder']:
+        yield
+        return
+    reasons = check_args(arg_dict)
+    if reasons:
+        raise ValueError("can't cache the text encoder outputs of this config:\n" + "\n".join(reasons))
+    import library.train_util as util
+    store = HiddenStateCache(arg_dict['te_cache_folder'], model_key(arg_dict), arg_dict['base_model'])
+    original = util.get_hidden_states
+    util.get_hidden_states = store.wrap(original)
+    try:
+        yield store
+    finally:
+        util.get_hidden_states = original
+        store.close()
+
+
+if __name__ == "__main__":
+    main()
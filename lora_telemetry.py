@@ -0,0 +1,114 @@
+import json
+import os
+import socket
+import sys
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:  # not available on windows
+    resource = None
+
+
+def peak_rss_bytes():
+    # peak resident memory of this process so far, None when it can't be read
+    if resource is not None:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # linux reports kilobytes, mac reports bytes
+        return peak if sys.platform == "darwin" else peak * 1024
+    try:
+        import psutil
+        return psutil.Process().memory_info().peak_wset
+    except (ImportError, AttributeError):
+        return None
+
+
+def reset_cuda_peak() -> None:
+    try:
+        import torch
+        if torch.cuda.is_available():
+            torch.cuda.reset_peak_memory_stats()
+    except ImportError:
+        pass
+
+
+def peak_cuda_bytes():
+    try:
+        import torch
+        if torch.cuda.is_available():
+            return torch.cuda.max_memory_allocated()
+    except ImportError:
+        pass
+    return None
+
+
+def count_steps(arg_dict: dict, find_max_steps=None):
+    if arg_dict.get('max_steps'):
+        return arg_dict['max_steps']
+    return find_max_steps(arg_dict) if find_max_steps else None
+
+
+class Telemetry:
+    # Appends one json object per line to path, does nothing when path is None so it can always be used
+    def __init__(self, path=None):
+        self.path = path
+        self.host = socket.gethostname()
+        self.lock = threading.Lock()
+        self.attempts = []  # when each try at training the current job started, OOM retries make more than one
+
+    def emit(self, event: str, **fields) -> None:
+        if not self.path:
+            return
+        record = {"event": event, "time": time.time(), "host": self.host, "pid": os.getpid()}
+        record.update(fields)
+        line = json.dumps(record, default=str) + "\n"
+        with self.lock:
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(line)
+
+    def attempt(self, train_fn):
+        # wraps train_fn so every try at training, retries included, gets its own start time
+        def run(args):
+            self.attempts.append(time.perf_counter())
+            return train_fn(args)
+        return run
+
+    @contextmanager
+    def job(self, arg_dict: dict, job_hash=None, steps=None, scan_time=None, find_max_steps=None):
+        """
+        Wraps the training of one job. job_hash is lora_common.config_hash of its config from before create_arg_space,
+        steps and scan_time are the step count and how long scanning the dataset for it took. OOM retries change
+        arg_dict in place, so the end of the job is reported with the time, batch size and step count of the attempt
+        that finished, counting the steps again with find_max_steps when a retry changed them.
+        """
+        if not self.path:
+            yield
+            return
+        job_id = uuid.uuid4().hex
+        common = {"job_id": job_id, "config_hash": job_hash,
+                  "output_name": arg_dict.get('change_output_name'), "img_folder": arg_dict.get('img_folder')}
+        self.emit("job_start", steps=steps, batch_size=arg_dict.get('batch_size'), scan_time=scan_time, **common)
+        reset_cuda_peak()
+        self.attempts = []
+        start = time.perf_counter()
+        try:
+            yield
+        except BaseException as e:
+            self.emit("job_failed", wall_time=time.perf_counter() - start, error=f"{type(e).__name__}: {e}",
+                      attempts=len(self.attempts), peak_rss=peak_rss_bytes(), peak_cuda=peak_cuda_bytes(), **common)
+            raise
+        end = time.perf_counter()
+        wall_time = end - (self.attempts[-1] if self.attempts else start)
+        if len(self.attempts) > 1:
+            steps = count_steps(arg_dict, find_max_steps)
+        steps_per_sec = steps / wall_time if steps and wall_time > 0 else None
+        # every step is an optimizer step, which sees gradient_acc_steps batches
+        images_per_step = arg_dict['batch_size'] * max(1, arg_dict.get('gradient_acc_steps') or 1)
+        self.emit("job_end", wall_time=wall_time, total_time=end - start, attempts=len(self.attempts), steps=steps,
+                  steps_per_sec=steps_per_sec,
+                  images_per_sec=steps_per_sec * images_per_step if steps_per_sec else None,
+                  batch_size=arg_dict['batch_size'], scan_time=scan_time, peak_rss=peak_rss_bytes(),
+                  peak_cuda=peak_cuda_bytes(), **common)
@@ -0,0 +1,173 @@
+import argparse
+import hashlib
+import json
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import lora_subset
+
+# the tokenizers sd-scripts loads for SD1 and SD2, both have a 77 token context, of which 75 are for the caption
+TOKENIZER_PATH = "openai/clip-vit-large-patch14"
+V2_TOKENIZER_PATH = "stabilityai/stable-diffusion-2"
+TOKEN_LENGTHS = [75, 150, 225]
+CACHE_FILE = ".token_lengths.json"
+BATCH_SIZE = 256
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Counts the CLIP tokens in every caption to pick max_clip_token_length")
+    parser.add_argument("--img_folder", type=str, required=True, help="the img folder, laid out as x_name folders")
+    parser.add_argument("--caption_extension", type=str, default=".txt")
+    parser.add_argument("--v2", action="store_true", help="uses the SD2 tokenizer")
+    parser.add_argument("--tokenizer", type=str, default=None,
+                        help="local folder of a saved CLIP tokenizer, to run without the huggingface cache")
+    parser.add_argument("--tolerance", type=float, default=0.0,
+                        help="share of steps allowed to train on a truncated caption when recommending a length")
+    parser.add_argument("--workers", type=int, default=max(1, (os.cpu_count() or 1) // 2))
+    parser.add_argument("--cache", type=str, default=None,
+                        help=f"json the token counts are cached in by caption hash, defaults to {CACHE_FILE} in "
+                             f"img_folder")
+    parser.add_argument("--json", type=str, default=None, help="also saves the report to this json file")
+    args = parser.parse_args()
+
+    captions = find_captions(args.img_folder, args.caption_extension)
+    if not captions:
+        print(f"no {args.caption_extension} captions found in {args.img_folder}")
+        quit(1)
+    tokenizer = args.tokenizer or (V2_TOKENIZER_PATH if args.v2 else TOKENIZER_PATH)
+    cache_path = args.cache or os.path.join(args.img_folder, CACHE_FILE)
+    try:
+        lengths = count_tokens([caption for caption, _ in captions], tokenizer, args.workers, cache_path)
+    except FileNotFoundError as e:
+        print(e)
+        quit(1)
+    report = build_report([(lengths[caption], repeats) for caption, repeats in captions], args.tolerance)
+    print_report(report)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=4)
+
+
+def find_captions(img_folder, caption_extension) -> list:
+    # (caption path, repeats of its folder) of every image with a caption
+    captions = []
+    for folder in sorted(os.listdir(img_folder)):
+        path = os.path.join(img_folder, folder)
+        if not os.path.isdir(path):
+            continue
+        try:
+            repeats = int(folder.split("_")[0])
+        except ValueError:
+            print(f"folder {folder} is not in the correct format. Format is x_name. skipping")
+            continue
+        files = set(os.listdir(path))
+        for file in sorted(files):
+            name, ext = os.path.splitext(file)
+            if ext[1:].lower() in lora_subset.IMG_EXTENSIONS and name + caption_extension in files:
+                captions.append((os.path.join(path, name + caption_extension), repeats))
+    return captions
+
+
+def load_tokenizer(tokenizer):
+    from transformers import CLIPTokenizerFast
+    kwargs = {"subfolder": "tokenizer"} if tokenizer == V2_TOKENIZER_PATH else {}
+    # sd-scripts loads the same tokenizer when training, so the copy it left in the huggingface cache is used first,
+    # that way an offline machine that has trained before never touches the hub
+    try:
+        return CLIPTokenizerFast.from_pretrained(tokenizer, local_files_only=True, **kwargs)
+    except (OSError, ValueError):
+        pass
+    try:
+        return CLIPTokenizerFast.from_pretrained(tokenizer, **kwargs)
+    except (OSError, ValueError) as e:
+        raise FileNotFoundError(f"no {tokenizer} tokenizer was found in the huggingface cache and it couldn't be "
+                                f"downloaded. train once with sd-scripts while online so it gets cached, or pass "
+                                f"--tokenizer with a folder holding its vocab.json and merges.txt") from e
+
+
+def init_worker(tokenizer) -> None:
+    global worker_tokenizer
+    worker_tokenizer = load_tokenizer(tokenizer)
+
+
+def tokenize_batch(texts) -> list:
+    # the caption without the start and end tokens, which is what max_clip_token_length counts
+    encoded = worker_tokenizer(texts, add_special_tokens=False, truncation=False)
+    return [len(ids) for ids in encoded['input_ids']]
+
+
+def count_tokens(paths, tokenizer, workers, cache_path) -> dict:
+    """
+    Token count of every caption file. Counts are cached by a hash of the caption, so only new or changed captions
+    get tokenized, in batches spread over a pool of processes.
+    """
+    cache = {}
+    if os.path.exists(cache_path):
+        with open(cache_path) as f:
+            cache = json.load(f).get(tokenizer, {})
+    hashes = {}
+    texts = {}
+    for path in paths:
+        with open(path, "rb") as f:
+            data = f.read()
+        digest = hashlib.sha1(data).hexdigest()
+        hashes[path] = digest
+        if digest not in cache:
+            texts[digest] = data.decode("utf-8", errors="replace").strip()
+    if texts:
+        # checked once here so a missing tokenizer is a clear error and not a broken pool
+        load_tokenizer(tokenizer)
+        print(f"tokenizing {len(texts)} new captions")
+        digests = list(texts)
+        batches = [digests[i:i + BATCH_SIZE] for i in range(0, len(digests), BATCH_SIZE)]
+        with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"),
+                                 initializer=init_worker, initargs=(tokenizer,)) as pool:
+            for batch, lengths in zip(batches, pool.map(tokenize_batch, [[texts[d] for d in b] for b in batches])):
+                cache.update(zip(batch, lengths))
+        stored = {}
+        if os.path.exists(cache_path):
+            with open(cache_path) as f:
+                stored = json.load(f)
+        stored[tokenizer] = {digest: cache[digest] for digest in set(hashes.values())}
+        with open(cache_path, "w") as f:
+            json.dump(stored, f)
+    return {path: cache[digest] for path, digest in hashes.items()}
+
+
+def build_report(lengths, tolerance) -> dict:
+    # lengths is (token count, repeats), repeats weigh each caption by how often it's trained on
+    total_steps = sum(repeats for _, repeats in lengths)
+    settings = {}
+    for setting in TOKEN_LENGTHS:
+        truncated = [(length, repeats) for length, repeats in lengths if length > setting]
+        settings[setting] = {"captions_truncated": len(truncated) / len(lengths),
+                             "steps_truncated": sum(repeats for _, repeats in truncated) / total_steps}
+    recommended = next((setting for setting in TOKEN_LENGTHS
+                        if settings[setting]['steps_truncated'] <= tolerance), TOKEN_LENGTHS[-1])
+    counts = sorted(length for length, _ in lengths)
+    histogram = {}
+    for length in counts:
+        start = length // 15 * 15
+        histogram[f"{start}-{start + 14}"] = histogram.get(f"{start}-{start + 14}", 0) + 1
+    return {"captions": len(counts), "percentiles": {p: counts[min(len(counts) - 1, len(counts) * p // 100)]
+                                                     for p in (50, 90, 99)},
+            "max": counts[-1], "histogram": histogram, "settings": settings, "recommended": recommended}
+
+
+def print_report(report) -> None:
+    print(f"{report['captions']} captions, median {report['percentiles'][50]} tokens, "
+          f"90th percentile {report['percentiles'][90]}, 99th percentile {report['percentiles'][99]}, "
+          f"longest {report['max']}")
+    most = max(report['histogram'].values())
+    for bucket, count in report['histogram'].items():
+        print(f"{bucket:>9} tokens | {'#' * max(1, round(40 * count / most)):<40} {count}")
+    print()
+    for setting, stats in report['settings'].items():
+        print(f"max_clip_token_length {setting}: {stats['captions_truncated']:.1%} of captions and "
+              f"{stats['steps_truncated']:.1%} of steps get truncated")
+    print(f"recommended max_clip_token_length: {report['recommended']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,181 @@
+import argparse
+import json
+import multiprocessing
+import os
+import struct
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+
+import lora_analyze
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Post-processes the LoRA in a folder as they get saved, run it next "
+                                                 "to a training or set watch_outputs in the training scripts")
+    parser.add_argument("folder", type=str, help="the output_folder of the training")
+    parser.add_argument("--ranks", type=int, nargs="*", default=[], help="ranks to resize every LoRA to")
+    parser.add_argument("--save_precision", type=str, default="fp16", choices=["float", "fp16", "bf16"])
+    parser.add_argument("--workers", type=int, default=2, help="number of processes doing the post-processing")
+    parser.add_argument("--interval", type=float, default=5, help="seconds between checks of the folder")
+    parser.add_argument("--existing", action="store_true", help="also processes the LoRA already in the folder")
+    args = parser.parse_args()
+    watcher = OutputWatcher(args.folder, args.ranks, args.save_precision, args.workers, args.interval,
+                            ignore_existing=not args.existing)
+    watcher.start()
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        watcher.stop()
+
+
+def is_complete(path) -> bool:
+    # a safetensors file is done being written when its size matches the 8 byte header size, the json header, and
+    # the end of the last tensor the header lists, which is much cheaper than loading it
+    try:
+        size = os.path.getsize(path)
+        with open(path, "rb") as f:
+            header_size = struct.unpack("<Q", f.read(8))[0]
+            if 8 + header_size > size:
+                return False
+            header = json.loads(f.read(header_size))
+    except (OSError, ValueError, struct.error):
+        return False
+    end = max((info["data_offsets"][1] for key, info in header.items() if key != "__metadata__"), default=0)
+    return size == 8 + header_size + end
+
+
+def write_stats(path) -> str:
+    stats = lora_analyze.lora_stats(path)
+    stats_path = os.path.splitext(path)[0] + ".stats.json"
+    with open(stats_path, "w") as f:
+        json.dump(stats, f, indent=4)
+    summary = stats["summary"]
+    if not summary["modules"]:
+        return f"{stats['file']}: no LoRA modules found"
+    return f"{stats['file']}: {summary['modules']} modules, mean norm {summary['mean_norm']:.4f}, " \
+           f"mean effective rank {summary['mean_effective_rank']:.2f}"
+
+
+def resize_to(path, rank, save_precision, out_dir) -> str:
+    import networks.resize_lora as resize
+    save_to = os.path.join(out_dir, f"{os.path.splitext(os.path.basename(path))[0]}-rank{rank}.safetensors")
+    args = argparse.Namespace(save_precision=save_precision, new_rank=rank, save_to=save_to, model=path,
+                              device="cpu", verbose=False, dynamic_method=None, dynamic_param=None)
+    resize.args = args
+    resize.resize(args)
+    return f"resized {os.path.basename(path)} to rank {rank}"
+
+
+def lower_priority(threads) -> None:
+    # the pool shares the machine with the training, so it stays out of the way of the data loader
+    if hasattr(os, "nice"):
+        os.nice(10)
+    import torch
+    torch.set_num_threads(threads)
+
+
+class OutputWatcher:
+    """
+    Polls a folder for new .safetensors files, and once one is complete and its size stopped changing, hands its
+    stats and resizes to a pool of processes. stop() picks up whatever got saved last and waits for the pool.
+    """
+    def __init__(self, folder, ranks=None, save_precision="fp16", workers=2, interval=5.0, ignore_existing=True):
+        self.folder = folder
+        self.ranks = ranks if ranks else []
+        self.save_precision = save_precision
+        self.interval = interval
+        self.seen = set()
+        self.sizes = {}
+        self.pending = []
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.thread = None
+        if ignore_existing and os.path.isdir(folder):
+            self.seen = {self.signature(file) for file in os.listdir(folder) if file.endswith(".safetensors")}
+        threads = max(1, (os.cpu_count() or 1) // (2 * max(1, workers)))
+        self.pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"),
+                                        initializer=lower_priority, initargs=(threads,))
+
+    def start(self) -> None:
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def run(self) -> None:
+        while not self.stopped.wait(self.interval):
+            self.check()
+
+    def signature(self, file) -> tuple:
+        # a file saved again under the same name, like the last epoch being overwritten, gets processed again
+        stat = os.stat(os.path.join(self.folder, file))
+        return file, stat.st_size, stat.st_mtime_ns
+
+    def check(self, final=False) -> None:
+        if not os.path.isdir(self.folder):
+            return
+        for file in sorted(os.listdir(self.folder)):
+            if not file.endswith(".safetensors"):
+                continue
+            try:
+                signature = self.signature(file)
+            except OSError:
+                continue
+            if signature in self.seen:
+                continue
+            # the file has to hold still for one interval, unless training is over and nothing is writing anymore
+            stable = final or self.sizes.get(file) == signature
+            self.sizes[file] = signature
+            path = os.path.join(self.folder, file)
+            if stable and is_complete(path):
+                self.seen.add(signature)
+                self.submit(path)
+
+    def submit(self, path) -> None:
+        tasks = [self.pool.submit(write_stats, path)]
+        if self.ranks:
+            out_dir = os.path.join(self.folder, "resized")
+            os.makedirs(out_dir, exist_ok=True)
+            tasks += [self.pool.submit(resize_to, path, rank, self.save_precision, out_dir) for rank in self.ranks]
+        for task in tasks:
+            task.add_done_callback(self.report)
+        with self.lock:
+            self.pending += tasks
+
+    @staticmethod
+    def report(task) -> None:
+        if task.exception() is not None:
+            print(f"post-processing failed: {task.exception()}")
+        else:
+            print(task.result())
+
+    def stop(self) -> None:
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+        self.check(final=True)
+        with self.lock:
+            remaining = sum(1 for task in self.pending if not task.done())
+        if remaining:
+            print(f"waiting for {remaining} post-processing tasks to finish")
+        self.pool.shutdown(wait=True)
+
+
+@contextmanager
+def watch(arg_dict: dict):
+    # used by the training scripts around a training, does nothing unless watch_outputs is set
+    if not arg_dict['watch_outputs']:
+        yield
+        return
+    watcher = OutputWatcher(arg_dict['output_folder'], arg_dict['watch_resize_ranks'], arg_dict['save_precision'],
+                            arg_dict['watch_workers'])
+    watcher.start()
+    try:
+        yield
+    finally:
+        watcher.stop()
+
+
+if __name__ == "__main__":
+    main()